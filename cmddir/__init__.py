@@ -2,16 +2,27 @@ from __future__ import annotations
 
 import os
 import sys
+import threading
+from collections import deque
 
-from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Sequence
 
 from pydantic import BaseModel as PydanticBaseModel
 
+from cmddir.bundle import bundle, is_bundle, load_bundle
 from cmddir.cmds import Command, SubMenu
+from cmddir.env import attach_env, subtree
+from cmddir.completion import regenerate, write_tables
+from cmddir.federate import federated_menus
+from cmddir.macro import record, replay
+from cmddir.paths import CmdPaths, wrap_command
+from cmddir.pipeline import Pipeline, attach_pipelines
+from cmddir.stream import export_ndjson, iter_tree
+from cmddir.tree import FlatTree
 from cmddir.types import BashScript, PythonScript, PathLike
-from cmddir.utils import to_ansi_art
+from cmddir.watch import watch_tree
 
 
 class BaseModel(PydanticBaseModel):
@@ -23,96 +34,10 @@ class BaseModel(PydanticBaseModel):
         extra = "forbid"
 
 
-@dataclass(init=False)
-class CmdPaths:
-    """
-    os.walk transformer -> SubMenu
-    """
-
-    cmd_path_stem: str
-    root: str
-    root_stem: str
-    dirs: List[str] = field(default_factory=list)
-    fullpaths: List[Path] = field(default_factory=list)
-
-    @staticmethod
-    def create(
-        cmd_path_stem: str, root: str, dirs: List[str], files: List[str]
-    ) -> CmdPaths:
-        root_path = Path(root)
-        assert root_path.exists()
-        paths = CmdPaths()
-        paths.root = root
-        paths.cmd_path_stem = cmd_path_stem
-        paths.root_stem = root_path.stem
-        paths.dirs = []
-        for d in dirs:
-            CmdPaths.add_init(root_path / d)
-            if CmdPaths.path_to_ignore(d):
-                paths.dirs.append(d)
-        paths.fullpaths = [
-            (root_path / f).resolve()
-            for f in files
-            if not CmdPaths.path_to_ignore(f) and CmdPaths.file_to_include(f)
-        ]
-        return paths
-
-    @staticmethod
-    def path_to_ignore(path: PathLike) -> bool:
-        invalid_contains = ["__pycache__", "__init__.py"]
-        return any([x in str(path) for x in invalid_contains])
-
-    @staticmethod
-    def file_to_include(path: PathLike) -> bool:
-        path = Path(path)
-        include_suffixes = [".py", ".sh", ".json"]
-        return path.suffix in include_suffixes
-
-    @staticmethod
-    def add_init(dir_path: PathLike):
-        dir_path = Path(dir_path)
-        assert dir_path.exists() and dir_path.is_dir()
-        init_path = dir_path / "__init__.py"
-        if not init_path.exists():
-            with open(init_path, "w") as f:
-                f.write("")
-
-    def create_menu(self, *args, **kwargs) -> SubMenu:
-        cmds = []
-        other_cmds = None
-        for path in self.fullpaths:
-            assert path.exists()
-            path_struct = str(path).split(os.sep)
-            path_struct = path_struct[path_struct.index(self.cmd_path_stem) + 1 :]
-            name = path.stem
-            cmd = Command(name=name, orig_name=name, shortcuts=[name[0]])
-            add_cmd = True
-            match Path(path_struct[-1]).suffix:
-                case ".py":
-                    cmd.fn = PythonScript(path_struct, *args, **kwargs)
-                case ".sh":
-                    cmd.fn = BashScript(path, *args, **kwargs)
-                case ".json":
-                    other_cmds = SubMenu.from_json(path)
-                    add_cmd = False
-            if add_cmd:
-                cmds.append(cmd)
-        c = SubMenu(
-            name=self.root_stem, 
-            orig_name=self.root_stem, 
-            cmds=cmds,
-            title=to_ansi_art(self.root_stem),
-            shortcuts=[self.root_stem[0]]
-        )
-        if other_cmds:
-            c.update(other_cmds)
-        return c
-
-
 def add_modules(root: Path, modules: PathLike | List[PathLike] = None):
     root = Path(root)
     assert root.exists()
-    if not isinstance(modules, list):
+    if modules and not isinstance(modules, list):
         modules = [Path(modules)]
     if modules:
         for m in modules:
@@ -129,9 +54,62 @@ def append_module(path: PathLike):
         sys.path.append(str(path.resolve()))
 
 
+class LazyLoader:
+    """
+    Loads a SubMenu placeholder the first time it is entered/looked up
+
+    Only that one directory is scanned, its sub directories become
+    placeholders themselves. With prefetch those children are loaded
+    one level ahead on a background thread
+    """
+
+    def __init__(self, cmd_root: PathLike, prefetch: bool = False):
+        self.cmd_root = cmd_root
+        self.lock = threading.RLock()
+        self.pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+
+    def __call__(self, menu: SubMenu):
+        self.expand(menu)
+        self.prefetch(menu)
+
+    def prefetch(self, menu: SubMenu):
+        """
+        Loader of a prefetched SubMenu, entering it prefetches its
+        children in turn such that loading keeps one level ahead
+        """
+        menu.loader = None
+        if self.pool:
+            for child in menu.children:
+                self.pool.submit(self.expand, child, True)
+
+    def expand(self, menu: SubMenu, prefetched: bool = False):
+        with self.lock:
+            if menu.loader is not self:
+                return
+            paths = CmdPaths.scan(self.cmd_root, menu.path)
+            loaded = paths.create_menu()
+            loaded.children = [
+                SubMenu.placeholder(Path(menu.path) / d, self, menu.level + 1)
+                for d in sorted(paths.dirs)
+            ]
+            for child in loaded.children:
+                child.parent = menu
+            menu.absorb(loaded)
+            menu.loader = self.prefetch if prefetched else None
+            attach_pipelines([menu])
+            attach_env([menu])
+
+
 def cmd_tree_builder(
-    cmd_path: PathLike, modules: PathLike | List[PathLike] = None, *args, **kwargs
-) -> List[SubMenu]:
+    cmd_path: PathLike | List[PathLike],
+    modules: PathLike | List[PathLike] = None,
+    *,
+    lazy: bool = False,
+    prefetch: bool = False,
+    completion: Optional[str] = None,
+    watch: bool = False,
+    stream: bool = False,
+) -> Sequence[SubMenu]:
     """
     Build a SubMenu from a directory path
 
@@ -143,41 +121,106 @@ def cmd_tree_builder(
     such that inside the tree's subfolders if a python
     file exists it can reference the root as a module
 
-    The first item in the List[SubMenu] will always be the root of the tree
+    The first item of the returned SubMenus will always be the root of the tree.
+    Built eagerly the directories are scanned up front but each
+    SubMenu is only created once it is indexed, iterated over or
+    entered: what comes back is a read only FlatMenus rather than a
+    list (a list with watch or several roots, see below). Until then
+    a child within .children is a placeholder, its .load() (or any
+    lookup on it) fills it in. Errors of a directory (e.g. an invalid
+    config.json) are raised when its SubMenu is first created, not
+    by cmd_tree_builder; list(tree) creates them all at once
+
+    :lazy Only the root is built, every child SubMenu is a placeholder
+    that is scanned the first time it is entered (see SubMenu.load)
+    and the returned list only holds the root
+    :prefetch With lazy, load children one level ahead in the background
+
+    cmd_path may also be a list of roots e.g. [team, host, personal]
+    which are built concurrently, each from a cache of its own, and
+    overlaid in that order: a SubMenu/Command at the same path in a
+    later root extends/replaces the earlier one (see cmddir.federate)
+
+    :completion Name of the program, its shell completion tables are
+    rewritten in the background whenever the tree changed, with watch
+    also after every change on disk (see cmddir.completion). Not with lazy
+    :watch Keep the tree in step with changes on disk from a
+    background thread (see cmddir.watch). Single root only, not with lazy
+    :stream Return as soon as the root is scanned, the rest of the
+    tree is scanned (see iter_tree) and linked in from a background
+    thread. The returned list only holds the root, completion/watch
+    start once the whole tree is in
+
+    cmd_path may also be a bundle made by cmddir.bundle, the tree
+    then comes out of the bundle as is without scanning anything
+
+    An .env file in any directory sets variables for the scripts of
+    that SubMenu and of every SubMenu below it (see cmddir.env)
     """
 
+    if isinstance(cmd_path, list):
+        assert not lazy and not watch, "lazy/watch take a single root"
+        for path in cmd_path:
+            add_modules(path, modules)
+        tree_list = federated_menus(cmd_path)
+        attach_pipelines(tree_list)
+        attach_env(tree_list)
+        if completion:
+            regenerate(completion, tree_list)
+        return tree_list
+
+    if is_bundle(cmd_path):
+        assert not lazy and not watch and not stream, "a bundle is loaded as a whole"
+        tree, libs = load_bundle(cmd_path)
+        if modules and not isinstance(modules, list):
+            modules = [modules]
+        add_modules(tree.cmd_root, libs + (modules or []))
+        # SubMenus are created as they are used, pipelines/.env along with them
+        tree_list = tree.menus()
+        if completion:
+            regenerate(completion, tree_list)
+        return tree_list
+
     cmd_path = Path(cmd_path)
 
     add_modules(cmd_path, modules)
 
-    trees = {}
-    tree_list = []
-    for root, dirs, files in os.walk(cmd_path):
-        if CmdPaths.path_to_ignore(root):
-            continue
-        print(root, dirs, files)
-        # os.walk will duplicate paths so let's not do that
-        parts = root.split(os.sep)
-        parts_from_stem: List[str] = parts[parts.index(cmd_path.stem):]
-        path: str = os.sep.join(parts_from_stem)
-        if path not in trees:
-            cmds: SubMenu = CmdPaths.create(cmd_path.stem, root, dirs, files).create_menu()
-            trees[path] = cmds
-
-    # For every tree find the children and parent
-    for tree_root, curr_tree in trees.items():
-        p = Path(tree_root)
-        parent = str(p.parent) 
-        parent_tree = trees[parent] if parent != '.' else None
-        if parent_tree:
-            parent_tree.children.append(curr_tree)
-        curr_tree.parent = parent_tree
-        curr_tree.level = len(tree_root.split(os.sep))
-        tree_list.append(curr_tree)
-    tree_list = sorted(tree_list, key=lambda t: t.level)
+    if stream:
+        menus = iter_tree(cmd_path)
+        root = next(menus)
+
+        def drain():
+            # A zero length deque just drains the generator
+            deque(menus, 0)
+            keep_current(subtree(root), completion, watch)
+
+        threading.Thread(target=drain, name="cmddir-stream", daemon=True).start()
+        return [root]
+
+    if lazy:
+        assert not completion and not watch, "a lazy tree is never complete, no completion/watch"
+        root = SubMenu.placeholder(cmd_path, LazyLoader(cmd_path, prefetch))
+        return [root.load()]
+
+    # SubMenus are created as they are used, pipelines/.env along with them
+    tree_list = FlatTree.build(cmd_path).menus()
+    if watch:
+        # A list the watcher keeps to the SubMenus of the tree
+        tree_list = list(tree_list)
+    keep_current(tree_list, completion, watch)
     return tree_list
 
 
+def keep_current(tree_list: List[SubMenu], completion: Optional[str], watch: bool):
+    """Completion tables of a single root tree, rewritten on every change watch picks up"""
+    if completion:
+        regenerate(completion, tree_list)
+    if watch:
+        root = tree_list[0]
+        on_update = (lambda _: write_tables(completion, subtree(root))) if completion else None
+        watch_tree(tree_list, on_update=on_update)
+
+
 
 # trees = cmd_tree_builder("test/subdir/test_cmds", "test/helpers")
 # print(trees)
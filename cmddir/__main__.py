@@ -0,0 +1,81 @@
+"""
+python -m cmddir <operation>
+"""
+import argparse
+import sys
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from cmddir import cmd_tree_builder
+from cmddir.bundle import bundle
+from cmddir.completion import SHELLS, completion_script, write_tables
+from cmddir.macro import replay
+from cmddir.stream import export_ndjson
+from cmddir.trace import print_trace_report
+from cmddir.validate import print_validation
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="cmddir")
+    ops = parser.add_subparsers(dest="op", required=True)
+
+    report = ops.add_parser("report", help="p50/p95 latency per command from a trace log")
+    report.add_argument("log", nargs="?", help="defaults to $CMDDIR_TRACE_LOG")
+
+    validate = ops.add_parser("validate", help="check every script and config of a tree")
+    validate.add_argument("root")
+    validate.add_argument("files", nargs="*", help="only these, e.g. from a pre-commit hook")
+    validate.add_argument("-j", "--workers", type=int, default=None)
+
+    completion = ops.add_parser(
+        "completion", help="write the completion tables of a tree and print the hook for a shell"
+    )
+    completion.add_argument("shell", choices=SHELLS)
+    completion.add_argument("prog", help="name the tree's program is run by")
+    completion.add_argument("roots", nargs="+")
+
+    export = ops.add_parser("export", help="the tree as one json line per SubMenu")
+    export.add_argument("root")
+
+    play = ops.add_parser("replay", help="run the recorded macros of a file against a tree")
+    play.add_argument("macros", help="file of macros, one json line each (see $CMDDIR_RECORD)")
+    play.add_argument("roots", nargs="+")
+    play.add_argument("-j", "--workers", type=int, default=1, help="steps of a macro run at once")
+    play.add_argument("-n", "--name", action="append", help="only the macro(s) of this name")
+
+    pack = ops.add_parser("bundle", help="pack a tree into one runnable zip with its bytecode")
+    pack.add_argument("root")
+    pack.add_argument("-m", "--modules", action="append", help="modules directory the tree imports from")
+    pack.add_argument("-o", "--out", help="defaults to <root>.pyz")
+
+    args = parser.parse_args(argv)
+    match args.op:
+        case "report":
+            print_trace_report(args.log)
+        case "validate":
+            return 1 if print_validation(args.root, args.files, args.workers) else 0
+        case "export":
+            out = sys.stdout
+            # Anything the scan prints goes to stderr, stdout is the export only
+            with redirect_stdout(sys.stderr):
+                export_ndjson(args.root, out)
+        case "completion":
+            roots = args.roots if len(args.roots) > 1 else args.roots[0]
+            # stdout is the hook only
+            with redirect_stdout(sys.stderr):
+                write_tables(args.prog, cmd_tree_builder(roots))
+            print(completion_script(args.prog, args.shell), end="")
+        case "bundle":
+            out = args.out or f"{Path(args.root).resolve().name}.pyz"
+            with redirect_stdout(sys.stderr):
+                bundle(args.root, out, args.modules)
+            print(out)
+        case "replay":
+            roots = args.roots if len(args.roots) > 1 else args.roots[0]
+            macros = replay(cmd_tree_builder(roots)[0], args.macros, args.workers, args.name)
+            return 0 if all(m.ok for m in macros) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
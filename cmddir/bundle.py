@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import json
+import os
+import pickle
+import py_compile
+import shutil
+import sys
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from cmddir.cache import CACHE_DIR
+from cmddir.tree import FlatTree
+from cmddir.types import PathLike
+
+BUNDLE_DIR = CACHE_DIR / "bundles"
+MANIFEST = "bundle.json"
+TREE = "tree.pickle"
+SHEBANG = b"#!/usr/bin/env python3\n"
+MAIN = """\
+import sys
+from cmddir.bundle import run_bundle
+sys.exit(run_bundle(sys.argv[0], sys.argv[1:]))
+"""
+
+
+class BundleError(Exception):
+    def __init__(self, msg: str):
+        self.message = f"Invalid bundle. {msg}"
+        super().__init__(self.message)
+
+
+def _files(top: Path) -> List[Tuple[Path, str]]:
+    """(path, path relative to top) of everything below top but bytecode"""
+    files = []
+    for root, dirs, names in os.walk(top):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(names):
+            if not name.endswith(".pyc"):
+                path = Path(root) / name
+                files.append((path, path.relative_to(top).as_posix()))
+    return files
+
+
+def _pyc(path: Path, name: str, tmp: Path) -> bytes:
+    """
+    Bytecode of path, unchecked such that the target never stats
+    or hashes the source to see if it is stale
+    """
+    cfile = tmp / "out.pyc"
+    py_compile.compile(
+        str(path),
+        cfile=str(cfile),
+        dfile=name,
+        doraise=True,
+        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+    )
+    return cfile.read_bytes()
+
+
+def bundle(
+    cmd_root: PathLike,
+    out: PathLike,
+    modules: PathLike | List[PathLike] = None,
+    workers: int = 8,
+) -> Path:
+    """
+    Pack a Command Structure into a single runnable zip
+
+    root/ the Command Structure, every .py along with its bytecode
+    lib<n>/ each of the modules directories, likewise
+    cmddir/ this package as bytecode only, imported straight from the zip
+    tree.pickle the FlatTree of the root (names, headers of every script)
+    bundle.json the digest of it all and the python it was compiled for
+
+    python tree.pyz [path/to/command] runs it, cmd_tree_builder("tree.pyz")
+    loads it (see load_bundle)
+    """
+    cmd_root = Path(cmd_root).resolve()
+    if modules and not isinstance(modules, list):
+        modules = [modules]
+    dirs = [("root", cmd_root)] + [(f"lib{i}", Path(m).resolve()) for i, m in enumerate(modules or [])]
+    out = Path(out)
+    # The scan adds any missing __init__.py, before the files are listed
+    tree = FlatTree.build(cmd_root, workers)
+    tree.cmd_root = Path("root")
+    digest = hashlib.sha256()
+    tmp_out = out.with_suffix(f".{os.getpid()}.tmp")
+    with tempfile.TemporaryDirectory() as tmp, open(tmp_out, "wb") as f:
+        f.write(SHEBANG)
+        with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as zf:
+
+            def add(name: str, data: bytes, mode: int = 0o644):
+                digest.update(f"{name} {mode:o}".encode() + b"\0" + hashlib.sha256(data).digest())
+                info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = mode << 16
+                zf.writestr(info, data)
+
+            for prefix, top in dirs:
+                for path, rel in _files(top):
+                    # Executables stay executable, see ExecRunner
+                    add(f"{prefix}/{rel}", path.read_bytes(), path.stat().st_mode & 0o777)
+                    if path.suffix == ".py":
+                        add(f"{prefix}/{importlib.util.cache_from_source(rel)}", _pyc(path, rel, Path(tmp)))
+            package = Path(__file__).parent
+            for path, rel in _files(package):
+                if path.suffix == ".py":
+                    add(f"cmddir/{rel[:-3]}.pyc", _pyc(path, f"cmddir/{rel}", Path(tmp)))
+            add(TREE, pickle.dumps(tree))
+            manifest = {
+                "digest": digest.hexdigest(),
+                "magic": importlib.util.MAGIC_NUMBER.hex(),
+                "modules": [prefix for prefix, _ in dirs[1:]],
+            }
+            zf.writestr(MANIFEST, json.dumps(manifest))
+            zf.writestr("__main__.py", MAIN)
+    tmp_out.chmod(0o755)
+    os.replace(tmp_out, out)
+    return out
+
+
+def _extract(zf: zipfile.ZipFile, manifest: dict, bundle_dir: Path) -> Path:
+    """
+    root/ and lib<n>/ unpacked once per digest, every later start
+    finds them in place. Unpacked next to the final directory and
+    renamed into it such that a half unpacked bundle is never used
+    """
+    target = bundle_dir / manifest["digest"]
+    if target.exists():
+        return target
+    bundle_dir.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=bundle_dir, prefix=".extract-"))
+    prefixes = tuple(f"{p}/" for p in ["root", *manifest["modules"]])
+    for info in zf.infolist():
+        if info.filename.startswith(prefixes):
+            zf.extract(info, tmp)
+            mode = info.external_attr >> 16
+            if mode:
+                os.chmod(tmp / info.filename, mode)
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        # Another process got there first
+        shutil.rmtree(tmp, ignore_errors=True)
+    return target
+
+
+def load_bundle(path: PathLike, bundle_dir: PathLike = BUNDLE_DIR) -> Tuple[FlatTree, List[Path]]:
+    """
+    The FlatTree of a bundle and the modules directories to import
+    from. Nothing is scanned, the tree comes out of the bundle as it
+    was when it was built
+    """
+    with zipfile.ZipFile(path) as zf:
+        try:
+            manifest = json.loads(zf.read(MANIFEST))
+        except KeyError:
+            raise BundleError(f"{path} has no {MANIFEST}")
+        if manifest["magic"] != importlib.util.MAGIC_NUMBER.hex():
+            raise BundleError(f"{path} was compiled for another version of python")
+        target = _extract(zf, manifest, Path(bundle_dir))
+        tree: FlatTree = pickle.loads(zf.read(TREE))
+    tree.cmd_root = target / "root"
+    return tree, [target / m for m in manifest["modules"]]
+
+
+def is_bundle(path: PathLike) -> bool:
+    return Path(path).is_file() and zipfile.is_zipfile(path)
+
+
+def run_bundle(path: PathLike, argv: Optional[List[str]] = None) -> int:
+    """
+    Entry point of a bundle run directly:
+        python tree.pyz             prompts at the root
+        python tree.pyz sub/script  runs it without prompting
+    """
+    from cmddir import cmd_tree_builder
+    from cmddir.cmds import COutput, SubMenu, cli
+    from cmddir.types import BashOut
+
+    root = cmd_tree_builder(path)[0]
+    argv = argv or []
+    parts = [p for p in argv[0].split("/") if p] if argv else []
+    found = root.lookup(parts)
+    if found is None:
+        print(f"{argv[0]} not found", file=sys.stderr)
+        return 1
+    if isinstance(found, SubMenu):
+        menu, skips = found, argv[1:]
+    else:
+        menu, skips = root.lookup(parts[:-1]), [parts[-1]] + argv[1:]
+
+    @cli(cmds=menu)
+    def main(out: COutput):
+        return out.run()
+
+    results = main(out=COutput(skips=skips))
+    returncode = 0
+    for result in results if isinstance(results, list) else [results]:
+        if isinstance(result, BashOut):
+            sys.stdout.write(str(result.stdout))
+            sys.stderr.write(str(result.stderr))
+            returncode = returncode or result.returncode
+        elif result is not None:
+            print(result)
+    return returncode
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cmddir.types import K, PathLike
+
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "cmddir"
+
+
+def script_key(fn: Callable, env: Optional[Dict[str, str]] = None) -> str:
+    """
+    Hash of the script file, the args/kwargs bound to it and
+    the given env such that a changed script is never served
+    a stale result
+    """
+    h = hashlib.sha256()
+    h.update(Path(fn.path).read_bytes())
+    h.update(repr(fn.args).encode())
+    h.update(repr(sorted(fn.kwargs.items())).encode())
+    for k, v in sorted((env or {}).items()):
+        h.update(f"{k}={v}".encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Two tier cache of command results
+
+    memory: LRU bounded by max_items
+    disk: one pickle per key under path, bounded by max_bytes
+    where the least recently used files are evicted first
+
+    Entries expire after the ttl they were put with
+
+    Unpickling runs code, so the disk tier is only read when the
+    directory and the file are owned by this user and writable by
+    no one else. The directory is created 0o700, files 0o600
+    """
+
+    def __init__(
+        self,
+        path: PathLike = CACHE_DIR / "results",
+        max_items: int = 128,
+        max_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.path = Path(path)
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.memory: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # Another process (see Matrix) starts with an empty memory tier
+        return {k: v for k, v in vars(self).items() if k not in ["memory", "lock"]}
+
+    def __setstate__(self, state: dict):
+        vars(self).update(state)
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[bool, Optional[K]]:
+        with self.lock:
+            if key in self.memory:
+                expires, value = self.memory[key]
+                if expires > time.time():
+                    self.memory.move_to_end(key)
+                    return True, value
+                del self.memory[key]
+        file = self.path / f"{key}.pickle"
+        try:
+            expires, value = load_pickle(file)
+        except (OSError, pickle.PickleError, EOFError):
+            return False, None
+        if expires <= time.time():
+            file.unlink(missing_ok=True)
+            return False, None
+        os.utime(file)
+        self._remember(key, expires, value)
+        return True, value
+
+    def put(self, key: str, value: K, ttl: int):
+        expires = time.time() + ttl
+        self._remember(key, expires, value)
+        if getattr(value, "spilled", False):
+            # Output large enough to go to disk isn't copied into a pickle
+            return
+        try:
+            data = pickle.dumps((expires, value))
+        except (pickle.PickleError, TypeError, AttributeError):
+            # Not everything a script returns survives a pickle, keep it in memory only
+            return
+        write_private(self.path / f"{key}.pickle", data)
+        self.evict()
+
+    def invalidate(self, key: str):
+        with self.lock:
+            self.memory.pop(key, None)
+        (self.path / f"{key}.pickle").unlink(missing_ok=True)
+
+    def evict(self):
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".pickle"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            Path(path).unlink(missing_ok=True)
+            total -= size
+
+    def _remember(self, key: str, expires: float, value: K):
+        with self.lock:
+            self.memory[key] = (expires, value)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_items:
+                self.memory.popitem(last=False)
+
+
+def _owned(stat: os.stat_result) -> bool:
+    """Owned by this user and writable by no one else"""
+    if not hasattr(os, "getuid"):
+        # Windows, no uid/mode to go by
+        return True
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+
+def load_pickle(file: Path) -> Any:
+    """
+    Unpickle file, only if it and its directory are owned by this
+    user and writable by no one else (PermissionError otherwise).
+    A symlink is never followed
+    """
+    if not _owned(os.stat(file.parent)):
+        raise PermissionError(f"{file.parent} is not owned by this user")
+    fd = os.open(file, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+    with open(fd, "rb") as f:
+        if not _owned(os.fstat(f.fileno())):
+            raise PermissionError(f"{file} is not owned by this user")
+        return pickle.load(f)
+
+
+def write_private(file: Path, data: bytes):
+    """Atomically write data to file, 0o600 within a 0o700 directory"""
+    file.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    # An existing directory keeps whatever mode it had otherwise
+    file.parent.chmod(0o700)
+    tmp = file.with_name(f"{file.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, file)
+
+
+_default_cache: Optional[ResultCache] = None
+
+
+def default_cache() -> ResultCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResultCache()
+    return _default_cache
+
+
+class CachedScript(Callable):
+    """
+    Memoize a PythonScript/BashScript
+
+    Opt in per Command within config.json:
+        {"orig_name": "report", "cache": true, "cache_ttl": 600, "cache_env": ["USER"]}
+
+    cache_env lists the environment variables the result depends on.
+    Args of a call are added to the ones bound to the script (see
+    with_args) and so make up a key of their own
+    """
+
+    def __init__(
+        self,
+        fn: Callable,
+        ttl: int = 300,
+        env: Optional[List[str]] = None,
+        cache: Optional[ResultCache] = None,
+    ):
+        self.fn = fn
+        self.ttl = ttl
+        self.env = env or []
+        self.cache = cache or default_cache()
+        self.refresh = False
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # Sent to a process pool by a Matrix in process mode
+        return {k: v for k, v in vars(self).items() if k != "lock"}
+
+    def __setstate__(self, state: dict):
+        vars(self).update(state)
+        self.lock = threading.Lock()
+
+    def key(self, fn: Optional[Callable] = None) -> str:
+        fn = fn or self.fn
+        # The script's own variables where it has them (see cmddir.env)
+        env = getattr(fn, "env", None) or {}
+        return script_key(fn, {k: env.get(k, os.environ.get(k, "")) for k in self.env})
+
+    def bound(self, *args, **kwargs) -> Callable:
+        """The script with args/kwargs of a call added to its own, they are part of the key"""
+        if not args and not kwargs:
+            return self.fn
+        return self.fn.with_args(*self.fn.args, *args, **{**self.fn.kwargs, **kwargs})
+
+    def refresh_next(self):
+        """Ignore and replace the cached result on the next call"""
+        with self.lock:
+            self.refresh = True
+
+    async def acall(self, *args, bypass: bool = False, **kwargs) -> Optional[K]:
+        return await asyncio.to_thread(self, *args, bypass=bypass, **kwargs)
+
+    def __call__(self, *args, bypass: bool = False, **kwargs) -> Optional[K]:
+        fn = self.bound(*args, **kwargs)
+        if bypass:
+            return fn()
+        key = self.key(fn)
+        # Only the one call right after refresh_next skips the cache
+        with self.lock:
+            refresh, self.refresh = self.refresh, False
+        if not refresh:
+            hit, value = self.cache.get(key)
+            if hit:
+                return value
+        value = fn()
+        self.cache.put(key, value, self.ttl)
+        return value
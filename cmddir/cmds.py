@@ -1,20 +1,44 @@
 from __future__ import annotations
 
+import inspect
+import json
+import os
+import shutil
 import sys
-from dataclasses import field
+import time
+from contextlib import contextmanager
+from dataclasses import field, fields
 from enum import Enum
 from pathlib import Path
-from typing import Callable, List, Optional, TypeAlias, Tuple
+from typing import Any, Callable, Dict, List, Optional, TypeAlias, Tuple
 
 from box import Box
 from bullet import Bullet, Check, keyhandler
-from bullet.charDef import NEWLINE_KEY
+from bullet.charDef import ARROW_DOWN_KEY, ARROW_UP_KEY, NEWLINE_KEY
 from pydantic.dataclasses import dataclass
 
-from cmddir.types import Bg, Fg, K
+from cmddir.keyfeed import run_prompt
+from cmddir.preimport import preimporter
+from cmddir.types import Bg, Fg, K, PathLike
 from cmddir.utils import clear_screen, getjson, notify, style
 
+try:
+    import resource
+    from resource import RUSAGE_CHILDREN, RUSAGE_SELF
+except ImportError:
+    # Windows, no resource accounting beyond wall time
+    resource = None
+    RUSAGE_CHILDREN = RUSAGE_SELF = 0
+
 VIM_SHORTCUTS = ["j", "k"]
+# Pressed instead of a shortcut/enter to modify how the highlighted Command runs
+REFRESH_KEY = "!"
+# Send the highlighted Command to the background / open the jobs panel (see cmddir.jobs)
+BACKGROUND_KEY = "&"
+JOBS_KEY = "%"
+RESERVED_SHORTCUTS = VIM_SHORTCUTS + [REFRESH_KEY, BACKGROUND_KEY, JOBS_KEY]
+# Lines of the terminal kept free around a windowed menu (see cmddir.window)
+WINDOW_MARGIN = 4
 
 
 class HotkeyError(Exception):
@@ -32,6 +56,19 @@ class Command:
     fn: Optional[Callable] = None
     custom_shortcuts: List[str]= field(default_factory=list)
     aliases: List[str] = field(default_factory=list)
+    cache: bool = False
+    cache_ttl: int = 300
+    cache_env: List[str] = field(default_factory=list)
+    matrix: Optional[str | List[Any]] = None
+    matrix_workers: int = 4
+    matrix_mode: str = "thread"
+    fail_fast: bool = False
+    coproc: str = ""
+    preimport: bool = False
+    priority: int = 0
+    depends_on: List[str] = field(default_factory=list)
+    dag_workers: int = 4
+    runner: str = ""
 
     def __post_init__(self):
         """
@@ -46,13 +83,27 @@ class Command:
             for k in self.shortcuts:
                 if len(k) > 1:
                     raise HotkeyError(self.name, k)
-                # Disallow j,k so we can use vim keys
-                if k in VIM_SHORTCUTS:
+                # Disallow j,k so we can use vim keys and the modifier keys
+                if k in RESERVED_SHORTCUTS:
                     raise HotkeyError(self.name, k)
 
     def update(self, other: Command):
         self.name = other.name or self.name
         self.desc = other.desc or self.desc
+        self.aliases = other.aliases or self.aliases
+        self.cache = other.cache or self.cache
+        self.cache_ttl = other.cache_ttl or self.cache_ttl
+        self.cache_env = other.cache_env or self.cache_env
+        self.matrix = other.matrix or self.matrix
+        self.matrix_workers = other.matrix_workers or self.matrix_workers
+        self.matrix_mode = other.matrix_mode or self.matrix_mode
+        self.fail_fast = other.fail_fast or self.fail_fast
+        self.coproc = other.coproc or self.coproc
+        self.preimport = other.preimport or self.preimport
+        self.priority = other.priority or self.priority
+        self.depends_on = other.depends_on or self.depends_on
+        self.dag_workers = other.dag_workers or self.dag_workers
+        self.runner = other.runner or self.runner
         if other.shortcuts:
             self.shortcuts += other.shortcuts 
             self.custom_shortcuts = other.shortcuts
@@ -126,6 +177,13 @@ class SubMenu:
     fn: Optional[Callable] = None
     parent: Optional[SubMenu] = None
     children: List[SubMenu] = field(default_factory=list)
+    pipelines: Dict[str, List[str]] = field(default_factory=dict)
+    modifier: Optional[str] = None
+    path: Optional[str] = None
+    loader: Optional[Callable] = None
+    windowed: Optional[bool] = None
+    # Variables of the .env files from the root down to here (see cmddir.env)
+    env: Dict[str, str] = field(default_factory=dict)
 
     @staticmethod
     def from_json(j: str | Path | str) -> SubMenu:
@@ -133,11 +191,52 @@ class SubMenu:
         if not isinstance(data, dict):
             data = getjson(data)
         subcmds: List[Command] = data.get("cmds") or []
-        if subcmds:
-            subcmds = [Command(**x) for x in subcmds]
-            data["cmds"] = subcmds
+        data["cmds"] = [Command(**x) for x in subcmds]
         return SubMenu(**data)
 
+    @staticmethod
+    def placeholder(path: PathLike, loader: Callable, level: int = 1) -> SubMenu:
+        """
+        Stand-in for a SubMenu whose directory has not been scanned
+        yet, see SubMenu.load
+        """
+        stem = Path(path).stem
+        return SubMenu(
+            cmds=[],
+            name=stem,
+            orig_name=stem,
+            shortcuts=[stem[0]],
+            path=str(path),
+            loader=loader,
+            level=level,
+        )
+
+    def load(self) -> SubMenu:
+        """
+        Expand a placeholder in place the first time it is needed
+        """
+        if self.loader:
+            self.loader(self)
+        return self
+
+    def absorb(self, other: SubMenu):
+        """
+        Take over everything the loaded other has, except for
+        where this SubMenu sits within the tree
+
+        All fields change in a single update of the instance dict, a
+        prompt reading this SubMenu on another thread sees either all
+        of the old or all of the new (see cmddir.watch)
+        """
+        taken = {f.name: getattr(other, f.name) for f in fields(other)}
+        for name in ["parent", "level", "path", "loader"]:
+            del taken[name]
+        vars(self).update(taken)
+        for cmd in self.cmds:
+            # A Dag resolves depends_on from where its SubMenu sits in the tree
+            if getattr(cmd.fn, "menu", None) is other:
+                cmd.fn.menu = self
+
     def update(self, other: SubMenu):
         self.name = other.name or self.name
         self.msg = other.msg or self.msg
@@ -149,68 +248,91 @@ class SubMenu:
         self.check = other.check or other.check
         self.shortcuts += other.shortcuts
         self.custom_shortcuts = other.shortcuts
-        for cmd in self.cmds:
-            for o_cmd in other.cmds:
-                if o_cmd.orig_name == cmd.orig_name:
-                    cmd.update(o_cmd)
-                else:
-                    print("Found invalid command in config")
+        self.pipelines.update(other.pipelines)
+        self.windowed = other.windowed if other.windowed is not None else self.windowed
+        names = [cmd.orig_name for cmd in self.cmds]
+        for o_cmd in other.cmds:
+            if o_cmd.orig_name in names:
+                self.cmds[names.index(o_cmd.orig_name)].update(o_cmd)
+            else:
+                print(f"Found invalid command in config: {o_cmd.orig_name}")
 
     def resolve_shortcut_conflicts(self):
-        while conflicts := self.conflicting_commands():
-            self.bump_shortcut_conflicts(conflicts)
-
-    def conflicting_commands(self) -> List[Tuple[Command, List[str], int]]:
-        conflicting = []
+        """
+        Bump every clashing shortcut to the next free key in a single
+        pass, Commands/SubMenus with custom shortcuts claim theirs first
+        """
+        self.load()
         shortcuty_things = self.cmds + self.children
-        for cmd in shortcuty_things:
-            for other_cmd in shortcuty_things:
-                if cmd == other_cmd:
-                    continue
-                print(f"Current_CMD: {cmd.name} {cmd.shortcuts}")
-                print(f"Other_CMD: {other_cmd.name} {other_cmd.shortcuts}")
-                bad_shortcuts = list(set(cmd.shortcuts).intersection(set(other_cmd.shortcuts)))
-                num_custom_bad = list(set(bad_shortcuts).intersection(set(cmd.custom_shortcuts)))
-                if bad_shortcuts:
-                    conflicting.append((cmd, bad_shortcuts, num_custom_bad))
-                continue
-        conflicting = sorted(conflicting, key=lambda c: c[2])
-        return conflicting
-
-    def bump_shortcut_conflicts(self, conflicting: List[Tuple[Command, List[str], int]]):
-        updated_shortcuts = []
-        for cmd, bad_shortcuts, _ in conflicting:
-            for s in bad_shortcuts:
-                if s not in updated_shortcuts:
-                    updated_shortcuts.append(s)
-                    next_char = chr(ord(s) + 1)
-                    cmd.shortcuts[cmd.shortcuts.index(s)] = next_char
+        for thing, shortcuts in zip(shortcuty_things, resolved_shortcuts(shortcuty_things)):
+            thing.shortcuts[:] = shortcuts
 
-    def prompt(self) -> Command | List[Command]:
-        max_align = MaxAlign(
+    def max_align(self) -> MaxAlign:
+        return MaxAlign(
             aliases=max([len(cmd.hotkey_str()) for cmd in self.cmds]),
             name=max([len(cmd.name) for cmd in self.cmds]),
             desc=max([len(cmd.desc) for cmd in self.cmds]),
         )
+
+    def prompt(self) -> Command | List[Command]:
+        self.load()
+        max_align = self.max_align()
         match self.type:
             case CommandsType.Dropdown:
                 return self.dropdown(max_align)
-            case CommandsType.Selectable():
+            case CommandsType.Selectable:
                 return self.selection(max_align)
             case _:
                 raise NotImplementedError()
 
+    async def aprompt(self) -> Command | List[Command]:
+        """
+        Awaitable prompt, the event loop reads the keys and keeps
+        running other tasks meanwhile. Cancelling it takes the prompt
+        down along with its thread (see cmddir.keyfeed.run_prompt)
+        """
+        return await run_prompt(self.prompt)
+
+    async def adropdown(self, max_align: MaxAlign) -> Command:
+        return await run_prompt(self.dropdown, max_align)
+
+    async def aselection(self, max_align: Optional[MaxAlign]) -> List[Command]:
+        return await run_prompt(self.selection, max_align)
+
     def order_hotkeys(self):
         """Order by shortcuts"""
         self.cmds = sorted(self.cmds, key=lambda cmd: cmd.shortcuts)
 
+    def highlight(self, pos: int):
+        """
+        The dropdown cursor moved onto self.cmds[pos], use the idle
+        time to import it (see cmddir.preimport)
+        """
+        if 0 <= pos < len(self.cmds):
+            preimporter().warm(self, self.cmds[pos])
+
     def all_shortcuts(self) -> List[str]:
+        self.load()
         return [key for cmd in self.cmds for key in cmd.shortcuts]
 
+    def use_window(self) -> bool:
+        """
+        windowed from config.json, or else whenever the Commands
+        won't fit the terminal (see cmddir.window)
+        """
+        if self.windowed is not None:
+            return self.windowed
+        return len(self.cmds) > shutil.get_terminal_size().lines - WINDOW_MARGIN
+
     def dropdown(self, max_align: MaxAlign) -> Command:
         notify(self.msg, self.msg_col)
+        self.modifier = None
         if self.ordered_hotkeys:
             self.order_hotkeys()
+        if self.use_window():
+            from cmddir.window import WindowedMenu
+
+            return WindowedMenu(self, max_align).launch()
         CBullet = generate_bullet(self)
         _cli = CBullet(
             prompt="",
@@ -227,6 +349,7 @@ class SubMenu:
             background_on_switch=Bg.default,
             pad_right=5,
         )
+        self.highlight(0)
         matcher = _cli.launch()
         matcher = Command.str_to_cmdname(matcher)
         chosen = self.find_command(matcher)
@@ -235,6 +358,10 @@ class SubMenu:
 
     def selection(self, max_align: Optional[MaxAlign]) -> List[Command]:
         notify(self.msg, self.msg_col)
+        if self.use_window():
+            from cmddir.window import WindowedMenu
+
+            return WindowedMenu(self, max_align, multi=True).launch()
         _cli = MinMaxCheck(
             prompt="",
             indent=self.indent_by * self.level,
@@ -262,13 +389,69 @@ class SubMenu:
     def find_command(self, matcher: Optional[str]) -> Optional[Command]:
         if not matcher:
             return None
+        self.load()
         chosen = [cmd for cmd in self.cmds if cmd.match(matcher)]
         assert len(chosen) <= 1
         return chosen[0] if chosen else None
 
     def find_commands(self, matcher: str) -> List[Command]:
+        self.load()
         return [cmd for cmd in self.cmds if cmd.match(matcher)]
 
+    def find_child(self, matcher: Optional[str]) -> Optional[SubMenu]:
+        if not matcher:
+            return None
+        self.load()
+        for child in self.children:
+            if matcher in [child.name, child.orig_name] + child.shortcuts:
+                return child
+        return None
+
+    def tree_path(self) -> List[str]:
+        """Names from the root of the tree down to this SubMenu"""
+        names = []
+        menu = self
+        while menu:
+            names.append(menu.name)
+            menu = menu.parent
+        return names[::-1]
+
+    def lookup(self, path: str | List[str]) -> Optional[Command | SubMenu]:
+        """
+        Resolve a "/" seperated path relative to this SubMenu
+
+        Every part but the last must name a child SubMenu, the
+        last may name either a Command or a child SubMenu
+        e.g. "subcmd1/script"
+        """
+        parts = [x for x in path.split("/") if x] if isinstance(path, str) else path
+        if not parts:
+            return self
+        match parts:
+            case [m]:
+                return self.find_command(m) or self.find_child(m)
+            case [m, *ms]:
+                child = self.find_child(m)
+                return child.lookup(ms) if child else None
+
+
+def resolved_shortcuts(shortcuty_things: List[Command | SubMenu]) -> List[List[str]]:
+    """
+    The shortcuts each of shortcuty_things ends up with once the
+    clashes are bumped (see SubMenu.resolve_shortcut_conflicts),
+    worked out on copies without changing any of them
+    """
+    resolved: List[List[str]] = [[] for _ in shortcuty_things]
+    taken = set()
+    # Stable, so otherwise the order they are in
+    for idx in sorted(range(len(shortcuty_things)), key=lambda i: not shortcuty_things[i].custom_shortcuts):
+        for s in shortcuty_things[idx].shortcuts:
+            while s in taken or s in RESERVED_SHORTCUTS:
+                s = chr(ord(s) + 1)
+            resolved[idx].append(s)
+            taken.add(s)
+    return resolved
+
 
 def generate_bullet(cmds: SubMenu):
     """
@@ -282,19 +465,43 @@ def generate_bullet(cmds: SubMenu):
     via Bullet.
 
     """
-    handlers = {"cmds": cmds}
+    # A dict of its own: the keyhandler metaclass otherwise registers
+    # into the one inherited from Bullet, changing every plain Bullet
+    handlers = {"cmds": cmds, "_key_handler": dict(Bullet._key_handler)}
     # Vim Key Bindings for Menu
 
+    @keyhandler.register(ARROW_UP_KEY)
     @keyhandler.register(ord("k"))
     def moveUp(self):
         self.moveUp()
+        self.cmds.highlight(self.pos)
 
+    @keyhandler.register(ARROW_DOWN_KEY)
     @keyhandler.register(ord("j"))
     def moveDown(self):
         self.moveDown()
+        self.cmds.highlight(self.pos)
+
+    @keyhandler.register(ord(REFRESH_KEY))
+    def refresh(self):
+        self.cmds.modifier = REFRESH_KEY
+        return self.accept()
+
+    @keyhandler.register(ord(BACKGROUND_KEY))
+    def background(self):
+        self.cmds.modifier = BACKGROUND_KEY
+        return self.accept()
+
+    @keyhandler.register(ord(JOBS_KEY))
+    def jobs(self):
+        self.cmds.modifier = JOBS_KEY
+        return self.accept()
 
     handlers["_moveUp"] = moveUp
     handlers["_moveDown"] = moveDown
+    handlers["_refresh"] = refresh
+    handlers["_background"] = background
+    handlers["_jobs"] = jobs
 
     def register_key_handler(key):
         @keyhandler.register(ord(key))
@@ -400,44 +607,24 @@ def cli(cmds: SubMenu):
     overlap with the previous call we want to pop the kwargs
     You will need to retrieve the args supplied from out.args
 
-    trace: T
-    This is a trace of what the chosens were previously
-    We also want to keep a trace of the args passed to each SubMenu
-    layer in order for us to trace what's going on
+    traces: List[Trace]
+    Running the chosen Command via out.run() records a Trace of
+    its wall time, cpu, memory, exit status and output size
+
+    Whilst prompting, & sends the highlighted Command to the
+    background and % opens the jobs panel (see cmddir.jobs)
+
+    With $CMDDIR_RECORD set every choice of the session is recorded
+    as a macro that can be replayed, with the args out.run() (or
+    dispatch) is given (see cmddir.macro)
     """
 
     def decorator(func: Callable):
         def wrapper(*args, **kwargs):
-            clear_screen()
-            if cmds.title:
-                print(style(cmds.title, cmds.title_col))
-            try:
-                out: COutput = kwargs.pop("out")
-            except:
-                skips = sys.argv[1:] if len(sys.argv) > 1 else []
-                out: COutput = COutput(skips=skips)
-            skips: List[str] = out.skips
-            matcher: Optional[str] = None
-            rest: List[str] = []
-            chosen: Optional[C] = None
-            match skips:
-                case [m, *ms]:
-                    matcher = m
-                    rest = ms
-                case [m]:
-                    matcher = m
-            chosen = cmds.find_command(matcher)
-            out.skips = rest
+            out, chosen = _resolve_skips(cmds, kwargs)
             if not chosen:
-                chosen = cmds.prompt()
-            out.chosen = chosen
-            a = {}
-            kwargs_keys = [k for k in kwargs.keys()]
-            for k in kwargs_keys:
-                a[k] = kwargs.pop(k)
-            out.args = a
-            out.args = Box(a)
-            clear_screen()
+                chosen = _prompt(cmds)
+            _choose(cmds, out, chosen, kwargs)
             return func(out=out, *args, **kwargs)
 
         return wrapper
@@ -445,21 +632,258 @@ def cli(cmds: SubMenu):
     return decorator
 
 
+def acli(cmds: SubMenu):
+    """
+    async variant of @cli(cmds)
+
+    @acli(cmds=cmds)
+    async def my_method(some_param, other_param, out):
+        pass
+
+    Prompting is awaited (see SubMenu.aprompt) such that other
+    tasks on the event loop keep running whilst the menu is up.
+    The decorated method may be a coroutine or a plain function
+    """
+
+    def decorator(func: Callable):
+        async def wrapper(*args, **kwargs):
+            out, chosen = _resolve_skips(cmds, kwargs)
+            if not chosen:
+                chosen = await run_prompt(_prompt, cmds)
+            _choose(cmds, out, chosen, kwargs)
+            result = func(out=out, *args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _resolve_skips(cmds: SubMenu, kwargs: dict) -> Tuple[COutput, Optional[C]]:
+    """
+    Shared by cli/acli: find the chosen Command from the skips
+    without prompting
+    """
+    clear_screen()
+    if cmds.title:
+        print(style(cmds.title, cmds.title_col))
+    try:
+        out: COutput = kwargs.pop("out")
+    except:
+        skips = sys.argv[1:] if len(sys.argv) > 1 else []
+        out: COutput = COutput(skips=skips)
+    skips: List[str] = out.skips
+    matcher: Optional[str] = None
+    rest: List[str] = []
+    match skips:
+        case [m, *ms]:
+            matcher = m
+            rest = ms
+        case [m]:
+            matcher = m
+    cmds.modifier = None
+    if matcher and len(matcher) > 1 and matcher[0] == REFRESH_KEY:
+        # e.g. "!d" runs d ignoring any cached result
+        cmds.modifier, matcher = REFRESH_KEY, matcher[1:]
+    out.skips = rest
+    return out, cmds.find_command(matcher)
+
+
+def _prompt(cmds: SubMenu) -> C:
+    """
+    Prompt until a Command is chosen to run in the foreground,
+    BACKGROUND_KEY sends the highlighted one to the job queue and
+    JOBS_KEY opens the jobs panel, both then prompt again
+    """
+    from cmddir.jobs import job_queue
+
+    while True:
+        chosen = cmds.prompt()
+        if cmds.modifier == BACKGROUND_KEY:
+            for cmd in chosen if isinstance(chosen, list) else [chosen]:
+                job = job_queue().submit(cmd, cmds)
+                notify(f"[{job.id}] {job.name} sent to the background, {JOBS_KEY} for jobs")
+        elif cmds.modifier == JOBS_KEY:
+            job_queue().panel()
+            clear_screen()
+        else:
+            return chosen
+
+
+def _choose(cmds: SubMenu, out: COutput, chosen: C, kwargs: dict):
+    from cmddir.macro import record_choice
+
+    if cmds.modifier == REFRESH_KEY and hasattr(chosen.fn, "refresh_next"):
+        chosen.fn.refresh_next()
+    out.chosen = chosen
+    out.menu = cmds
+    a = {}
+    kwargs_keys = [k for k in kwargs.keys()]
+    for k in kwargs_keys:
+        a[k] = kwargs.pop(k)
+    out.args = a
+    out.args = Box(a)
+    record_choice(out)
+    clear_screen()
+
+
 C: TypeAlias = Command | List[Command]
+Args: TypeAlias = Box[str, K]
+
+
+@dataclass
+class Trace:
+    """
+    What running a chosen Command cost, see dispatch
+
+    name: path of the Command within the tree e.g. "ok/subcmd1/script"
+    cpu_user/cpu_sys: seconds, of the bash process for a BashScript
+    otherwise of this process (and any children waited on meanwhile)
+    max_rss: KiB, peak of the bash process or of this process so far
+    max_rss_scope: "command" where max_rss is the bash process's own,
+    "process" where it is the peak of this whole process (and its
+    children) over its lifetime, not something the Command alone used
+    returncode: 130 when interrupted (ctrl-c)
+    """
+
+    name: str
+    fn: Optional[Callable] = None
+    args: Optional[Args] = None
+    out: Optional[Any] = None
+    start: float = 0.0
+    wall: float = 0.0
+    cpu_user: float = 0.0
+    cpu_sys: float = 0.0
+    max_rss: int = 0
+    max_rss_scope: str = ""
+    returncode: Optional[int] = None
+    output_size: int = 0
+    error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        d = {f.name: getattr(self, f.name) for f in fields(self)}
+        for k in ["fn", "out"]:
+            d.pop(k)
+        d["args"] = self.args.to_dict() if isinstance(self.args, Box) else dict(self.args or {})
+        return d
 
 
 @dataclass
 class COutput:
     chosen: Optional[C] = None
     skips: List[str] = field(default_factory=list)
+    menu: Optional[SubMenu] = None
+    traces: List[Trace] = field(default_factory=list)
+    recorded: Optional[Any] = None
 
+    def run(self, *args, **kwargs) -> Optional[K]:
+        """Run the chosen Command(s), see dispatch"""
+        chosen = self.chosen if isinstance(self.chosen, list) else [self.chosen]
+        results = [dispatch(self.menu, cmd, self, *args, **kwargs) for cmd in chosen]
+        return results if isinstance(self.chosen, list) else results[0]
 
-Args: TypeAlias = Box[str, K]
+    async def arun(self, *args, **kwargs) -> Optional[K]:
+        chosen = self.chosen if isinstance(self.chosen, list) else [self.chosen]
+        results = [await adispatch(self.menu, cmd, self, *args, **kwargs) for cmd in chosen]
+        return results if isinstance(self.chosen, list) else results[0]
 
 
-@dataclass
-class Trace:
-    name: str
-    fn: Callable
-    args: Args
-    out: COutput
+def dispatch(menu: Optional[SubMenu], cmd: Command, out: Optional[COutput] = None, *args, **kwargs) -> Optional[K]:
+    """
+    Run cmd.fn recording a Trace of it onto out.traces
+
+    With $CMDDIR_TRACE_LOG set every Trace is also appended
+    to that file as a line of json (see cmddir.trace)
+
+    cmd.fn runs on the executor of the runner it came from
+    (see cmddir.runners)
+
+    With $CMDDIR_RECORD set the run is a step of the session's
+    macro (see cmddir.macro)
+    """
+    from cmddir.macro import recording
+    from cmddir.runners import call
+
+    with recording(menu, cmd, out, args, kwargs), traced(menu, cmd, out, args, kwargs) as trace:
+        result = trace.result = call(cmd, *args, **kwargs)
+    return result
+
+
+async def adispatch(menu: Optional[SubMenu], cmd: Command, out: Optional[COutput] = None, *args, **kwargs) -> Optional[K]:
+    """dispatch awaited, slots of the runner are taken just the same (see Runner.acall)"""
+    from cmddir.macro import recording
+    from cmddir.runners import acall
+
+    with recording(menu, cmd, out, args, kwargs), traced(menu, cmd, out, args, kwargs) as trace:
+        result = trace.result = await acall(cmd, *args, **kwargs)
+    return result
+
+
+@contextmanager
+def traced(menu: Optional[SubMenu], cmd: Command, out: Optional[COutput], args: tuple, kwargs: dict):
+    name = "/".join((menu.tree_path() if menu else []) + [cmd.name])
+    trace = Trace(name=name, fn=cmd.fn, args=Box({"args": list(args), **kwargs}), out=out)
+    trace.result = None
+    before_self = _rusage(RUSAGE_SELF)
+    before_children = _rusage(RUSAGE_CHILDREN)
+    trace.start = time.time()
+    start = time.perf_counter()
+    try:
+        yield trace
+    except BaseException as e:
+        trace.error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        if isinstance(e, KeyboardInterrupt):
+            trace.returncode = 130
+        elif isinstance(e, SystemExit):
+            trace.returncode = e.code if isinstance(e.code, int) else 1
+        else:
+            trace.returncode = 1
+        raise
+    finally:
+        trace.wall = time.perf_counter() - start
+        result = trace.result
+        usage = getattr(result, "rusage", None)
+        if usage:
+            trace.cpu_user, trace.cpu_sys = usage.ru_utime, usage.ru_stime
+            trace.max_rss = usage.ru_maxrss
+            trace.max_rss_scope = "command"
+        elif resource:
+            after_self = _rusage(RUSAGE_SELF)
+            after_children = _rusage(RUSAGE_CHILDREN)
+            trace.cpu_user = (after_self.ru_utime - before_self.ru_utime) + (
+                after_children.ru_utime - before_children.ru_utime
+            )
+            trace.cpu_sys = (after_self.ru_stime - before_self.ru_stime) + (
+                after_children.ru_stime - before_children.ru_stime
+            )
+            trace.max_rss = max(after_self.ru_maxrss, after_children.ru_maxrss)
+            trace.max_rss_scope = "process"
+        if trace.returncode is None:
+            trace.returncode = getattr(result, "returncode", 0)
+        trace.output_size = _output_size(result)
+        # Don't keep the output alive through out.traces
+        trace.result = None
+        if out is not None:
+            out.traces.append(trace)
+        if os.environ.get("CMDDIR_TRACE_LOG"):
+            with open(os.environ["CMDDIR_TRACE_LOG"], "a") as f:
+                f.write(json.dumps(trace.to_dict(), default=str) + "\n")
+
+
+def _rusage(who: int):
+    return resource.getrusage(who) if resource else None
+
+
+def _output_size(result) -> int:
+    spool = getattr(result, "stdout_spool", None)
+    if spool is not None:
+        # Sized without decoding it (see BashOut)
+        return len(spool) + len(getattr(result, "stderr_spool", None) or b"")
+    stdout = getattr(result, "stdout", None)
+    if stdout is not None:
+        return len(stdout) + len(getattr(result, "stderr", None) or "")
+    if isinstance(result, (str, bytes)):
+        return len(result)
+    return 0
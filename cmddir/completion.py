@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+from shlex import quote
+from typing import Dict, List, Sequence, Tuple
+
+from cmddir.cache import CACHE_DIR
+from cmddir.cmds import SubMenu, resolved_shortcuts
+from cmddir.tree import FlatMenus
+from cmddir.types import PathLike
+
+COMPLETION_DIR = CACHE_DIR / "completion"
+SHELLS = ["bash", "zsh", "fish"]
+# Table entry of a Command, nothing follows it
+LEAF = -1
+
+
+def completion_tables(menus: Sequence[SubMenu]) -> List[Tuple[List[str], Dict[str, int]]]:
+    """
+    Per SubMenu (by index within menus, the root first):
+    the words offered and word -> index of the SubMenu it leads to,
+    or LEAF for a Command
+
+    Names and aliases are offered, shortcuts are only followed. The
+    shortcuts are the ones left once the conflicts of each SubMenu
+    are resolved, such that a shortcut leads to the one entry the
+    prompt shows it on
+
+    Runs in the background of a tree that is in use, so nothing of
+    it is changed or loaded: shortcuts are resolved on copies and the
+    SubMenus of a FlatMenus that weren't created yet are read as
+    unlinked views (see FlatTree.view), their .env files aren't run
+    """
+    if isinstance(menus, FlatMenus):
+        tree = menus.tree
+        views = [tree.view(node) for node in range(len(tree))]
+        outline = [(views[node], [(views[c], c) for c in tree.children(node)]) for node in range(len(tree))]
+    else:
+        ids = {id(menu): idx for idx, menu in enumerate(menus)}
+        outline = [
+            # A child that isn't among menus still takes its shortcuts
+            (menu, [(child, ids.get(id(child))) for child in menu.children])
+            for menu in menus
+        ]
+    tables = []
+    for menu, children in outline:
+        shortcuts = resolved_shortcuts(menu.cmds + [child for child, _ in children])
+        words: List[str] = []
+        follow: Dict[str, int] = {}
+        for cmd, cmd_shortcuts in zip(menu.cmds, shortcuts):
+            words += [cmd.name, *cmd.aliases]
+            for w in [cmd.name, *cmd.aliases, *cmd_shortcuts]:
+                follow.setdefault(w, LEAF)
+        for (child, idx), child_shortcuts in zip(children, shortcuts[len(menu.cmds) :]):
+            if idx is None:
+                continue
+            words.append(child.name)
+            for w in [child.name, child.orig_name, *child_shortcuts]:
+                follow.setdefault(w, idx)
+        tables.append((words, follow))
+    return tables
+
+
+def _var(prog: str) -> str:
+    return "_cmddir_" + re.sub(r"\W", "_", prog)
+
+
+def bash_tables(prog: str, tables) -> str:
+    """Also sourced by zsh, both take the same assoc array syntax"""
+    v = _var(prog)
+    lines = [f"typeset -gA {v}_w {v}_n", f"{v}_w=("]
+    lines += [f"  [{state}]={quote(' '.join(words))}" for state, (words, _) in enumerate(tables)]
+    lines += [")", f"{v}_n=("]
+    lines += [
+        f"  [{quote(f'{state}/{word}')}]={nxt}"
+        for state, (_, follow) in enumerate(tables)
+        for word, nxt in follow.items()
+    ]
+    lines.append(")")
+    return "\n".join(lines) + "\n"
+
+
+def fish_tables(prog: str, tables) -> str:
+    v = _var(prog)
+    lines = []
+    for state, (words, follow) in enumerate(tables):
+        lines.append(f"set -g {v}_w{state} -- {' '.join(map(quote, words))}")
+        lines.append(f"set -g {v}_k{state} -- {' '.join(map(quote, follow))}")
+        lines.append(f"set -g {v}_v{state} -- {' '.join(map(str, follow.values()))}")
+    return "\n".join(lines) + "\n"
+
+
+def table_path(prog: str, shell: str, directory: PathLike = COMPLETION_DIR) -> Path:
+    name = re.sub(r"[^\w.-]", "_", prog)
+    return Path(directory) / f"{name}.{shell}"
+
+
+def write_tables(prog: str, menus: Sequence[SubMenu], directory: PathLike = COMPLETION_DIR) -> bool:
+    """
+    Write the tables of every shell, only where they changed.
+    Next to each is a .gen file with the hash of its content which
+    the shell checks on every Tab to pick up new tables
+    """
+    tables = completion_tables(menus)
+    changed = False
+    for shell in SHELLS:
+        data = fish_tables(prog, tables) if shell == "fish" else bash_tables(prog, tables)
+        gen = hashlib.sha1(data.encode()).hexdigest()
+        path = table_path(prog, shell, directory)
+        gen_path = path.with_name(path.name + ".gen")
+        try:
+            if gen_path.read_text().strip() == gen:
+                continue
+        except OSError:
+            pass
+        path.parent.mkdir(parents=True, exist_ok=True)
+        for p, content in [(path, data), (gen_path, gen + "\n")]:
+            tmp = p.with_name(f"{p.name}.{os.getpid()}.tmp")
+            tmp.write_text(content)
+            os.replace(tmp, p)
+        changed = True
+    return changed
+
+
+def regenerate(prog: str, menus: Sequence[SubMenu], directory: PathLike = COMPLETION_DIR) -> threading.Thread:
+    """
+    write_tables in the background, see cmd_tree_builder(completion=prog).
+    Not a daemon such that the tables are complete before exiting
+    """
+    thread = threading.Thread(target=write_tables, args=(prog, menus, directory), name="cmddir-completion")
+    thread.start()
+    return thread
+
+
+def completion_script(prog: str, shell: str, directory: PathLike = COMPLETION_DIR) -> str:
+    """
+    Hook to source from the shell's rc. It never starts python,
+    tables are (re)sourced only when their .gen changed
+    """
+    v = _var(prog)
+    data = quote(str(table_path(prog, shell, directory)))
+    match shell:
+        case "bash":
+            return f"""{v}() {{
+    local data={data} gen state=0 i
+    [[ -f $data ]] || return
+    read -r gen < "$data.gen"
+    if [[ $gen != "${{{v}_gen-}}" ]]; then
+        source "$data" && {v}_gen=$gen
+    fi
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        state=${{{v}_n["$state/${{COMP_WORDS[i]}}"]-}}
+        [[ -z $state || $state == {LEAF} ]] && return
+    done
+    COMPREPLY=($(compgen -W "${{{v}_w[$state]}}" -- "${{COMP_WORDS[COMP_CWORD]}}"))
+}}
+complete -F {v} {quote(prog)}
+"""
+        case "zsh":
+            return f"""{v}() {{
+    local data={data} gen state=0 i
+    [[ -f $data ]] || return 1
+    read -r gen < "$data.gen"
+    if [[ $gen != "${{{v}_gen-}}" ]]; then
+        source "$data" && typeset -g {v}_gen=$gen
+    fi
+    for ((i = 2; i < CURRENT; i++)); do
+        state=${{{v}_n[$state/${{words[i]}}]}}
+        [[ -z $state || $state == {LEAF} ]] && return 1
+    done
+    compadd -- ${{={v}_w[$state]}}
+}}
+compdef {v} {quote(prog)}
+"""
+        case "fish":
+            return f"""function {v}
+    set -l data {data}
+    test -f $data; or return
+    read -l gen < $data.gen
+    if test "$gen" != "$__{v}_gen"
+        source $data; and set -g __{v}_gen $gen
+    end
+    set -l state 0
+    for word in (commandline -opc)[2..-1]
+        set -l keys {v}_k$state
+        set -l values {v}_v$state
+        set -l idx (contains -i -- $word $$keys); or return
+        set -l nexts $$values
+        set state $nexts[$idx]
+        test $state = {LEAF}; and return
+    end
+    set -l words {v}_w$state
+    printf '%s\\n' $$words
+end
+complete -c {quote(prog)} -f -a '({v})'
+"""
+        case _:
+            raise NotImplementedError(shell)
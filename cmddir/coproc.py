@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import os
+import shlex
+import subprocess
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from cmddir.spool import SpooledOutput
+from cmddir.types import BashOut, PathLike
+
+
+class CoprocessError(Exception):
+    def __init__(self, msg: str):
+        self.message = f"Bash coprocess failed. {msg}"
+        super().__init__(self.message)
+
+
+class BashCoprocess:
+    """
+    A long lived bash that scripts are sourced into
+
+    Every run happens in a subshell of it such that a script can't
+    change the state (cwd, variables, traps) of the coprocess, yet the
+    cost of starting bash (and any setup it sources) is only paid once
+
+    stdout/stderr of a run are framed by a sentinel line carrying
+    the exit status. A coprocess found dead is restarted, a run is only
+    retried when it never reached bash. Should bash die part way
+    through a script the run fails (returncode of bash, or 1) rather
+    than running it a second time
+
+    setup is run once per (re)start, get_coprocess takes it from
+    $CMDDIR_BASH_SETUP e.g. "source ~/.cmddir_env"
+    """
+
+    def __init__(self, cwd: Optional[PathLike] = None, setup: Optional[str] = None):
+        self.cwd = str(cwd) if cwd else None
+        self.setup = setup
+        self.lock = threading.Lock()
+        self.ps: Optional[subprocess.Popen] = None
+
+    def start(self):
+        self.ps = subprocess.Popen(
+            ["bash", "--noprofile", "--norc"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.cwd,
+        )
+        if self.setup:
+            self._framed(self.setup)
+
+    def alive(self) -> bool:
+        return self.ps is not None and self.ps.poll() is None
+
+    def stop(self):
+        if self.alive():
+            self.ps.stdin.close()
+            self.ps.wait()
+        self.ps = None
+
+    def run(self, path: PathLike, args: List[str] = None, env: Optional[Dict[str, str]] = None) -> BashOut:
+        """env: the whole environment of the script, what differs is exported in its subshell"""
+        cmd = " ".join(shlex.quote(str(x)) for x in [path, *(args or [])])
+        cwd = shlex.quote(self.cwd or os.getcwd())
+        exports = "".join(
+            f"export {k}={shlex.quote(v)}; " for k, v in (env or {}).items() if os.environ.get(k) != v
+        )
+        script = f"({exports}cd {cwd} && source {cmd}) </dev/null"
+        with self.lock:
+            if not self.alive():
+                self.start()
+            try:
+                sentinel = self._send_framed(script)
+            except BrokenPipeError:
+                # Died in the meantime, nothing of the script ran
+                self.stop()
+                self.start()
+                sentinel = self._send_framed(script)
+            o = BashOut()
+            try:
+                return self._collect(sentinel, o)
+            except CoprocessError as e:
+                o.returncode = self.ps.wait() or 1
+                o.stderr_spool.write(f"\n{e.message}\n".encode())
+                self.stop()
+                return o
+
+    def _framed(self, script: str) -> BashOut:
+        return self._collect(self._send_framed(script), BashOut())
+
+    def _send_framed(self, script: str) -> str:
+        sentinel = f"__cmddir_{uuid.uuid4().hex}__"
+        # The exit status is echoed to both streams once the script is done
+        self._send(
+            f"{script}\n"
+            f"__s=$?; echo; echo {sentinel} $__s; echo >&2; echo {sentinel} $__s >&2\n"
+        )
+        return sentinel
+
+    def _collect(self, sentinel: str, o: BashOut) -> BashOut:
+        o.stderr_spool = SpooledOutput()
+        reader = threading.Thread(target=self._read_stderr, args=(sentinel, o.stderr_spool))
+        reader.start()
+        o.stdout_spool = SpooledOutput()
+        try:
+            o.returncode = self._read_until(self.ps.stdout, sentinel, o.stdout_spool)
+        finally:
+            reader.join()
+        return o
+
+    def _send(self, line: str):
+        self.ps.stdin.write(line.encode())
+        self.ps.stdin.flush()
+
+    def _read_stderr(self, sentinel: str, out: SpooledOutput):
+        try:
+            self._read_until(self.ps.stderr, sentinel, out)
+        except CoprocessError:
+            pass
+
+    @staticmethod
+    def _read_until(stream, sentinel: str, out: SpooledOutput) -> int:
+        """Spool stream into out up to the sentinel, returns the exit status"""
+        marker = sentinel.encode()
+        # Held back a line as the newline in front of the sentinel isn't output
+        prev = b""
+        for line in iter(stream.readline, b""):
+            if line.startswith(marker):
+                out.write(prev[:-1])
+                return int(line.split()[1])
+            out.write(prev)
+            prev = line
+        # Whatever it got out before dying
+        out.write(prev)
+        raise CoprocessError("bash exited before the script finished")
+
+
+_coprocesses: Dict[Optional[str], BashCoprocess] = {}
+_coprocesses_lock = threading.Lock()
+
+
+def get_coprocess(cwd: Optional[PathLike] = None) -> BashCoprocess:
+    """
+    One coprocess per session, or per directory when cwd is given
+    """
+    key = str(Path(cwd).resolve()) if cwd else None
+    with _coprocesses_lock:
+        if key not in _coprocesses:
+            _coprocesses[key] = BashCoprocess(cwd, setup=os.environ.get("CMDDIR_BASH_SETUP"))
+        return _coprocesses[key]
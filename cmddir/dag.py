@@ -0,0 +1,313 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from contextvars import copy_context
+from copy import copy
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cmddir.cache import CACHE_DIR, script_key
+from cmddir.cmds import Command, SubMenu, dispatch
+from cmddir.types import PathLike, script_path
+from cmddir.utils import notify, notify_kv
+
+
+class DagError(Exception):
+    def __init__(self, msg: str):
+        self.message = f"Invalid depends_on. {msg}"
+        super().__init__(self.message)
+
+
+@dataclass
+class DagNode:
+    """
+    One Command of the graph
+
+    status: pending -> done/failed, skipped when its inputs are
+    unchanged since it last succeeded, blocked when a dependency failed
+    """
+
+    name: str
+    menu: SubMenu
+    cmd: Command
+    deps: List[str] = field(default_factory=list)
+    key: Optional[str] = None
+    status: str = "pending"
+    returncode: Optional[int] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.status in ["done", "skipped"]
+
+
+@dataclass
+class DagOut:
+    nodes: Dict[str, DagNode] = field(default_factory=dict)
+    critical_path: List[str] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def returncode(self) -> int:
+        return next((n.returncode or 1 for n in self.nodes.values() if not n.ok), 0)
+
+    def summary(self):
+        count = lambda *status: sum(1 for n in self.nodes.values() if n.status in status)
+        notify(
+            f"{len(self.nodes)} commands, {count('done', 'failed')} ran, "
+            f"{count('skipped')} up to date, {count('blocked')} blocked in {self.elapsed:.2f}s",
+            sep=True,
+        )
+        for node in self.nodes.values():
+            detail = node.error or (f"exit {node.returncode}" if node.returncode else "")
+            notify_kv(node.name, f"{node.status} {node.elapsed:.2f}s {detail}".rstrip())
+        length = sum(self.nodes[n].elapsed for n in self.critical_path)
+        notify_kv("critical path", f"{' -> '.join(self.critical_path)} ({length:.2f}s)")
+
+
+def resolve(menu: SubMenu, path: str) -> Optional[Tuple[SubMenu, Command]]:
+    """
+    depends_on paths are relative to the declaring SubMenu,
+    ".." goes up a level and a leading "/" starts at the root
+    """
+    if path.startswith("/"):
+        while menu.parent:
+            menu = menu.parent
+    *dirs, name = [p for p in path.split("/") if p]
+    for d in dirs:
+        menu = menu.parent if d == ".." else menu.find_child(d)
+        if menu is None:
+            return None
+    found = menu.find_command(name)
+    return (menu, found) if found else None
+
+
+def inner(fn: Callable) -> Callable:
+    """The fn a Dag wraps, so that a dependency doesn't run its own graph"""
+    return fn.fn if isinstance(fn, Dag) else fn
+
+
+class Dag(Callable):
+    """
+    Run a Command after everything it depends_on (transitively)
+
+    Declared within config.json, paths are relative to the SubMenu:
+        {"orig_name": "deploy", "depends_on": ["test", "../build/all"]}
+
+    Independent Commands run in parallel on up to workers threads.
+    A Command whose script, args, cache_env and dependencies are
+    unchanged since it last succeeded is skipped, unless called with
+    bypass or right after refresh_next. A matrix Command's argument
+    file counts as one of its inputs. With fail_fast nothing new is
+    started after the first failure, otherwise only the dependents
+    of a failure are blocked
+
+    Args it is called with go to cmd itself, the dependencies run with
+    the args they are bound to. They count as an input of cmd, other
+    args than last time make it run again
+
+    depends_on is resolved from menu when the Dag runs, a SubMenu
+    absorbing menu takes the Dag over (see SubMenu.absorb)
+    """
+
+    def __init__(
+        self,
+        menu: SubMenu,
+        cmd: Command,
+        fn: Callable,
+        workers: int = 4,
+        fail_fast: bool = False,
+        state_dir: PathLike = CACHE_DIR / "dag",
+    ):
+        self.menu = menu
+        self.cmd = cmd
+        self.fn = fn
+        self.workers = workers
+        self.fail_fast = fail_fast
+        self.state_dir = Path(state_dir)
+        self.refresh = False
+        self.lock = threading.Lock()
+
+    def graph(self) -> Dict[str, DagNode]:
+        """Every node reachable from cmd, dependencies first"""
+        nodes: Dict[str, DagNode] = {}
+        visiting: List[str] = []
+
+        def visit(menu: SubMenu, cmd: Command) -> str:
+            name = "/".join(menu.tree_path() + [cmd.name])
+            if name in visiting:
+                raise DagError(f"cycle {' -> '.join(visiting[visiting.index(name):] + [name])}")
+            if name in nodes:
+                return name
+            visiting.append(name)
+            node = DagNode(name, menu, cmd)
+            for path in cmd.depends_on:
+                found = resolve(menu, path)
+                if not found:
+                    raise DagError(f"{path} of {name} not found")
+                node.deps.append(visit(*found))
+            visiting.pop()
+            nodes[name] = node
+            return name
+
+        visit(self.menu, self.cmd)
+        return nodes
+
+    def node_key(self, node: DagNode, nodes: Dict[str, DagNode]) -> Optional[str]:
+        fn = inner(node.cmd.fn)
+        if script_path(fn) is None or any(nodes[d].key is None for d in node.deps):
+            # Nothing to fingerprint (e.g. a Pipeline), always run
+            return None
+        h = hashlib.sha256()
+        while not hasattr(fn, "path"):
+            arg_sets = getattr(fn, "arg_sets", None)
+            if isinstance(arg_sets, list):
+                h.update(repr(arg_sets).encode())
+            elif arg_sets is not None:
+                if str(arg_sets) == "-":
+                    # Whatever comes in on stdin, always run
+                    return None
+                try:
+                    h.update(Path(arg_sets).read_bytes())
+                except OSError:
+                    return None
+            fn = fn.fn
+        h.update(script_key(fn, {k: os.environ.get(k, "") for k in node.cmd.cache_env}).encode())
+        for d in node.deps:
+            h.update(nodes[d].key.encode())
+        return h.hexdigest()
+
+    def _state_file(self, node: DagNode):
+        return self.state_dir / f"{hashlib.sha1(node.name.encode()).hexdigest()}.json"
+
+    def up_to_date(self, node: DagNode) -> bool:
+        try:
+            return node.key is not None and json.loads(self._state_file(node).read_text())["key"] == node.key
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def remember(self, node: DagNode):
+        if node.key is None:
+            return
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self._state_file(node).write_text(json.dumps({"name": node.name, "key": node.key}))
+
+    def run_node(self, node: DagNode, *args, **kwargs) -> DagNode:
+        """
+        A result fails by its returncode (BashOut, MatrixOut, DagOut,
+        PipelineOut or anything else that has one), any other result
+        of a script is a success and an exception a failure
+        """
+        start = time.perf_counter()
+        try:
+            cmd = node.cmd
+            if isinstance(cmd.fn, Dag):
+                cmd = copy(cmd)
+                cmd.fn = cmd.fn.fn
+            result = dispatch(node.menu, cmd, None, *args, **kwargs)
+            node.returncode = getattr(result, "returncode", 0) or 0
+        except Exception as e:
+            node.returncode = 1
+            node.error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+        node.elapsed = time.perf_counter() - start
+        node.status = "failed" if node.returncode else "done"
+        return node
+
+    def refresh_next(self):
+        """Run every node on the next call, up to date or not"""
+        with self.lock:
+            self.refresh = True
+
+    def __call__(self, *args, bypass: bool = False, **kwargs) -> DagOut:
+        with self.lock:
+            refresh, self.refresh = self.refresh, False
+        bypass = bypass or refresh
+        nodes = self.graph()
+        # Dependencies come first in nodes, so their keys are known
+        for node in nodes.values():
+            node.key = self.node_key(node, nodes)
+        # cmd itself comes last
+        root = list(nodes)[-1]
+        if nodes[root].key is not None and (args or kwargs):
+            h = hashlib.sha256(nodes[root].key.encode())
+            h.update(repr(args).encode())
+            h.update(repr(sorted(kwargs.items())).encode())
+            nodes[root].key = h.hexdigest()
+        out = DagOut(nodes=nodes)
+        waiting = {name: set(node.deps) for name, node in nodes.items()}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {}
+            failed = False
+            while True:
+                ready = [n for n, deps in waiting.items() if not deps]
+                for name in ready:
+                    del waiting[name]
+                    node = nodes[name]
+                    if failed and self.fail_fast:
+                        node.status = "blocked"
+                    elif not bypass and self.up_to_date(node):
+                        node.status = "skipped"
+                        self._finished(node, waiting, nodes)
+                    else:
+                        call_args, call_kwargs = (args, kwargs) if name == root else ((), {})
+                        # Runs within this context, e.g. nodes aren't macro steps
+                        run = copy_context().run
+                        pending[executor.submit(run, self.run_node, node, *call_args, **call_kwargs)] = name
+                if not pending:
+                    if ready:
+                        # Skipped nodes may have readied others
+                        continue
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = nodes[pending.pop(future)]
+                    notify_kv(node.name, f"{node.status} ({node.elapsed:.2f}s)")
+                    failed = failed or not node.ok
+                    self._finished(node, waiting, nodes)
+        for node in nodes.values():
+            if node.status == "pending":
+                node.status = "blocked"
+        out.elapsed = time.perf_counter() - start
+        out.critical_path = critical_path(nodes)
+        out.summary()
+        return out
+
+    def _finished(self, node: DagNode, waiting: Dict[str, set], nodes: Dict[str, DagNode]):
+        if node.ok:
+            if node.status == "done":
+                self.remember(node)
+            for deps in waiting.values():
+                deps.discard(node.name)
+        else:
+            # Everything downstream of a failure is blocked
+            for name in [n for n, deps in waiting.items() if node.name in deps]:
+                del waiting[name]
+                nodes[name].status = "blocked"
+                self._finished(nodes[name], waiting, nodes)
+
+
+def critical_path(nodes: Dict[str, DagNode]) -> List[str]:
+    """The chain of dependencies that took the longest in total"""
+    longest: Dict[str, float] = {}
+    via: Dict[str, Optional[str]] = {}
+    # Dependencies come first in nodes
+    for name, node in nodes.items():
+        prev = max(node.deps, key=lambda d: longest[d], default=None)
+        longest[name] = node.elapsed + (longest[prev] if prev else 0.0)
+        via[name] = prev
+    end = max(longest, key=longest.get, default=None)
+    path = []
+    while end:
+        path.append(end)
+        end = via[end]
+    return path[::-1]
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from cmddir.cache import CACHE_DIR, ResultCache
+from cmddir.cmds import SubMenu
+from cmddir.types import PathLike, PythonScript, script_of
+from cmddir.utils import notify
+
+ENV_FILE = ".env"
+# How long the output of a $(...) within an .env file is reused for, in seconds
+ENV_TTL = int(os.environ.get("CMDDIR_ENV_TTL", 300))
+# How long a $(...) may take before it is given up on
+ENV_TIMEOUT = 60
+
+ENV_LINE = re.compile(r"^\s*(?:export\s+)?([A-Za-z_][A-Za-z0-9_]*)\s*=\s*(.*?)\s*$")
+ENV_VAR = re.compile(r"\$(?:\{([A-Za-z_][A-Za-z0-9_]*)\}|([A-Za-z_][A-Za-z0-9_]*))")
+
+
+_env_cache: Optional[ResultCache] = None
+
+
+def env_cache() -> ResultCache:
+    """
+    Where the output of every $(...) is kept, it is often a credential
+    so the directory is only readable by the user
+    """
+    global _env_cache
+    if _env_cache is None:
+        path = CACHE_DIR / "env"
+        path.mkdir(mode=0o700, parents=True, exist_ok=True)
+        # mkdir leaves the mode of a directory that already exists as is
+        path.chmod(0o700)
+        _env_cache = ResultCache(path)
+    return _env_cache
+
+
+def substitute(command: str, env: Dict[str, str], cwd: PathLike, ttl: int = ENV_TTL) -> str:
+    """
+    Output of a $(...), run by bash within the directory of the .env
+    file. Cached per command, directory and the variables before it
+    for ttl seconds, a failure is reported and never cached
+    """
+    h = hashlib.sha256(f"{cwd}\0{command}".encode())
+    for k, v in sorted(env.items()):
+        h.update(f"\0{k}={v}".encode())
+    key = h.hexdigest()
+    cache = env_cache()
+    hit, value = cache.get(key)
+    if hit:
+        return value
+    try:
+        ps = subprocess.run(
+            ["bash", "-c", command],
+            cwd=cwd,
+            env={**os.environ, **env},
+            capture_output=True,
+            text=True,
+            timeout=ENV_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        notify(f"$({command}) in {cwd}/{ENV_FILE} took over {ENV_TIMEOUT}s")
+        return ""
+    if ps.returncode:
+        notify(f"$({command}) in {cwd}/{ENV_FILE} failed: {ps.stderr.strip()}")
+        return ""
+    value = ps.stdout.rstrip("\n")
+    cache.put(key, value, ttl)
+    return value
+
+
+def expand(value: str, env: Dict[str, str], run: Callable[[str], str]) -> str:
+    """$VAR, ${VAR} and $(command) within value, \\$ is a literal $"""
+    out = []
+    idx = 0
+    while idx < len(value):
+        c = value[idx]
+        if c == "\\" and value[idx + 1 : idx + 2] == "$":
+            out.append("$")
+            idx += 2
+        elif value.startswith("$(", idx):
+            depth, end = 1, idx + 2
+            while end < len(value) and depth:
+                depth += {"(": 1, ")": -1}.get(value[end], 0)
+                end += 1
+            out.append(run(value[idx + 2 : end - 1]))
+            idx = end
+        elif match := ENV_VAR.match(value, idx):
+            name = match.group(1) or match.group(2)
+            out.append(env.get(name, os.environ.get(name, "")))
+            idx = match.end()
+        else:
+            out.append(c)
+            idx += 1
+    return "".join(out)
+
+
+def parse_env(path: PathLike, base: Optional[Dict[str, str]] = None, ttl: int = ENV_TTL) -> Dict[str, str]:
+    """
+    The variables of an .env file on top of base:
+
+        # comment
+        export REGION=eu-west-1
+        HOME_BIN=$HOME/bin
+        TOKEN="$(vault read -field=token secret/ci)"
+        LITERAL='no $expansion here'
+
+    Later lines see the earlier ones, the inherited ones (base)
+    and the environment cmddir was started with
+    """
+    path = Path(path)
+    env = dict(base or {})
+    cwd = path.parent
+    with open(path) as f:
+        for line in f:
+            match = ENV_LINE.match(line)
+            if not match or line.lstrip().startswith("#"):
+                continue
+            key, value = match.groups()
+            if value[:1] == "'" and "'" in value[1:]:
+                env[key] = value[1 : value.index("'", 1)]
+                continue
+            if value[:1] == '"' and '"' in value[1:]:
+                value = value[1 : value.rindex('"')]
+            else:
+                value = re.split(r"\s+#", value, 1)[0]
+            env[key] = expand(value, env, lambda command: substitute(command, env, cwd, ttl))
+    return env
+
+
+def attach_env(menus: List[SubMenu]):
+    """
+    The .env file of every SubMenu's directory, on top of the one of
+    its parent, is read once and the result handed to each of its
+    scripts: a subprocess gets the whole environment to run with
+    (see BashScript.env), a PythonScript only the variables of the
+    .env files, laid over os.environ as it is whilst main runs
+    (see PythonScript.env)
+
+    Parents are dealt with before their children, a SubMenu whose
+    parent isn't among menus takes whatever the parent already has
+    """
+    for menu in sorted(menus, key=lambda m: m.level):
+        set_env(menu, menu.parent.env if menu.parent else {})
+
+
+def set_env(menu: SubMenu, inherited: Dict[str, str]):
+    """The .env file of menu on top of inherited, see attach_env"""
+    env_file = Path(menu.path) / ENV_FILE if menu.path else None
+    if env_file and env_file.is_file():
+        menu.env = parse_env(env_file, inherited)
+    else:
+        menu.env = dict(inherited)
+    # Prebuilt once for every subprocess of the SubMenu
+    full = {**os.environ, **menu.env} if menu.env else None
+    for cmd in menu.cmds:
+        script = script_of(cmd.fn)
+        if isinstance(script, PythonScript):
+            script.env = dict(menu.env) or None
+        elif script is not None:
+            script.env = full
+
+
+def subtree(menu: SubMenu) -> List[SubMenu]:
+    """menu and everything below it, parents first"""
+    menus, idx = [menu], 0
+    while idx < len(menus):
+        menus.extend(menus[idx].children)
+        idx += 1
+    return menus
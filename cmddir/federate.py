@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from cmddir.cmds import SubMenu
+from cmddir.tree import FlatTree
+from cmddir.types import PathLike
+
+
+class OverlayFinder(importlib.abc.MetaPathFinder):
+    """
+    Makes the same module path across several roots resolve in
+    overlay order (the last root first)
+
+    A package found in more than one root gets the directories of
+    all of them as its __path__, so e.g. tools/a.py of the shared
+    tree and tools/b.py of the personal tree are both importable as
+    tools.a and tools.b
+
+    Only the module names of the trees (see FlatTree.module_names)
+    are ever answered for, anything else is left to the rest of
+    sys.meta_path without a single stat. A top level name that
+    resolves outside of the roots (e.g. a script called json.py)
+    is never shadowed either
+    """
+
+    def __init__(self, roots: List[PathLike], names: Set[str]):
+        self.roots = [Path(r).resolve() for r in reversed(roots)]
+        self.names = names
+        self._outside: Dict[str, bool] = {}
+
+    def find_spec(self, name: str, path=None, target=None):
+        if name not in self.names:
+            return None
+        parts = name.split(".")
+        if len(parts) == 1 and self.resolves_outside(name):
+            return None
+        dirs = [root.joinpath(*parts) for root in self.roots if root.joinpath(*parts).is_dir()]
+        if len(dirs) > 1:
+            spec = importlib.machinery.PathFinder.find_spec(name, [str(dirs[0].parent)])
+            if spec and spec.submodule_search_locations is not None:
+                spec.submodule_search_locations = [str(d) for d in dirs]
+                return spec
+        if len(parts) == 1:
+            # Top level scripts would otherwise go by sys.path order
+            for root in self.roots:
+                if (root / f"{name}.py").exists():
+                    return importlib.util.spec_from_file_location(name, root / f"{name}.py")
+        return None
+
+    def resolves_outside(self, name: str) -> bool:
+        """name is a builtin/frozen module or found on sys.path outside of the roots"""
+        if name not in self._outside:
+            roots = {str(r) for r in self.roots}
+            outside = [p for p in sys.path if str(Path(p or ".").resolve()) not in roots]
+            self._outside[name] = bool(
+                name in sys.builtin_module_names
+                or importlib.machinery.FrozenImporter.find_spec(name)
+                or importlib.machinery.PathFinder.find_spec(name, outside)
+            )
+        return self._outside[name]
+
+
+_finder: Optional[OverlayFinder] = None
+
+
+def install_finder(roots: List[PathLike], names: Set[str]):
+    global _finder
+    if _finder in sys.meta_path:
+        sys.meta_path.remove(_finder)
+    _finder = OverlayFinder(roots, names)
+    sys.meta_path.insert(0, _finder)
+
+
+def overlay(base: SubMenu, top: SubMenu, is_root: bool = False):
+    """
+    Merge top into base, matched by path (orig_name)
+
+    Commands of top replace those of base, SubMenus of both are
+    merged in turn and anything only top has is added. The root
+    keeps the name/title of the first tree
+    """
+    base.load()
+    top.load()
+    if not is_root:
+        base.title = top.title or base.title
+    base.msg = top.msg or base.msg
+    base.desc = top.desc or base.desc
+    base.pipelines.update(top.pipelines)
+    by_name = {cmd.orig_name: idx for idx, cmd in enumerate(base.cmds)}
+    for cmd in top.cmds:
+        if cmd.orig_name in by_name:
+            base.cmds[by_name[cmd.orig_name]] = cmd
+        else:
+            base.cmds.append(cmd)
+    children = {child.orig_name: child for child in base.children}
+    for child in top.children:
+        if child.orig_name in children:
+            overlay(children[child.orig_name], child)
+        else:
+            child.parent = base
+            base.children.append(child)
+    base.resolve_shortcut_conflicts()
+
+
+def federated_menus(cmd_paths: List[PathLike], workers: int = 8) -> List[SubMenu]:
+    """
+    Every root is scanned concurrently from its own cache (see
+    FlatTree.cached) and the trees are overlaid in the given order
+    """
+    with ThreadPoolExecutor(max_workers=len(cmd_paths)) as executor:
+        trees = list(executor.map(lambda p: FlatTree.cached(p, workers=workers), cmd_paths))
+    # Before any SubMenu is created, creating one may import its scripts
+    install_finder(cmd_paths, set().union(*(tree.module_names() for tree in trees)))
+    roots = [tree.menus()[0] for tree in trees]
+    for top in roots[1:]:
+        overlay(roots[0], top, is_root=True)
+    menus = []
+    pending = [roots[0]]
+    while pending:
+        # Every SubMenu is needed for the overlay/list, so all are loaded
+        menu = pending.pop(0).load()
+        menus.append(menu)
+        pending.extend(menu.children)
+    return menus
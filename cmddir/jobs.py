@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import codecs
+import io
+import itertools
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from bullet import Bullet
+
+from cmddir.cmds import Command, SubMenu, traced
+from cmddir.runners import call
+from cmddir.spool import CHUNK_SIZE, SpooledOutput
+from cmddir.types import BashOut, BashScript, Bg, Fg, K
+from cmddir.utils import clear_screen, notify, notify_kv
+
+# At most this many jobs run at once
+MAX_JOBS = int(os.environ.get("CMDDIR_JOBS", 4))
+# Lines of output a job keeps at hand for the jobs panel
+TAIL_LINES = 200
+
+
+class JobCancelled(Exception):
+    def __init__(self, msg: str = ""):
+        self.message = f"Job cancelled. {msg}"
+        super().__init__(self.message)
+
+
+class Job:
+    """
+    A Command sent to the background (see JobQueue)
+
+    status: queued -> running -> done/failed/cancelled
+    output: everything it printed, tail: the last TAIL_LINES of it
+    cancelled: set by JobQueue.cancel, a python job sees it through
+    check_cancelled (or its next print raises JobCancelled)
+    """
+
+    def __init__(self, id: int, menu: Optional[SubMenu], cmd: Command, priority: int = 0):
+        self.id = id
+        self.menu = menu
+        self.cmd = cmd
+        self.priority = priority
+        self.status = "queued"
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Optional[K] = None
+        self.error: Optional[str] = None
+        self.output = SpooledOutput()
+        self.tail: deque = deque(maxlen=TAIL_LINES)
+        self.process: Optional[subprocess.Popen] = None
+        self.thread: Optional[threading.Thread] = None
+        self._partial = ""
+        # A character split across two chunks is decoded once whole
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.cancelled = threading.Event()
+        self.line_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return "/".join((self.menu.tree_path() if self.menu else []) + [self.cmd.name])
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def active(self) -> bool:
+        return self.status in ["queued", "running"]
+
+    def write(self, data: bytes | str):
+        data = data.encode() if isinstance(data, str) else data
+        with self._lock:
+            self.output.write(data)
+            text = self._partial + self._decoder.decode(data)
+            *lines, self._partial = text.split("\n")
+            self.tail.extend(lines)
+            self.line_count += len(lines)
+
+    def last_lines(self, n: int = 5) -> List[str]:
+        lines = list(self.tail)[-n:]
+        return lines + [self._partial] if self._partial else lines
+
+    def summary(self) -> str:
+        last = next((l for l in reversed(self.last_lines()) if l.strip()), "")
+        return f"[{self.id}] {self.status:<9} {self.elapsed:7.1f}s  {self.name}  {last[:60]}"
+
+
+class _JobStdout(io.TextIOBase):
+    """
+    Stands in for sys.stdout/stderr, whatever a job's thread prints
+    goes to that job and everything else to the original stream
+    """
+
+    def __init__(self, original, jobs: threading.local):
+        self.original = original
+        self.jobs = jobs
+
+    def write(self, s: str) -> int:
+        job = getattr(self.jobs, "job", None)
+        if job is None:
+            return self.original.write(s)
+        if job.cancelled.is_set():
+            raise JobCancelled(job.name)
+        job.write(s)
+        return len(s)
+
+    def flush(self):
+        self.original.flush()
+
+    def isatty(self) -> bool:
+        return self.original.isatty()
+
+    def fileno(self) -> int:
+        return self.original.fileno()
+
+
+class JobQueue:
+    """
+    In process queue of background jobs, run by at most max_jobs
+    worker threads. Lower priority values run first, equal ones in
+    the order they were submitted
+
+    A BashScript is run as a process of its own whose output is
+    streamed into the job, anything else runs on the worker thread
+    with its prints captured into the job. Cancelling stops a queued
+    job from running, terminates a bash process or asks a python job
+    to stop: JobCancelled is raised at its next print or
+    check_cancelled, whatever it returns after is dropped
+    """
+
+    def __init__(self, max_jobs: int = MAX_JOBS):
+        self.max_jobs = max_jobs
+        self.queue: queue.PriorityQueue = queue.PriorityQueue()
+        self.jobs: Dict[int, Job] = {}
+        self.ids = itertools.count(1)
+        self.local = threading.local()
+        self.workers: List[threading.Thread] = []
+        self.lock = threading.Lock()
+
+    def submit(self, cmd: Command, menu: Optional[SubMenu] = None, priority: Optional[int] = None) -> Job:
+        priority = cmd.priority if priority is None else priority
+        job = Job(next(self.ids), menu, cmd, priority)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._start_workers()
+        self.queue.put((priority, job.id, job))
+        return job
+
+    def _start_workers(self):
+        if self.workers:
+            return
+        if not isinstance(sys.stdout, _JobStdout):
+            sys.stdout = _JobStdout(sys.stdout, self.local)
+            sys.stderr = _JobStdout(sys.stderr, self.local)
+        for idx in range(self.max_jobs):
+            worker = threading.Thread(target=self._work, name=f"cmddir-job-{idx}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _work(self):
+        while True:
+            _, _, job = self.queue.get()
+            if job.status == "queued":
+                self.run(job)
+            self.queue.task_done()
+
+    def run(self, job: Job):
+        job.status = "running"
+        job.started = time.time()
+        job.thread = threading.current_thread()
+        self.local.job = job
+        try:
+            with traced(job.menu, job.cmd, None, (), {}) as trace:
+                trace.result = job.result = self._call(job)
+            returncode = getattr(job.result, "returncode", 0)
+            if job.cancelled.is_set():
+                job.result = None
+            elif job.status == "running":
+                job.status = "failed" if returncode else "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.write(job.error + "\n")
+            job.status = "cancelled" if job.status == "cancelled" else "failed"
+        finally:
+            self.local.job = None
+            job.finished = time.time()
+
+    def _call(self, job: Job) -> Optional[K]:
+        fn = job.cmd.fn
+        if not isinstance(fn, BashScript) or fn.coproc:
+            return call(job.cmd)
+        # A group of its own, cancelling stops whatever the script started too
+        job.process = subprocess.Popen(
+            fn.cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=fn.env, start_new_session=True
+        )
+        for chunk in iter(lambda: job.process.stdout.read1(CHUNK_SIZE), b""):
+            job.write(chunk)
+        o = BashOut(stdout=job.output, stderr=SpooledOutput())
+        o.returncode = job.process.wait()
+        return o
+
+    def cancel(self, job: Job) -> bool:
+        if not job.active:
+            return False
+        was_running = job.status == "running"
+        job.status = "cancelled"
+        job.cancelled.set()
+        if not was_running:
+            job.finished = time.time()
+        elif job.process:
+            _terminate(job.process)
+        return True
+
+    def attach(self, job: Job, poll: float = 0.1):
+        """
+        Follow the output of job until it finishes, ctrl-c detaches
+        """
+        clear_screen()
+        notify(job.summary(), sep=True)
+        shown = 0
+        try:
+            while True:
+                with job._lock:
+                    count, lines = job.line_count, list(job.tail)
+                # Lines that already slid out of the tail are skipped
+                for line in lines[len(lines) - min(count - shown, len(lines)) :]:
+                    print(line)
+                shown = count
+                if not job.active:
+                    break
+                time.sleep(poll)
+        except KeyboardInterrupt:
+            pass
+        if job._partial:
+            print(job._partial)
+        notify(job.summary())
+
+    def panel(self):
+        """
+        Jobs panel: every job with its status, elapsed time and last
+        line of output. Choosing a job offers attach/cancel
+        """
+        while True:
+            clear_screen()
+            jobs = sorted(self.jobs.values(), key=lambda j: -j.id)
+            if not jobs:
+                notify("No jobs")
+                return
+            back = "<- back"
+            choices = [job.summary() for job in jobs] + [back]
+            chosen = _menu("Jobs", choices)
+            if chosen == back:
+                return
+            job = jobs[choices.index(chosen)]
+            clear_screen()
+            notify_kv(job.name, job.status, sep=True)
+            for line in job.last_lines(10):
+                print(line)
+            action = _menu("", ["attach", "cancel", "back"])
+            match action:
+                case "attach":
+                    self.attach(job)
+                    input("Press enter to return to the jobs panel")
+                case "cancel":
+                    self.cancel(job)
+
+
+def _terminate(process: subprocess.Popen):
+    """
+    The process group of a bash job, a child left running (e.g. a
+    sleep) would keep the output pipe open and the job with it
+    """
+    if not hasattr(os, "killpg"):
+        process.terminate()
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def _menu(prompt: str, choices: List[str]) -> str:
+    return Bullet(
+        prompt=prompt,
+        choices=choices,
+        indent=2,
+        margin=2,
+        bullet=">",
+        bullet_color=Fg.magenta,
+        word_color=Fg.blue,
+        word_on_switch=Fg.green,
+        background_color=Bg.default,
+        background_on_switch=Bg.default,
+    ).launch()
+
+
+def check_cancelled():
+    """
+    For a python job to call now and then, raises JobCancelled once
+    the job it runs in was cancelled. A no-op outside of a job
+    """
+    job = getattr(_job_queue.local, "job", None) if _job_queue else None
+    if job is not None and job.cancelled.is_set():
+        raise JobCancelled(job.name)
+
+
+_job_queue: Optional[JobQueue] = None
+
+
+def job_queue() -> JobQueue:
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue()
+    return _job_queue
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import asyncio
+import codecs
+import io
+import os
+import queue
+import sys
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+from cmddir.types import K
+
+try:
+    import termios
+    import tty
+except ImportError:
+    # Windows, no terminal modes to set
+    termios = tty = None
+
+# Handed to a pending read once the awaited prompt was cancelled
+_CANCELLED = object()
+
+
+class PromptCancelled(Exception):
+    def __init__(self, msg: str = ""):
+        self.message = f"Prompt cancelled. {msg}"
+        super().__init__(self.message)
+
+
+class KeyFeed(io.TextIOBase):
+    """
+    Stands in for sys.stdin whilst an awaited prompt is up (see
+    run_prompt). The event loop reads the terminal and hands every
+    key over, the prompt's thread reads them from here as it would
+    from sys.stdin. Once cancelled any read raises PromptCancelled
+    """
+
+    def __init__(self, original, loop: asyncio.AbstractEventLoop):
+        self.original = original
+        self.fd = original.fileno()
+        self.loop = loop
+        self.keys: queue.SimpleQueue = queue.SimpleQueue()
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def isatty(self) -> bool:
+        return self.original.isatty()
+
+    def readable(self) -> bool:
+        return True
+
+    def feed(self):
+        """Reader callback of the event loop"""
+        try:
+            data = os.read(self.fd, 1024)
+        except BlockingIOError:
+            return
+        if not data:
+            # Nothing more to come, stop the loop polling a closed end
+            self.loop.remove_reader(self.fd)
+            self.keys.put(None)
+        for c in self._decoder.decode(data):
+            self.keys.put(c)
+
+    def cancel(self):
+        self.keys.put(_CANCELLED)
+
+    def _get(self) -> Optional[str]:
+        c = self.keys.get()
+        if c is _CANCELLED:
+            # Every later read fails just the same
+            self.keys.put(c)
+            raise PromptCancelled()
+        if c is None:
+            self.keys.put(c)
+        return c
+
+    def read(self, size: int = -1) -> str:
+        out = []
+        while size < 0 or len(out) < size:
+            c = self._get()
+            if c is None:
+                break
+            out.append(c)
+        return "".join(out)
+
+    def readline(self, size: int = -1) -> str:
+        out = []
+        while size < 0 or len(out) < size:
+            c = self._get()
+            if c is None:
+                break
+            out.append(c)
+            if c == "\n":
+                break
+        return "".join(out)
+
+
+@asynccontextmanager
+async def key_feed():
+    """
+    sys.stdin as a KeyFeed read by the running loop, a terminal is
+    put into cbreak mode such that each key arrives as it is pressed.
+    Yields None when stdin can't be polled (no fd, a regular file, ...)
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        feed = KeyFeed(sys.stdin, loop)
+        loop.add_reader(feed.fd, feed.feed)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        yield None
+        return
+    saved = termios.tcgetattr(feed.fd) if termios and feed.isatty() else None
+    if saved is not None:
+        tty.setcbreak(feed.fd)
+    sys.stdin = feed
+    try:
+        yield feed
+    finally:
+        sys.stdin = feed.original
+        loop.remove_reader(feed.fd)
+        if saved is not None:
+            termios.tcsetattr(feed.fd, termios.TCSADRAIN, saved)
+
+
+async def run_prompt(prompt: Callable[..., K], *args) -> K:
+    """
+    A blocking prompt (e.g. SubMenu.prompt) awaited: it runs on a
+    thread with its keys coming from the event loop. Cancelling the
+    awaiting task ends the prompt's thread before it is re-raised,
+    nothing is left blocked on the terminal
+    """
+    async with key_feed() as feed:
+        if feed is None:
+            return await asyncio.to_thread(prompt, *args)
+        task = asyncio.ensure_future(asyncio.to_thread(prompt, *args))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            feed.cancel()
+            try:
+                await task
+            except PromptCancelled:
+                pass
+            raise
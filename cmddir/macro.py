@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from cmddir.cmds import COutput, Command, REFRESH_KEY, SubMenu, dispatch
+from cmddir.dag import resolve
+from cmddir.types import PathLike
+from cmddir.utils import notify, notify_kv
+
+
+class MacroError(Exception):
+    def __init__(self, msg: str):
+        self.message = f"Invalid macro. {msg}"
+        super().__init__(self.message)
+
+
+@dataclass
+class Step:
+    """
+    One run of chosen Command(s) within a session
+
+    paths: relative to the root of the tree e.g. "subcmd1/script",
+    several when they were picked from a checklist
+    after: indices of the steps it has to wait for, None meaning the
+    step before it. [] marks a step as independent of the others
+    unrun: paths of a cli choice that weren't run yet, the first
+    of them to run hands the step its args
+    """
+
+    paths: List[str]
+    args: List[Any] = field(default_factory=list)
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    refresh: bool = False
+    after: Optional[List[int]] = None
+    status: str = "pending"
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    unrun: List[str] = field(default_factory=list, repr=False)
+
+    @staticmethod
+    def from_dict(d: dict) -> Step:
+        return Step(
+            paths=d["paths"],
+            args=d.get("args") or [],
+            kwargs=d.get("kwargs") or {},
+            refresh=d.get("refresh", False),
+            after=d.get("after"),
+        )
+
+    def to_dict(self) -> dict:
+        d = {"paths": self.paths, "args": self.args, "kwargs": self.kwargs}
+        if self.refresh:
+            d["refresh"] = True
+        if self.after is not None:
+            d["after"] = self.after
+        return d
+
+
+@dataclass
+class Macro:
+    """
+    A recorded session, one json line of a macro file:
+        {"name": "rotate-certs", "steps": [{"paths": ["d/s/r"], "args": [], "kwargs": {}}]}
+    """
+
+    name: str
+    steps: List[Step] = field(default_factory=list)
+    out: COutput = field(default_factory=COutput)
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return all(s.status == "done" for s in self.steps)
+
+    def to_json(self) -> str:
+        return json.dumps({"name": self.name, "steps": [s.to_dict() for s in self.steps]}, default=str)
+
+    def deps(self, idx: int) -> List[int]:
+        step = self.steps[idx]
+        deps = step.after if step.after is not None else ([idx - 1] if idx else [])
+        for d in deps:
+            if not 0 <= d < idx:
+                raise MacroError(f"step {idx} of {self.name} waits for step {d}")
+        return deps
+
+    def summary(self):
+        count = lambda status: sum(1 for s in self.steps if s.status == status)
+        notify(
+            f"{self.name}: {count('done')}/{len(self.steps)} steps done, "
+            f"{count('failed')} failed, {count('blocked')} blocked in {self.elapsed:.2f}s",
+            sep=True,
+        )
+        for idx, step in enumerate(self.steps):
+            detail = f" {step.error}" if step.error else ""
+            notify_kv(f"{idx} {','.join(step.paths)}", f"{step.status} {step.elapsed:.2f}s{detail}")
+
+
+def read_macros(path: PathLike) -> List[Macro]:
+    macros = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                d = json.loads(line)
+                macros.append(Macro(d.get("name") or f"macro{len(macros)}", [Step.from_dict(s) for s in d["steps"]]))
+    return macros
+
+
+class Recorder:
+    """
+    Collects what is chosen and dispatched during a session, the
+    macro is appended to path as one json line when the session ends
+    """
+
+    def __init__(self, path: PathLike, name: Optional[str] = None):
+        self.path = Path(path)
+        self.macro = Macro(name or time.strftime("session-%Y%m%d-%H%M%S"))
+        self.lock = threading.Lock()
+        self.saved = False
+
+    def add(self, menu: Optional[SubMenu], cmds: List[Command], args: tuple, kwargs: dict, refresh: bool) -> Step:
+        step = Step(paths=[_path(menu, cmd) for cmd in cmds], args=list(args), kwargs=dict(kwargs), refresh=refresh)
+        with self.lock:
+            self.macro.steps.append(step)
+        return step
+
+    def chose(self, out: COutput):
+        chosen = out.chosen if isinstance(out.chosen, list) else [out.chosen]
+        out.recorded = self.add(out.menu, chosen, (), {}, _refresh(out))
+        out.recorded.unrun = out.recorded.paths[:]
+
+    def dispatched(self, menu: Optional[SubMenu], cmd: Command, out: Optional[COutput], args: tuple, kwargs: dict):
+        step, path = out.recorded if out else None, _path(menu, cmd)
+        with self.lock:
+            if step is not None and path in step.unrun:
+                if len(step.unrun) == len(step.paths):
+                    step.args, step.kwargs = list(args), dict(kwargs)
+                step.unrun.remove(path)
+                return
+        self.add(menu, [cmd], args, kwargs, _refresh(out))
+
+    def save(self):
+        with self.lock:
+            if self.saved or not self.macro.steps:
+                return
+            self.saved = True
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(self.macro.to_json() + "\n")
+
+
+def _path(menu: Optional[SubMenu], cmd: Command) -> str:
+    return "/".join((menu.tree_path()[1:] if menu else []) + [cmd.name])
+
+
+def _refresh(out: Optional[COutput]) -> bool:
+    return bool(out and out.menu and out.menu.modifier == REFRESH_KEY)
+
+
+_recorder: Optional[Recorder] = None
+# Set whilst something is being run, such that what it runs in turn isn't
+# recorded as well. A ContextVar follows asyncio tasks, other threads
+# start out unset (see Dag.__call__ on passing it on)
+_unrecorded: ContextVar[bool] = ContextVar("cmddir_unrecorded", default=False)
+
+
+def recorder() -> Optional[Recorder]:
+    """
+    The Recorder of this session, started on first use when
+    $CMDDIR_RECORD names a macro file ($CMDDIR_RECORD_NAME names the macro)
+    """
+    global _recorder
+    if _recorder is None and os.environ.get("CMDDIR_RECORD"):
+        _recorder = Recorder(os.environ["CMDDIR_RECORD"], os.environ.get("CMDDIR_RECORD_NAME"))
+        atexit.register(_recorder.save)
+    return _recorder
+
+
+@contextmanager
+def record(path: PathLike, name: Optional[str] = None):
+    """Record every run within the block as a macro"""
+    global _recorder
+    previous, _recorder = _recorder, Recorder(path, name)
+    try:
+        yield _recorder
+    finally:
+        _recorder.save()
+        _recorder = previous
+
+
+@contextmanager
+def unrecorded():
+    """Nothing dispatched within the block is recorded"""
+    token = _unrecorded.set(True)
+    try:
+        yield
+    finally:
+        _unrecorded.reset(token)
+
+
+def record_choice(out: COutput):
+    """
+    Called once a cli prompt chose, such that a handler that runs
+    out.chosen.fn() itself still leaves a step (without args)
+    """
+    rec = recorder()
+    if rec is not None and not _unrecorded.get():
+        rec.chose(out)
+
+
+@contextmanager
+def recording(menu: Optional[SubMenu], cmd: Command, out: Optional[COutput], args: tuple, kwargs: dict):
+    """
+    Wraps dispatch, a no-op unless a session is recorded. Runs nested
+    in another one (e.g. a script dispatching itself) aren't steps
+    """
+    rec = recorder()
+    if rec is not None and not _unrecorded.get():
+        rec.dispatched(menu, cmd, out, args, kwargs)
+    with unrecorded():
+        yield
+
+
+class Replay:
+    """
+    Run macros against a tree without prompting
+
+    The tree is built once for every macro of a file. With workers > 1
+    the steps of a macro run as soon as the steps they wait for (see
+    Step.after) are done, otherwise one after the other. A failed step
+    blocks everything waiting for it, the next macro still runs
+    """
+
+    def __init__(self, root: SubMenu, workers: int = 1):
+        self.root = root
+        self.workers = max(workers, 1)
+
+    def resolve(self, macro: Macro):
+        """Every path up front such that a typo fails before anything runs"""
+        found = []
+        for step in macro.steps:
+            targets = []
+            for path in step.paths:
+                target = resolve(self.root, "/" + path)
+                if target is None:
+                    raise MacroError(f"{path} of {macro.name} not found")
+                targets.append(target)
+            found.append(targets)
+        return found
+
+    def run_step(self, macro: Macro, step: Step, targets) -> Step:
+        start = time.perf_counter()
+        try:
+            for menu, cmd in targets:
+                if step.refresh and hasattr(cmd.fn, "refresh_next"):
+                    cmd.fn.refresh_next()
+                with unrecorded():
+                    result = dispatch(menu, cmd, macro.out, *step.args, **step.kwargs)
+                returncode = getattr(result, "returncode", 0) or 0
+                if returncode:
+                    step.error = f"{cmd.name} exit {returncode}"
+                    break
+        except Exception as e:
+            step.error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+        step.elapsed = time.perf_counter() - start
+        step.status = "failed" if step.error else "done"
+        return step
+
+    def run(self, macro: Macro) -> Macro:
+        targets = self.resolve(macro)
+        waiting = {idx: set(macro.deps(idx)) for idx in range(len(macro.steps))}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {}
+            while True:
+                for idx in sorted(i for i, deps in waiting.items() if not deps):
+                    del waiting[idx]
+                    pending[executor.submit(self.run_step, macro, macro.steps[idx], targets[idx])] = idx
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._finished(macro, pending.pop(future), waiting)
+        macro.elapsed = time.perf_counter() - start
+        return macro
+
+    def _finished(self, macro: Macro, idx: int, waiting: Dict[int, set]):
+        step = macro.steps[idx]
+        for other in [i for i, deps in waiting.items() if idx in deps]:
+            if step.status == "done":
+                waiting[other].discard(idx)
+            else:
+                del waiting[other]
+                macro.steps[other].status = "blocked"
+                self._finished(macro, other, waiting)
+
+    def run_all(self, macros: List[Macro], summary: bool = True) -> List[Macro]:
+        for macro in macros:
+            try:
+                self.run(macro)
+            except MacroError as e:
+                notify(e.message, sep=True)
+                for step in macro.steps:
+                    step.status = "blocked"
+            if summary:
+                macro.summary()
+        return macros
+
+
+def replay(root: SubMenu, path: PathLike, workers: int = 1, names: Optional[List[str]] = None) -> List[Macro]:
+    """Replay every macro of a file (or only those in names)"""
+    macros = [m for m in read_macros(path) if not names or m.name in names]
+    return Replay(root, workers).run_all(macros)
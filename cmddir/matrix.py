@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import json
+import shlex
+import sys
+import time
+import traceback
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cmddir.types import BashOut, K, PathLike
+from cmddir.utils import notify, notify_kv
+
+ArgSet = Tuple[List[Any], Dict[str, Any]]
+
+
+@dataclass
+class MatrixItem:
+    args: List[Any]
+    kwargs: Dict[str, Any]
+    returncode: Optional[int] = None
+    output: Optional[K] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+    def label(self) -> str:
+        parts = [str(a) for a in self.args]
+        parts += [f"{k}={v}" for k, v in self.kwargs.items()]
+        return " ".join(parts) or "<no args>"
+
+
+@dataclass
+class MatrixOut:
+    items: List[MatrixItem] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def returncode(self) -> int:
+        return next((i.returncode or 1 for i in self.items if not i.ok), 0)
+
+    def summary(self):
+        failed = [i for i in self.items if not i.ok]
+        notify(f"{len(self.items) - len(failed)}/{len(self.items)} succeeded in {self.elapsed:.2f}s", sep=True)
+        for item in failed:
+            notify_kv(item.label(), item.error or f"exit {item.returncode}")
+
+
+def load_arg_sets(source: PathLike | List[Any]) -> List[ArgSet]:
+    """
+    Argument sets come from a list (i.e. config.json), a file or stdin ("-")
+
+    .json files hold a list, anything else is one shell quoted
+    set of args per line. Each set can be:
+        list -> *args
+        dict -> **kwargs
+        str  -> shlex.split into *args
+    """
+    if isinstance(source, list):
+        entries = source
+    elif str(source) == "-":
+        entries = _lines(sys.stdin.read())
+    elif Path(source).suffix == ".json":
+        entries = json.loads(Path(source).read_text())
+    else:
+        entries = _lines(Path(source).read_text())
+    arg_sets = []
+    for entry in entries:
+        match entry:
+            case dict():
+                arg_sets.append(([], entry))
+            case list():
+                arg_sets.append((entry, {}))
+            case str():
+                arg_sets.append((shlex.split(entry), {}))
+            case _:
+                arg_sets.append(([entry], {}))
+    return arg_sets
+
+
+def _lines(text: str) -> List[str]:
+    return [l for l in text.splitlines() if l.strip() and not l.lstrip().startswith("#")]
+
+
+def run_item(fn: Callable, item: MatrixItem) -> MatrixItem:
+    start = time.perf_counter()
+    try:
+        item.output = fn()
+        item.returncode = item.output.returncode if isinstance(item.output, BashOut) else 0
+    except Exception as e:
+        item.returncode = 1
+        item.error = f"{type(e).__name__}: {e}"
+        item.output = traceback.format_exc()
+    item.elapsed = time.perf_counter() - start
+    return item
+
+
+def failed_item(item: MatrixItem, e: Exception):
+    item.returncode = 1
+    item.error = f"{type(e).__name__}: {e}"
+    item.output = "".join(traceback.format_exception(e))
+
+
+class Matrix(Callable):
+    """
+    Fan one PythonScript/BashScript out over many argument sets
+
+    mode: "thread" or "process" (the script has to be picklable)
+    workers: maximum number of argument sets running at once
+    fail_fast: stop scheduling new argument sets after the first failure
+    wrap: optionally wrap every bound script e.g. with a CachedScript
+
+    Opt in per Command within config.json:
+        {"orig_name": "deploy", "matrix": "hosts.txt", "matrix_workers": 8}
+    """
+
+    def __init__(
+        self,
+        fn: Callable,
+        arg_sets: PathLike | List[Any],
+        workers: int = 4,
+        mode: str = "thread",
+        fail_fast: bool = False,
+        wrap: Optional[Callable] = None,
+        on_item: Optional[Callable[[int, int, MatrixItem], None]] = None,
+    ):
+        assert mode in ["thread", "process"]
+        self.fn = fn
+        self.arg_sets = arg_sets
+        self.workers = workers
+        self.mode = mode
+        self.fail_fast = fail_fast
+        self.wrap = wrap
+        self.on_item = on_item or self.notify_item
+
+    @staticmethod
+    def notify_item(done: int, total: int, item: MatrixItem):
+        status = "ok" if item.ok else item.error or f"exit {item.returncode}"
+        notify_kv(f"[{done}/{total}] {item.label()}", f"{status} ({item.elapsed:.2f}s)")
+
+    def __call__(self) -> MatrixOut:
+        arg_sets = load_arg_sets(self.arg_sets)
+        items = [MatrixItem(args=list(a), kwargs=k) for a, k in arg_sets]
+        out = MatrixOut(items=items)
+        executor_type = ThreadPoolExecutor if self.mode == "thread" else ProcessPoolExecutor
+        start = time.perf_counter()
+        with executor_type(max_workers=self.workers) as executor:
+            # Only keep `workers` argument sets in flight so fail_fast stops promptly
+            queued = iter(enumerate(items))
+            pending = {}
+            done_count = 0
+            failed = False
+            while True:
+                while not failed and len(pending) < self.workers:
+                    idx, item = next(queued, (None, None))
+                    if item is None:
+                        break
+                    try:
+                        fn = self.fn.with_args(*item.args, **item.kwargs)
+                        if self.wrap:
+                            fn = self.wrap(fn)
+                        pending[executor.submit(run_item, fn, item)] = idx
+                    except Exception as e:
+                        failed_item(item, e)
+                        done_count += 1
+                        self.on_item(done_count, len(items), item)
+                        failed = failed or self.fail_fast
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx = pending.pop(future)
+                    try:
+                        # Process pools hand back a copy
+                        items[idx] = future.result()
+                    except Exception as e:
+                        # Never ran e.g. the script couldn't be pickled
+                        # for a process pool, or the pool broke
+                        failed_item(items[idx], e)
+                    done_count += 1
+                    self.on_item(done_count, len(items), items[idx])
+                    failed = failed or (self.fail_fast and not items[idx].ok)
+        out.items = [i for i in items if i.returncode is not None]
+        out.elapsed = time.perf_counter() - start
+        out.summary()
+        return out
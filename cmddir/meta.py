@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import ast
+import io
+import tokenize
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from cmddir.cmds import Command
+from cmddir.types import PathLike
+
+# Only this much of every script is ever read
+HEADER_BYTES = 8192
+SH_PREFIX = "# cmddir:"
+# Scripts whose header comments are read as by sh_meta
+SH_SUFFIXES = [".sh", ".zsh", ".ps1"]
+META_SUFFIXES = [".py", *SH_SUFFIXES]
+LIST_KEYS = ["shortcuts", "aliases", "cache_env", "depends_on"]
+
+
+@dataclass
+class ScriptMeta:
+    """
+    Metadata of a script read without importing/running it
+
+    .py: the module docstring is the desc and a literal
+        __cmddir__ = {"shortcuts": ["u"], "aliases": ["usage"]}
+    .sh (.zsh, .ps1): header comments before the first command
+        # cmddir: desc=Show disk usage
+        # cmddir: shortcuts=u
+
+    Any Command field can be given, as within config.json, other
+    keys are left out (see unknown_keys)
+
+    has_main is a hint: True/False only when the whole .py file fits
+    in the header and main is plainly there or plainly not, None
+    otherwise (e.g. from x import *). Importing is the final word
+    """
+
+    desc: str = ""
+    config: Dict[str, Any] = field(default_factory=dict)
+    has_main: Optional[bool] = None
+
+    def unknown_keys(self) -> List[str]:
+        known = {f.name for f in fields(Command)}
+        return [k for k in self.config if k not in known]
+
+    def command(self) -> Command:
+        unknown = self.unknown_keys()
+        config = {k: v for k, v in {"desc": self.desc, **self.config}.items() if k not in unknown}
+        return Command(**{"name": None, **config})
+
+
+def read_meta(path: PathLike) -> Optional[ScriptMeta]:
+    path = Path(path)
+    if path.suffix not in META_SUFFIXES:
+        return None
+    with open(path, "rb") as f:
+        header = f.read(HEADER_BYTES + 1)
+    complete = len(header) <= HEADER_BYTES
+    header = header[:HEADER_BYTES]
+    if path.suffix == ".py":
+        return py_meta(header, complete)
+    return sh_meta(header.decode(errors="replace"))
+
+
+def read_all_meta(paths: List[PathLike], workers: int = 8) -> List[Optional[ScriptMeta]]:
+    """
+    Headers are read in parallel, the order of paths is kept
+    """
+    if len(paths) < 2:
+        return [read_meta(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(read_meta, paths))
+
+
+def py_meta(header: bytes, complete: bool = False) -> ScriptMeta:
+    meta = ScriptMeta()
+    if complete:
+        try:
+            module = ast.parse(header)
+        except SyntaxError:
+            return meta
+        meta.desc = _first_line(ast.get_docstring(module) or "")
+        meta.has_main = defines_main(module)
+        for node in module.body:
+            if isinstance(node, ast.Assign) and [
+                t.id for t in node.targets if isinstance(t, ast.Name)
+            ] == ["__cmddir__"]:
+                meta.config = _literal(node.value)
+        return meta
+    # A truncated file won't parse, so pick the docstring and the
+    # __cmddir__ statement out of the tokens instead
+    lines = header.decode(errors="replace").splitlines(keepends=True)
+    tokens = []
+    try:
+        for tok in tokenize.tokenize(io.BytesIO(header).readline):
+            tokens.append(tok)
+    except (tokenize.TokenError, SyntaxError):
+        # Expected where the header cuts a statement in half
+        pass
+    statement_start = True
+    statements = 0
+    for idx, tok in enumerate(tokens):
+        if tok.type in [tokenize.ENCODING, tokenize.COMMENT, tokenize.NL]:
+            continue
+        if tok.type == tokenize.NEWLINE:
+            statement_start = True
+            statements += 1
+            continue
+        if statement_start and statements == 0 and tok.type == tokenize.STRING:
+            meta.desc = _first_line(ast.literal_eval(tok.string))
+        if (
+            statement_start
+            and tok.type == tokenize.NAME
+            and tok.string == "__cmddir__"
+            and idx + 1 < len(tokens)
+            and tokens[idx + 1].string == "="
+        ):
+            end = next((t for t in tokens[idx + 2 :] if t.type == tokenize.NEWLINE), None)
+            if end:
+                value = _slice(lines, tokens[idx + 2].start, end.start)
+                try:
+                    meta.config = _literal(ast.parse(value.strip(), mode="eval").body)
+                except SyntaxError:
+                    pass
+        statement_start = False
+    return meta
+
+
+def defines_main(module: ast.Module) -> Optional[bool]:
+    """
+    main defined, assigned or imported at the top level, including
+    within an if/try/with. None where it can't be told without
+    running the module (a star import)
+    """
+    return _defines_main(module.body)
+
+
+def _defines_main(body: List[ast.stmt]) -> Optional[bool]:
+    found: Optional[bool] = False
+    for node in body:
+        match node:
+            case ast.FunctionDef(name="main") | ast.AsyncFunctionDef(name="main"):
+                return True
+            case ast.Assign(targets=targets) if any(
+                isinstance(t, ast.Name) and t.id == "main" for t in targets
+            ):
+                return True
+            case ast.AnnAssign(target=ast.Name(id="main"), value=value) if value is not None:
+                return True
+            case ast.ImportFrom(names=names) if any(
+                (a.asname or a.name) == "main" for a in names
+            ):
+                return True
+            case ast.ImportFrom(names=names) if any(a.name == "*" for a in names):
+                found = None
+            case ast.If() | ast.Try() | ast.With() | ast.For() | ast.While():
+                blocks = [node.body, getattr(node, "orelse", []), getattr(node, "finalbody", [])]
+                blocks += [h.body for h in getattr(node, "handlers", [])]
+                for block in blocks:
+                    inner = _defines_main(block)
+                    if inner:
+                        return True
+                    if inner is None:
+                        found = None
+    return found
+
+
+def sh_meta(header: str) -> ScriptMeta:
+    meta = ScriptMeta()
+    for line in header.splitlines():
+        line = line.strip()
+        if line.startswith("#!") or not line:
+            continue
+        if not line.startswith("#"):
+            break
+        if not line.startswith(SH_PREFIX):
+            continue
+        key, _, value = line[len(SH_PREFIX) :].partition("=")
+        key, value = key.strip(), value.strip()
+        if key == "desc":
+            meta.desc = value
+        elif key in LIST_KEYS:
+            meta.config[key] = [v.strip() for v in value.split(",") if v.strip()]
+        elif key:
+            meta.config[key] = value
+    return meta
+
+
+def _first_line(doc: str) -> str:
+    return next((l.strip() for l in doc.splitlines() if l.strip()), "")
+
+
+def _literal(node: ast.AST) -> Dict[str, Any]:
+    try:
+        value = ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        # e.g. {"a": 1} | {"b": 2} is a TypeError
+        return {}
+    return value if isinstance(value, dict) else {}
+
+
+def _slice(lines: List[str], start, end) -> str:
+    (srow, scol), (erow, ecol) = start, end
+    if srow == erow:
+        return lines[srow - 1][scol:ecol]
+    return lines[srow - 1][scol:] + "".join(lines[srow : erow - 1]) + lines[erow - 1][:ecol]
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from cmddir.cache import CachedScript
+from cmddir.cmds import Command, SubMenu
+from cmddir.coproc import get_coprocess
+from cmddir.dag import Dag
+from cmddir.matrix import Matrix
+from cmddir.meta import ScriptMeta, read_meta
+from cmddir.runners import runner_for
+from cmddir.types import BashScript, PathLike
+from cmddir.utils import to_ansi_art
+
+# The one .json file of a directory that configures it, any other is data (e.g. matrix args)
+CONFIG_FILE = "config.json"
+
+
+@dataclass(init=False)
+class CmdPaths:
+    """
+    os.walk transformer -> SubMenu
+
+    cmd_root is the resolved root of the Command Structure, module
+    paths of python scripts are relative to it
+    """
+
+    cmd_root: Path
+    root: str
+    root_stem: str
+    dirs: List[str] = field(default_factory=list)
+    fullpaths: List[Path] = field(default_factory=list)
+    # file name -> ScriptMeta, read on the fly where missing
+    meta: Dict[str, Optional[ScriptMeta]] = field(default_factory=dict)
+
+    @staticmethod
+    def create(
+        cmd_root: PathLike, root: str, dirs: List[str], files: List[str]
+    ) -> CmdPaths:
+        root_path = Path(root)
+        assert root_path.exists()
+        paths = CmdPaths()
+        paths.root = root
+        paths.cmd_root = Path(cmd_root).resolve()
+        paths.root_stem = root_path.stem
+        paths.dirs = []
+        paths.meta = {}
+        for d in dirs:
+            CmdPaths.add_init(root_path / d)
+            if not CmdPaths.path_to_ignore(d):
+                paths.dirs.append(d)
+        paths.fullpaths = [
+            # A symlinked script keeps its place within the tree
+            root_path.resolve() / f
+            for f in files
+            if not CmdPaths.path_to_ignore(f) and CmdPaths.file_to_include(root_path / f)
+        ]
+        return paths
+
+    @staticmethod
+    def scan(cmd_root: PathLike, root: PathLike) -> CmdPaths:
+        """
+        Single directory alternative to an os.walk step
+        """
+        dirs, files = [], []
+        for entry in os.scandir(root):
+            # Symlinked directories are never followed, as with os.walk
+            (dirs if entry.is_dir(follow_symlinks=False) else files).append(entry.name)
+        return CmdPaths.create(cmd_root, str(root), dirs, files)
+
+    @staticmethod
+    def path_to_ignore(path: PathLike) -> bool:
+        invalid_contains = ["__pycache__", "__init__.py"]
+        return any([x in str(path) for x in invalid_contains])
+
+    @staticmethod
+    def file_to_include(path: PathLike) -> bool:
+        """config.json or any file a runner takes (see cmddir.runners)"""
+        path = Path(path)
+        return path.name == CONFIG_FILE or runner_for(path) is not None
+
+    @staticmethod
+    def add_init(dir_path: PathLike):
+        dir_path = Path(dir_path)
+        assert dir_path.exists() and dir_path.is_dir()
+        init_path = dir_path / "__init__.py"
+        if not init_path.exists():
+            with open(init_path, "w") as f:
+                f.write("")
+
+    def create_menu(self, *args, **kwargs) -> SubMenu:
+        cmds = []
+        other_cmds = None
+        for path in self.fullpaths:
+            assert path.exists()
+            if path.name == CONFIG_FILE:
+                other_cmds = SubMenu.from_json(path)
+                continue
+            path_struct = list(path.relative_to(self.cmd_root).parts)
+            meta = self.meta[path.name] if path.name in self.meta else read_meta(path)
+            cmds += runner_for(path).commands(path, path_struct, meta, *args, **kwargs)
+        c = SubMenu(
+            name=self.root_stem, 
+            orig_name=self.root_stem, 
+            cmds=cmds,
+            title=to_ansi_art(self.root_stem),
+            shortcuts=[self.root_stem[0]],
+            path=self.root,
+        )
+        if other_cmds:
+            c.update(other_cmds)
+        for cmd in c.cmds:
+            wrap_command(cmd, Path(self.root))
+            if cmd.depends_on:
+                cmd.fn = Dag(c, cmd, cmd.fn, workers=cmd.dag_workers, fail_fast=cmd.fail_fast)
+        return c
+
+
+def wrap_command(cmd: Command, root: Path):
+    """
+    Apply the per Command options from config.json to its fn
+
+    A matrix file path is relative to the directory of the Command
+
+    coproc is "session" for one bash coprocess shared by every BashScript
+    or "dir" for one per directory (which the scripts then run in)
+    """
+    if not cmd.fn:
+        return
+    if cmd.coproc and type(cmd.fn) is BashScript:
+        assert cmd.coproc in ["session", "dir"]
+        cmd.fn.coproc = get_coprocess(root if cmd.coproc == "dir" else None)
+    cache = partial(CachedScript, ttl=cmd.cache_ttl, env=cmd.cache_env) if cmd.cache else None
+    if cmd.matrix:
+        arg_sets = cmd.matrix
+        if isinstance(arg_sets, str) and arg_sets != "-":
+            arg_sets = root / arg_sets
+        cmd.fn = Matrix(
+            cmd.fn,
+            arg_sets,
+            workers=cmd.matrix_workers,
+            mode=cmd.matrix_mode,
+            fail_fast=cmd.fail_fast,
+            wrap=cache,
+        )
+    elif cache:
+        cmd.fn = cache(cmd.fn)
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import io
+import subprocess
+import sys
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from cmddir.cmds import Command, SubMenu
+from cmddir.types import BashScript, PythonScript
+
+
+class PipelineError(Exception):
+    def __init__(self, msg: str):
+        self.message = f"Invalid Pipeline. {msg}"
+        super().__init__(self.message)
+
+
+class PipelineOut(list):
+    """
+    Returncodes of the bash steps, in order. returncode is the
+    first one that failed, 0 when all of them succeeded
+    """
+
+    @property
+    def returncode(self) -> int:
+        return next((rc for rc in self if rc), 0)
+
+
+class Pipeline(Callable):
+    """
+    Chain tree commands such that the output of one step
+    is the input of the next, without buffering in between
+
+    BashScript -> BashScript
+        stdout is handed to the next process as its stdin
+    BashScript -> PythonScript
+        main is called with stdin=<lazy generator of lines>
+    PythonScript -> BashScript
+        whatever main returns/yields is written to stdin line by line
+    PythonScript -> PythonScript
+        main is called with stdin=<what the previous main returned>
+
+    A PythonScript main that is a generator keeps the whole
+    chain streaming, otherwise its return value is passed on
+    """
+
+    def __init__(self, steps: List[Command | Callable]):
+        if not steps:
+            raise PipelineError("A Pipeline needs at least one step")
+        self.steps = [s.fn if isinstance(s, Command) else s for s in steps]
+        for step in self.steps:
+            if not isinstance(step, (BashScript, PythonScript)):
+                raise PipelineError(f"Unsupported step: {step}")
+        self.returncodes: List[Optional[int]] = []
+
+    @staticmethod
+    def from_tree(menu: SubMenu, paths: List[str]) -> Pipeline:
+        steps = []
+        for path in paths:
+            cmd = menu.lookup(path)
+            if not isinstance(cmd, Command) or not cmd.fn:
+                raise PipelineError(f"No command found at: {path}")
+            steps.append(cmd)
+        return Pipeline(steps)
+
+    def stream(self) -> Iterator:
+        procs: List[subprocess.Popen] = []
+        upstream = None
+        finished = False
+        try:
+            for step in self.steps:
+                match step:
+                    case BashScript():
+                        upstream = self._bash_step(step, upstream, procs)
+                    case PythonScript():
+                        upstream = self._python_step(step, upstream)
+            if isinstance(upstream, io.IOBase):
+                upstream = _lines(upstream)
+            yield from upstream or []
+            finished = True
+        finally:
+            for p in procs:
+                if not finished and p.poll() is None:
+                    p.terminate()
+                p.wait()
+            self.returncodes = [p.returncode for p in procs]
+
+    def _bash_step(self, step: BashScript, upstream, procs: List[subprocess.Popen]):
+        if upstream is None or isinstance(upstream, io.IOBase):
+            proc = step.popen(stdin=upstream)
+            if upstream is not None:
+                # Let the previous process get SIGPIPE if this one exits early
+                upstream.close()
+        else:
+            proc = step.popen(stdin=subprocess.PIPE)
+            threading.Thread(target=_feed, args=(proc.stdin, upstream), daemon=True).start()
+        procs.append(proc)
+        return proc.stdout
+
+    def _python_step(self, step: PythonScript, upstream):
+        if upstream is None:
+            result = step()
+        elif isinstance(upstream, io.IOBase):
+            result = step(stdin=_lines(upstream))
+        else:
+            result = step(stdin=upstream)
+        if result is None:
+            return []
+        if isinstance(result, (str, bytes)) or not isinstance(result, Iterable):
+            return [result]
+        return result
+
+    def __call__(self) -> PipelineOut:
+        for line in self.stream():
+            line = line.decode() if isinstance(line, bytes) else str(line)
+            sys.stdout.write(line if line.endswith("\n") else line + "\n")
+        sys.stdout.flush()
+        return PipelineOut(self.returncodes)
+
+
+def attach_pipelines(trees: List[SubMenu]):
+    """
+    Turn the "pipelines" declared in each config.json into Commands
+    of that SubMenu. Step paths are relative to the declaring SubMenu
+    """
+    for tree in trees:
+        for name, paths in tree.pipelines.items():
+            pipeline = Pipeline.from_tree(tree, paths)
+            tree.cmds.append(
+                Command(name=name, orig_name=name, shortcuts=[name[0]], fn=pipeline)
+            )
+
+
+def _lines(stream) -> Iterator[str]:
+    with io.TextIOWrapper(stream) as s:
+        yield from s
+
+
+def _feed(stdin, items: Iterable):
+    try:
+        for item in items:
+            data = item if isinstance(item, bytes) else str(item).encode()
+            stdin.write(data if data.endswith(b"\n") else data + b"\n")
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections import Counter
+from typing import List, Optional
+
+from cmddir.residency import rss
+from cmddir.trace import read_traces
+from cmddir.types import PythonScript, script_of
+
+# How much the background imports may grow this process by, in MiB
+PREIMPORT_BUDGET = int(os.environ.get("CMDDIR_PREIMPORT_BUDGET", 256)) * 1024 * 1024
+# Besides the highlighted Command, this many of the most used in a menu
+PREIMPORT_TOP = 3
+
+
+class Preimporter:
+    """
+    Imports the PythonScripts a user is likely to run next whilst
+    a dropdown waits for a key, so the chosen script starts hot
+
+    Only Commands that opted in are ever imported, as importing
+    runs the module's top level code:
+        {"orig_name": "report", "preimport": true}
+    or "# cmddir: preimport=true" / __cmddir__ = {"preimport": True}
+
+    Candidates are the highlighted Command followed by the most
+    used ones of the menu, by count within $CMDDIR_TRACE_LOG.
+    A newer highlight replaces whatever is still queued. Once
+    the imports have grown the process by budget bytes no more
+    are done for the rest of the session
+    """
+
+    def __init__(self, budget: int = PREIMPORT_BUDGET, top: int = PREIMPORT_TOP):
+        self.budget = budget
+        self.top = top
+        self.used = 0
+        self.queue: List[PythonScript] = []
+        self.cond = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self._usage: Optional[Counter] = None
+
+    def usage(self) -> Counter:
+        if self._usage is None:
+            try:
+                self._usage = Counter(t["name"] for t in read_traces())
+            except (OSError, ValueError, KeyError):
+                self._usage = Counter()
+        return self._usage
+
+    def candidates(self, menu, highlighted) -> List[PythonScript]:
+        opted = [cmd for cmd in menu.cmds if cmd.preimport]
+        if not opted:
+            return []
+        prefix = "/".join(menu.tree_path())
+        usage = self.usage()
+        most_used = sorted(
+            (cmd for cmd in opted if usage[f"{prefix}/{cmd.name}"]),
+            key=lambda cmd: -usage[f"{prefix}/{cmd.name}"],
+        )[: self.top]
+        scripts = []
+        for cmd in ([highlighted] if highlighted in opted else []) + most_used:
+            script = script_of(cmd.fn)
+            if isinstance(script, PythonScript) and script._fn is None and script not in scripts:
+                scripts.append(script)
+        return scripts
+
+    def warm(self, menu, highlighted):
+        if self.used >= self.budget:
+            return
+        scripts = self.candidates(menu, highlighted)
+        if not scripts:
+            return
+        with self.cond:
+            self.queue = scripts
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="cmddir-preimport", daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                script = self.queue.pop(0)
+            if self.used >= self.budget or script._fn is not None:
+                continue
+            before = rss()
+            try:
+                script.load()
+            except Exception:
+                # Surfaces again, to the user, when it is actually run
+                pass
+            self.used += max(rss() - before, 0)
+
+
+_preimporter: Optional[Preimporter] = None
+
+
+def preimporter() -> Preimporter:
+    global _preimporter
+    if _preimporter is None:
+        _preimporter = Preimporter()
+    return _preimporter
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Set
+
+# At most this many script modules stay imported, 0 (the default) for no limit.
+# Unloading resets a module's state and runs its top level code again on next
+# use, so only opt in where the scripts of a tree are fine with that
+MAX_MODULES = int(os.environ.get("CMDDIR_MAX_MODULES", 0))
+# And/or at most this much RSS (MiB) attributed to their imports, 0 for no limit
+MODULE_BUDGET = int(os.environ.get("CMDDIR_MODULE_BUDGET", 0)) * 1024 * 1024
+
+
+def rss() -> int:
+    """Current resident size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        # Peak rather than current, it only ever overestimates
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@dataclass(eq=False)
+class Resident:
+    """
+    A script module that is imported
+
+    modules: what its import added to sys.modules from within the
+    tree (third party/stdlib modules are shared and never unloaded)
+    scripts: every PythonScript holding a main of it
+    """
+
+    module_path: str
+    modules: Set[str] = field(default_factory=set)
+    size: int = 0
+    scripts: weakref.WeakSet = field(default_factory=weakref.WeakSet)
+
+
+class Residency:
+    """
+    LRU of the imported tree script modules
+
+    Once more than max_modules are imported, or their imports
+    grew the process by more than max_bytes, the least recently
+    used is unloaded. Its modules are removed from sys.modules
+    (and from their parent package) and every PythonScript of it
+    drops its main, so it is imported again on its next call
+
+    Off unless $CMDDIR_MAX_MODULES/$CMDDIR_MODULE_BUDGET is set
+    """
+
+    def __init__(self, max_modules: int = MAX_MODULES, max_bytes: int = MODULE_BUDGET):
+        self.max_modules = max_modules
+        self.max_bytes = max_bytes
+        self.residents: OrderedDict[str, Resident] = OrderedDict()
+        self.lock = threading.RLock()
+
+    @property
+    def size(self) -> int:
+        return sum(r.size for r in self.residents.values())
+
+    def load(self, script, import_fn):
+        """
+        Import on behalf of script (see PythonScript.load), noting
+        which tree modules it brought in and how much memory
+
+        The import itself runs outside of the lock (python's own
+        import lock keeps a module from being imported twice) so a
+        slow import, e.g. a background preimport, never holds up
+        another script. Whatever another thread imports meanwhile
+        may be attributed to this one, it is only used to unload
+        """
+        before_modules = set(sys.modules)
+        before = rss()
+        module = import_fn()
+        root = Path(module.__file__).resolve().parents[script.module_path.count(".")]
+        added = {
+            name
+            for name in set(sys.modules) - before_modules
+            if name in sys.modules and _under(sys.modules[name], root)
+        }
+        size = max(rss() - before, 0)
+        with self.lock:
+            resident = self.residents.get(script.module_path) or Resident(script.module_path)
+            resident.modules |= added | {script.module_path}
+            resident.size += size
+            self.residents[script.module_path] = resident
+        return module
+
+    def used(self, script):
+        """script holds a main of its module and was just run/loaded"""
+        with self.lock:
+            resident = self.residents.setdefault(script.module_path, Resident(script.module_path))
+            resident.scripts.add(script)
+            self.residents.move_to_end(script.module_path)
+            self.evict(keep=script.module_path)
+
+    def evict(self, keep: Optional[str] = None):
+        with self.lock:
+            while self._over():
+                victim = next((k for k in self.residents if k != keep), None)
+                if victim is None:
+                    return
+                self.unload(victim)
+
+    def unload(self, module_path: str):
+        with self.lock:
+            resident = self.residents.pop(module_path, None)
+            if resident is None:
+                return
+            for script in list(resident.scripts):
+                script._fn = None
+            # Packages still holding another resident's modules stay
+            others = {m for r in self.residents.values() for m in r.modules}
+            for name in sorted(resident.modules, reverse=True):
+                if any(m.startswith(f"{name}.") for m in others):
+                    continue
+                sys.modules.pop(name, None)
+                parent, _, child = name.rpartition(".")
+                if parent in sys.modules and child in vars(sys.modules[parent]):
+                    delattr(sys.modules[parent], child)
+
+    def _over(self) -> bool:
+        if self.max_modules and len(self.residents) > self.max_modules:
+            return True
+        return bool(self.max_bytes) and self.size > self.max_bytes
+
+
+def _under(module, root: Path) -> bool:
+    file = getattr(module, "__file__", None)
+    return bool(file) and Path(file).resolve().is_relative_to(root)
+
+
+_residency: Optional[Residency] = None
+
+
+def residency() -> Residency:
+    global _residency
+    if _residency is None:
+        _residency = Residency()
+    return _residency
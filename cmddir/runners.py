@@ -0,0 +1,355 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from cmddir import types
+from cmddir.cmds import Command
+from cmddir.coproc import get_coprocess
+from cmddir.dag import Dag
+from cmddir.types import BashScript, K, PathLike, PythonScript
+
+EXECUTORS = ["inline", "thread", "process", "persistent"]
+
+
+class RunnerError(Exception):
+    def __init__(self, msg: str):
+        self.message = f"Invalid runner. {msg}"
+        super().__init__(self.message)
+
+
+class ZshScript(BashScript):
+    interpreter = ["zsh"]
+
+
+class PwshScript(BashScript):
+    interpreter = ["pwsh", "-NoLogo", "-NoProfile", "-File"]
+
+
+class ExecScript(BashScript):
+    """Anything executable, run as is"""
+
+    interpreter = []
+
+
+class MakeTarget(BashScript):
+    """One target of a Makefile, made within the Makefile's directory"""
+
+    def __init__(self, path: PathLike, target: str, *args, **kwargs):
+        super().__init__(path, *args, **kwargs)
+        self.target = target
+        self.cmd = ["make", "--no-print-directory", "-C", str(self.path.parent), "-f", str(self.path), target]
+        self.cmd += [str(x) for x in args]
+
+    def with_args(self, *args, **kwargs) -> MakeTarget:
+        script = MakeTarget(self.path, self.target, *args, **kwargs)
+        script.coproc = self.coproc
+        script.env = self.env
+        return script
+
+
+class Runner(ABC):
+    """
+    How one kind of file in the tree becomes Commands and how those run
+
+    suffixes/names: the files it takes, by suffix or by exact name
+    executor:
+        inline: called on the calling thread
+        thread: on a pool of max_workers threads
+        process: on a pool of max_workers processes, the script has to
+            be picklable (as for a Matrix in process mode)
+        persistent: sourced into a long lived interpreter (shell
+            scripts, see cmddir.coproc), one per session with reuse
+            otherwise one per directory
+    max_workers: runs of its Commands at once, None for no limit inline.
+        Only scripts take a slot, a Dag runs each of its Commands
+        through the runner of that Command instead
+    warm: start the executor as soon as a tree has one of its files
+    reuse: keep the pool between runs, otherwise every run gets a
+        fresh one (nothing a previous run left behind is seen)
+
+    Commands name the runner they came from (Command.runner), a
+    config.json may point one at another registered runner
+    """
+
+    name: str = ""
+    suffixes: List[str] = []
+    names: List[str] = []
+    executor: str = "inline"
+    max_workers: Optional[int] = None
+    warm: bool = False
+    reuse: bool = True
+
+    def __init__(self, **settings):
+        for k, v in settings.items():
+            if not hasattr(self, k):
+                raise RunnerError(f"{k} is not a setting of {type(self).__name__}")
+            setattr(self, k, v)
+        if self.executor not in EXECUTORS:
+            raise RunnerError(f"{self.name}: executor {self.executor} is not one of {EXECUTORS}")
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.max_workers) if self.max_workers else None
+        self._pool: Optional[Executor] = None
+        self.started = False
+
+    def matches(self, path: Path) -> bool:
+        return path.suffix in self.suffixes or path.name in self.names
+
+    @abstractmethod
+    def script(self, path: Path, path_struct: List[str], *args, **kwargs) -> Callable:
+        """The script of a file, see commands"""
+
+    def commands(self, path: Path, path_struct: List[str], meta=None, *args, **kwargs) -> List[Command]:
+        """The Commands of a file, by default the file is one Command"""
+        name = path.stem
+        cmd = Command(name=name, orig_name=name, shortcuts=[name[0]], runner=self.name)
+        if meta:
+            for key in meta.unknown_keys():
+                print(f"Found invalid key in {path}: {key}")
+            cmd.update(meta.command())
+        cmd.fn = self.script(path, path_struct, *args, **kwargs)
+        self.attach(cmd.fn, path)
+        return [cmd]
+
+    def attach(self, fn: Callable, path: Path):
+        """Hook up the executor to a new script"""
+        if self.executor == "persistent" and isinstance(fn, BashScript):
+            fn.coproc = get_coprocess(None if self.reuse else path.parent)
+        if self.warm:
+            self.start()
+
+    def pool(self) -> Executor:
+        workers = self.max_workers or os.cpu_count()
+        if not self.reuse:
+            return (ThreadPoolExecutor if self.executor == "thread" else ProcessPoolExecutor)(workers)
+        with self.lock:
+            if self._pool is None:
+                executor_type = ThreadPoolExecutor if self.executor == "thread" else ProcessPoolExecutor
+                self._pool = executor_type(max_workers=workers)
+            return self._pool
+
+    def start(self):
+        """Warm up: pool workers are started ahead of the first run"""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        if self.executor in ["thread", "process"] and self.reuse:
+            pool = self.pool()
+            for _ in range(self.max_workers or os.cpu_count()):
+                pool.submit(int)
+        elif self.executor == "persistent" and self.reuse:
+            coproc = get_coprocess()
+            with coproc.lock:
+                if not coproc.alive():
+                    coproc.start()
+
+    def call(self, fn: Callable, *args, **kwargs) -> Optional[K]:
+        if isinstance(fn, Dag):
+            # Held slots would starve the dependencies it waits on
+            return fn(*args, **kwargs)
+        with self.slots or nullcontext():
+            if self.executor not in ["thread", "process"]:
+                return fn(*args, **kwargs)
+            pool = self.pool()
+            try:
+                return pool.submit(fn, *args, **kwargs).result()
+            finally:
+                if not self.reuse:
+                    pool.shutdown(wait=False)
+
+    async def acall(self, fn: Callable, *args, **kwargs) -> Optional[K]:
+        """
+        call awaited, taking a slot the same way. Inline scripts run on
+        the loop (see types.acall), a cancelled wait for a slot gives
+        back the one it got meanwhile. Cancelling a thread or process
+        run leaves the script to finish, as a Future's cancel would
+        """
+        if isinstance(fn, Dag) or self.executor in ["thread", "process"]:
+            return await asyncio.to_thread(self.call, fn, *args, **kwargs)
+        if self.slots is None:
+            return await types.acall(fn, *args, **kwargs)
+        if not self.slots.acquire(blocking=False):
+            waiting = asyncio.ensure_future(asyncio.to_thread(self.slots.acquire))
+            try:
+                await asyncio.shield(waiting)
+            except asyncio.CancelledError:
+                waiting.add_done_callback(lambda _: self.slots.release())
+                raise
+        try:
+            return await types.acall(fn, *args, **kwargs)
+        finally:
+            self.slots.release()
+
+    def shutdown(self):
+        with self.lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self.started = False
+
+
+class PythonRunner(Runner):
+    name = "python"
+    suffixes = [".py"]
+
+    def commands(self, path: Path, path_struct: List[str], meta=None, *args, **kwargs) -> List[Command]:
+        cmds = super().commands(path, path_struct, meta, *args, **kwargs)
+        if meta and meta.has_main is False:
+            # Only a hint, the import raises InvalidScriptError if main really is missing
+            cmds[0].fn.load()
+        return cmds
+
+    def script(self, path: Path, path_struct: List[str], *args, **kwargs) -> PythonScript:
+        return PythonScript.lazy(path_struct, path, *args, **kwargs)
+
+
+class ShellRunner(Runner):
+    """A script handed to an interpreter, see BashScript.interpreter"""
+
+    script_type = BashScript
+
+    def script(self, path: Path, path_struct: List[str], *args, **kwargs) -> BashScript:
+        return self.script_type(path, *args, **kwargs)
+
+    def attach(self, fn: Callable, path: Path):
+        if self.executor == "persistent" and self.script_type is not BashScript:
+            raise RunnerError(f"{self.name}: only bash scripts can be sourced into a coprocess")
+        super().attach(fn, path)
+
+
+class BashRunner(ShellRunner):
+    name = "bash"
+    suffixes = [".sh"]
+
+
+class ZshRunner(ShellRunner):
+    name = "zsh"
+    suffixes = [".zsh"]
+    script_type = ZshScript
+
+
+class PwshRunner(ShellRunner):
+    name = "pwsh"
+    suffixes = [".ps1"]
+    script_type = PwshScript
+
+
+class ExecRunner(ShellRunner):
+    """Any executable file no other runner took"""
+
+    name = "exec"
+    script_type = ExecScript
+
+    def matches(self, path: Path) -> bool:
+        return os.access(path, os.X_OK) and path.is_file()
+
+
+# Rules of a Makefile, patterns (%), variables ($) and special targets (.PHONY) aside
+MAKE_RULE = re.compile(r"^([^\s:#=.$%][^:#=$%]*?)\s*::?(?!=)")
+
+
+class MakeRunner(Runner):
+    """Every target of a Makefile is a Command of its own"""
+
+    name = "make"
+    names = ["Makefile", "makefile", "GNUmakefile"]
+
+    def commands(self, path: Path, path_struct: List[str], meta=None, *args, **kwargs) -> List[Command]:
+        cmds = []
+        for target in make_targets(path):
+            cmd = Command(name=target, orig_name=target, shortcuts=[target[0]], runner=self.name)
+            cmd.fn = self.script(path, path_struct, *args, target=target, **kwargs)
+            self.attach(cmd.fn, path)
+            cmds.append(cmd)
+        return cmds
+
+    def attach(self, fn: Callable, path: Path):
+        if self.executor == "persistent":
+            raise RunnerError(f"{self.name}: a Makefile can't be sourced into a coprocess")
+        super().attach(fn, path)
+
+    def script(self, path: Path, path_struct: List[str], *args, target: str, **kwargs) -> MakeTarget:
+        return MakeTarget(path, target, *args, **kwargs)
+
+
+def make_targets(path: PathLike) -> List[str]:
+    targets = []
+    with open(path, errors="replace") as f:
+        for line in f:
+            match = MAKE_RULE.match(line)
+            if match:
+                targets += [t for t in match.group(1).split() if t not in targets]
+    return targets
+
+
+_runners: Dict[str, Runner] = {}
+
+
+def register(runner: Runner, first: bool = False):
+    """
+    Add (or replace, by name) a runner. Files go to the first runner
+    that matches them, first puts it ahead of the registered ones.
+    A variant registered after e.g. PythonRunner(name="py-pool",
+    executor="process") only runs the Commands that name it
+    """
+    _runners.pop(runner.name, None)
+    if first:
+        items = list(_runners.items())
+        _runners.clear()
+        _runners[runner.name] = runner
+        _runners.update(items)
+    else:
+        _runners[runner.name] = runner
+
+
+def configure(name: str, **settings) -> Runner:
+    """e.g. configure("python", executor="process", max_workers=4, warm=True)"""
+    runner = get_runner(name)
+    if runner is None:
+        raise RunnerError(f"no runner named {name}")
+    runner.shutdown()
+    current = {k: getattr(runner, k) for k in ["name", "executor", "max_workers", "warm", "reuse"]}
+    new = type(runner)(**{**current, **settings})
+    _runners[name] = new
+    return new
+
+
+def get_runner(name: str) -> Optional[Runner]:
+    return _runners.get(name)
+
+
+def runner_for(path: PathLike) -> Optional[Runner]:
+    path = Path(path)
+    return next((r for r in _runners.values() if r.matches(path)), None)
+
+
+def runners() -> List[Runner]:
+    return list(_runners.values())
+
+
+def call(cmd: Command, *args, **kwargs) -> Optional[K]:
+    """Run cmd.fn through the executor of its runner"""
+    runner = _runners.get(cmd.runner) if cmd.runner else None
+    if runner is None:
+        return cmd.fn(*args, **kwargs)
+    return runner.call(cmd.fn, *args, **kwargs)
+
+
+async def acall(cmd: Command, *args, **kwargs) -> Optional[K]:
+    """call awaited, see Runner.acall"""
+    runner = _runners.get(cmd.runner) if cmd.runner else None
+    if runner is None:
+        return await types.acall(cmd.fn, *args, **kwargs)
+    return await runner.acall(cmd.fn, *args, **kwargs)
+
+
+for _runner in [PythonRunner(), BashRunner(), ZshRunner(), PwshRunner(), MakeRunner(), ExecRunner()]:
+    register(_runner)
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import mmap
+import re
+import shutil
+import tempfile
+from array import array
+from typing import Iterator, List, Optional, Tuple
+
+from bullet import utils
+
+# Output up to this size is kept in memory, anything larger spills to a temp file
+SPOOL_THRESHOLD = 4 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class SpooledOutput:
+    """
+    Captured output of a script (see BashOut)
+
+    Small output stays in memory, once it grows past max_size it is
+    moved to a temp file which is read back through an mmap. Nothing
+    is decoded until asked for so a few GB of output never has to fit
+    in memory as a str
+
+    lines/tail/search/page only touch the part of the output they need,
+    str() still gives back the whole output as before. line() indexes
+    every line on first use, page() doesn't
+    """
+
+    def __init__(self, max_size: int = SPOOL_THRESHOLD):
+        self.max_size = max_size
+        self.memory = bytearray()
+        self.file = None
+        self.size = 0
+        self._map: Optional[mmap.mmap] = None
+        self._line_starts: Optional[array] = None
+
+    @staticmethod
+    def from_bytes(data: bytes, max_size: int = SPOOL_THRESHOLD) -> SpooledOutput:
+        out = SpooledOutput(max_size)
+        out.write(data)
+        return out
+
+    @staticmethod
+    def from_stream(stream, max_size: int = SPOOL_THRESHOLD) -> SpooledOutput:
+        out = SpooledOutput(max_size)
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            out.write(chunk)
+        return out
+
+    @property
+    def spilled(self) -> bool:
+        return self.file is not None
+
+    def write(self, data: bytes):
+        assert self._map is None, "SpooledOutput is read only once viewed"
+        self.size += len(data)
+        if self.file is None and len(self.memory) + len(data) <= self.max_size:
+            self.memory += data
+            return
+        if self.file is None:
+            self.file = tempfile.TemporaryFile()
+            self.file.write(self.memory)
+            self.memory = bytearray()
+        self.file.write(data)
+
+    def view(self) -> bytes | bytearray | mmap.mmap:
+        if not self.spilled:
+            return self.memory
+        if self._map is None:
+            self.file.flush()
+            self._map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def line_starts(self) -> array:
+        """Byte offset of every line, found without decoding anything"""
+        if self._line_starts is None:
+            data = self.view()
+            starts = array("Q", [0] if self.size else [])
+            pos = data.find(b"\n")
+            while pos != -1 and pos + 1 < self.size:
+                starts.append(pos + 1)
+                pos = data.find(b"\n", pos + 1)
+            self._line_starts = starts
+        return self._line_starts
+
+    def line(self, idx: int) -> str:
+        starts = self.line_starts()
+        end = starts[idx + 1] if idx + 1 < len(starts) else self.size
+        return bytes(self.view()[starts[idx] : end]).decode(errors="replace").rstrip("\n")
+
+    def lines(self) -> Iterator[str]:
+        data = self.view()
+        start = 0
+        while start < self.size:
+            end = data.find(b"\n", start)
+            end = self.size if end == -1 else end + 1
+            yield bytes(data[start:end]).decode(errors="replace").rstrip("\n")
+            start = end
+
+    def tail(self, n: int = 10) -> List[str]:
+        data = self.view()
+        end = self.size - 1 if self.size and data[self.size - 1 : self.size] == b"\n" else self.size
+        start = end
+        for _ in range(n):
+            start = data.rfind(b"\n", 0, start)
+            if start == -1:
+                break
+        chunk = bytes(data[start + 1 : end])
+        return chunk.decode(errors="replace").split("\n") if chunk or start != -1 else []
+
+    def search(self, pattern: str, flags: int = 0) -> Iterator[Tuple[int, str]]:
+        """(byte offset, line) of every line matching pattern"""
+        data = self.view()
+        end = -1
+        for match in re.finditer(pattern.encode(), data, flags):
+            if match.start() <= end:
+                continue
+            start = data.rfind(b"\n", 0, match.start()) + 1
+            end = data.find(b"\n", match.start())
+            end = self.size if end == -1 else end
+            yield start, bytes(data[start:end]).decode(errors="replace")
+
+    def page(self, height: Optional[int] = None):
+        """
+        Minimal pager over the output, only the visible lines are read.
+        The position is kept as a byte offset so nothing is indexed
+        up front, the status line shows how far in it is
+
+        j/k: line down/up, space/b: page down/up, g/G: top/bottom, q: quit
+        """
+        height = height or shutil.get_terminal_size().lines - 1
+        data = self.view()
+        last = self.size
+        for _ in range(height):
+            last = self._line_before(data, last)
+        top = 0
+        while True:
+            utils.forceWrite("\033[2J\033[H")
+            pos = top
+            for _ in range(height):
+                if pos >= self.size:
+                    break
+                end = self._line_after(data, pos)
+                utils.forceWrite(bytes(data[pos:end]).decode(errors="replace").rstrip("\n") + "\n")
+                pos = end
+            utils.forceWrite(f"-- {100 if pos >= self.size else pos * 100 // self.size}% --")
+            key = utils.getchar()
+            match key:
+                case "q":
+                    utils.forceWrite("\n")
+                    return
+                case "j":
+                    top = min(self._line_after(data, top), last)
+                case "k":
+                    top = self._line_before(data, top)
+                case " ":
+                    for _ in range(height):
+                        top = min(self._line_after(data, top), last)
+                case "b":
+                    for _ in range(height):
+                        top = self._line_before(data, top)
+                case "g":
+                    top = 0
+                case "G":
+                    top = last
+
+    def _line_after(self, data, pos: int) -> int:
+        """Offset of the line following the one at pos"""
+        end = data.find(b"\n", pos)
+        return self.size if end == -1 else end + 1
+
+    @staticmethod
+    def _line_before(data, pos: int) -> int:
+        """Offset of the line preceding the one at pos"""
+        return data.rfind(b"\n", 0, pos - 1) + 1 if pos > 0 else 0
+
+    def text(self) -> str:
+        return bytes(self.view()).decode(errors="replace")
+
+    def __str__(self) -> str:
+        return self.text()
+
+    def __repr__(self) -> str:
+        where = "file" if self.spilled else "memory"
+        return f"SpooledOutput(size={self.size}, {where})"
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, str):
+            return self.text() == other
+        if isinstance(other, SpooledOutput):
+            return self.size == other.size and self.view()[:] == other.view()[:]
+        return NotImplemented
+
+    def __contains__(self, item: str) -> bool:
+        return self.view().find(item.encode()) != -1
+
+    def __reduce__(self):
+        return (SpooledOutput.from_bytes, (bytes(self.view()), self.max_size))
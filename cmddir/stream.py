@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import json
+import sys
+from collections import deque
+from pathlib import Path
+from typing import IO, Iterator, List, Tuple
+
+from cmddir.cmds import SubMenu
+from cmddir.env import set_env
+from cmddir.paths import CmdPaths
+from cmddir.pipeline import attach_pipelines
+from cmddir.types import PathLike, script_path
+
+
+def _walk(cmd_path: PathLike, link: bool, *args, **kwargs) -> Iterator[Tuple[SubMenu, List[str]]]:
+    cmd_root = Path(cmd_path)
+    # Only directories still to be scanned are held, along with their
+    # parent (when linked) and the .env variables it hands down
+    pending = deque([(cmd_root, None, 1, {})])
+    while pending:
+        path, parent, level, inherited = pending.popleft()
+        paths = CmdPaths.scan(cmd_root, path)
+        menu = paths.create_menu(*args, **kwargs)
+        menu.level = level
+        menu.parent = parent
+        if link and parent is not None:
+            parent.children.append(menu)
+        attach_pipelines([menu])
+        set_env(menu, inherited)
+        dirs = sorted(paths.dirs)
+        pending.extend((path / d, menu if link else None, level + 1, menu.env) for d in dirs)
+        yield menu, dirs
+
+
+def iter_tree(cmd_path: PathLike, *args, link: bool = True, **kwargs) -> Iterator[SubMenu]:
+    """
+    Yield every SubMenu in BFS order (the root first) as soon as its
+    directory is scanned. It is already linked to its parent, its
+    children are appended as they are yielded in turn
+
+    With link=False nothing is linked such that a consumer that drops
+    each SubMenu walks a tree of any size in constant memory
+    """
+    for menu, _ in _walk(cmd_path, link, *args, **kwargs):
+        yield menu
+
+
+def menu_record(menu: SubMenu, cmd_root: Path, dirs: List[str]) -> dict:
+    path = Path(menu.path).relative_to(cmd_root)
+    return {
+        "path": "" if path == Path(".") else path.as_posix(),
+        "name": menu.name,
+        "level": menu.level,
+        "shortcuts": menu.shortcuts,
+        "desc": menu.desc,
+        "dirs": dirs,
+        "cmds": [
+            {
+                "name": cmd.name,
+                "orig_name": cmd.orig_name,
+                "shortcuts": cmd.shortcuts,
+                "aliases": cmd.aliases,
+                "desc": cmd.desc,
+                "file": script_path(cmd.fn),
+            }
+            for cmd in menu.cmds
+        ],
+    }
+
+
+def export_ndjson(cmd_path: PathLike, out: IO[str] = sys.stdout, *args, **kwargs) -> int:
+    """
+    One json line per SubMenu, in the order of iter_tree. path is
+    relative to cmd_path ("" for the root) and dirs names the
+    children. Returns the number of lines written
+    """
+    cmd_root = Path(cmd_path)
+    count = 0
+    for menu, dirs in _walk(cmd_root, False, *args, **kwargs):
+        out.write(json.dumps(menu_record(menu, cmd_root, dirs), default=str) + "\n")
+        count += 1
+    return count
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from cmddir.types import PathLike
+from cmddir.utils import notify, style, _colors
+
+
+def trace_log_path(path: Optional[PathLike] = None) -> Path:
+    """The log dispatch appends to, see $CMDDIR_TRACE_LOG"""
+    if path:
+        return Path(path)
+    if os.environ.get("CMDDIR_TRACE_LOG"):
+        return Path(os.environ["CMDDIR_TRACE_LOG"])
+    raise FileNotFoundError("No trace log given and $CMDDIR_TRACE_LOG is not set")
+
+
+def read_traces(path: Optional[PathLike] = None) -> List[dict]:
+    traces = []
+    with open(trace_log_path(path)) as f:
+        for line in f:
+            if line.strip():
+                traces.append(json.loads(line))
+    return traces
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest rank percentile of values"""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def trace_report(path: Optional[PathLike] = None) -> Dict[str, dict]:
+    """
+    Per command path: count, p50/p95 wall time, mean cpu,
+    peak rss, failures and mean output size
+
+    rss_process marks a peak rss that is the whole process's
+    rather than the command's (see Trace.max_rss_scope)
+    """
+    by_name: Dict[str, List[dict]] = defaultdict(list)
+    for trace in read_traces(path):
+        by_name[trace["name"]].append(trace)
+    report = {}
+    for name, traces in by_name.items():
+        walls = [t["wall"] for t in traces]
+        report[name] = {
+            "count": len(traces),
+            "p50": percentile(walls, 50),
+            "p95": percentile(walls, 95),
+            "cpu": sum(t["cpu_user"] + t["cpu_sys"] for t in traces) / len(traces),
+            "max_rss": max(t["max_rss"] for t in traces),
+            # Any of them only knew the peak of the whole process
+            "rss_process": any(t.get("max_rss_scope") == "process" for t in traces),
+            "failed": sum(1 for t in traces if t["returncode"] or t["error"]),
+            "output": sum(t["output_size"] for t in traces) // len(traces),
+        }
+    return report
+
+
+def print_trace_report(path: Optional[PathLike] = None):
+    report = trace_report(path)
+    if not report:
+        notify("No traces recorded")
+        return
+    width = max(len(name) for name in report)
+    header = f"{'command':<{width}}  {'count':>6}  {'p50':>8}  {'p95':>8}  {'cpu':>8}  {'rss KiB':>9}  {'failed':>6}"
+    notify(header, sep=True)
+    # Slowest first
+    for name, r in sorted(report.items(), key=lambda x: -x[1]["p95"]):
+        rss = f"{r['max_rss']}{'*' if r['rss_process'] else ''}"
+        row = (
+            f"{r['count']:>6}  {r['p50']:>7.3f}s  {r['p95']:>7.3f}s  "
+            f"{r['cpu']:>7.3f}s  {rss:>9}  {r['failed']:>6}"
+        )
+        print(style(f"{name:<{width}}  ", _colors.notify_kv.k) + style(row, _colors.notify_kv.v))
+    if any(r["rss_process"] for r in report.values()):
+        notify("* peak rss of the whole cmddir process, not of the command alone")
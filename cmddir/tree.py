@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import pickle
+import threading
+from array import array
+from collections.abc import Sequence
+from functools import partial
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from cmddir.cache import CACHE_DIR, load_pickle, write_private
+from cmddir.cmds import SubMenu
+from cmddir.meta import ScriptMeta, read_all_meta
+from cmddir.paths import CmdPaths
+from cmddir.types import PathLike
+
+
+class FlatTree:
+    """
+    Compact store of a Command Structure
+
+    Node ids are handed out in BFS order such that a parent id is
+    always lower than its child ids, the children of a node are
+    contiguous and depth never decreases. Per node it holds:
+
+    parents: id of the parent, -1 for the root
+    depth: 0 for the root
+    name_start/name_end: slice of the directory name within strings
+    child_start/child_end: range of the children ids
+    file_start/file_end: range of its files within file_name_start/file_name_end
+
+    Every name is a slice of one string table. SubMenus are only
+    created on demand (see FlatTree.menu), a node's children are
+    placeholders until it is loaded
+
+    meta holds the ScriptMeta of every file (by file id), read in
+    parallel once the structure has been scanned
+    """
+
+    def __init__(self, cmd_root: PathLike):
+        self.cmd_root = Path(cmd_root)
+        self.parents = array("i")
+        self.depth = array("H")
+        self.name_start = array("I")
+        self.name_end = array("I")
+        self.child_start = array("I")
+        self.child_end = array("I")
+        self.file_start = array("I")
+        self.file_end = array("I")
+        self.file_name_start = array("I")
+        self.file_name_end = array("I")
+        self.strings = ""
+        self.meta: List[Optional[ScriptMeta]] = []
+        self.views: Dict[int, SubMenu] = {}
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def __getstate__(self) -> dict:
+        # Views hold loaded scripts, they are built again per process
+        return {k: v for k, v in self.__dict__.items() if k not in ["views", "lock"]}
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.views = {}
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def fingerprint(cmd_root: PathLike) -> str:
+        """
+        Hash of every directory/file the tree is made of along with
+        the mtime and size of each file, nothing is read
+        """
+        h = hashlib.sha256()
+        stack = [str(cmd_root)]
+        while stack:
+            root = stack.pop()
+            entries = sorted(
+                (e for e in os.scandir(root) if not CmdPaths.path_to_ignore(e.name)),
+                key=lambda e: e.name,
+            )
+            for entry in entries:
+                # Symlinked directories are never followed (cycles, links out of the root)
+                if entry.is_dir(follow_symlinks=False):
+                    h.update(f"d {entry.path}\n".encode())
+                    stack.append(entry.path)
+                elif CmdPaths.file_to_include(entry.path):
+                    stat = entry.stat()
+                    h.update(f"f {entry.path} {stat.st_mtime_ns} {stat.st_size}\n".encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def cached(cmd_root: PathLike, cache_dir: PathLike = CACHE_DIR / "trees", workers: int = 8) -> FlatTree:
+        """
+        FlatTree.build, reused from cache_dir for as long as the
+        fingerprint of cmd_root stays the same. Every root gets a
+        cache of its own, read and written like the disk tier of a
+        ResultCache (owned by this user, 0o600)
+        """
+        cmd_root = Path(cmd_root).resolve()
+        cache_file = Path(cache_dir) / f"{hashlib.sha1(str(cmd_root).encode()).hexdigest()}.pickle"
+        fingerprint = FlatTree.fingerprint(cmd_root)
+        try:
+            cached_fingerprint, tree = load_pickle(cache_file)
+            if cached_fingerprint == fingerprint:
+                return tree
+        except (OSError, pickle.PickleError, EOFError, ValueError, AttributeError):
+            pass
+        # Taken before building, a change made meanwhile means a rebuild next time
+        tree = FlatTree.build(cmd_root, workers)
+        write_private(cache_file, pickle.dumps((fingerprint, tree)))
+        return tree
+
+    @staticmethod
+    def build(cmd_root: PathLike, workers: int = 8) -> FlatTree:
+        """
+        Single BFS pass over the directory tree, each directory is
+        scanned exactly once and nothing is sorted afterwards
+        """
+        tree = FlatTree(cmd_root)
+        pieces: List[str] = []
+        offset = 0
+
+        def add_string(s: str) -> Tuple[int, int]:
+            nonlocal offset
+            pieces.append(s)
+            offset += len(s)
+            return offset - len(s), offset
+
+        # Only needed whilst building, ids index into them
+        dirs: List[str] = [str(tree.cmd_root)]
+        file_paths: List[str] = []
+        start, end = add_string(tree.cmd_root.name)
+        tree._add_node(-1, 0, start, end)
+        node = 0
+        while node < len(dirs):
+            sub_dirs, files = [], []
+            for entry in os.scandir(dirs[node]):
+                if CmdPaths.path_to_ignore(entry.name):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    sub_dirs.append(entry.name)
+                elif CmdPaths.file_to_include(entry.path):
+                    files.append(entry.name)
+            tree.file_start.append(len(tree.file_name_start))
+            for f in sorted(files):
+                file_paths.append(os.path.join(dirs[node], f))
+                start, end = add_string(f)
+                tree.file_name_start.append(start)
+                tree.file_name_end.append(end)
+            tree.file_end.append(len(tree.file_name_start))
+            tree.child_start.append(len(dirs))
+            for d in sorted(sub_dirs):
+                CmdPaths.add_init(Path(dirs[node]) / d)
+                dirs.append(os.path.join(dirs[node], d))
+                start, end = add_string(d)
+                tree._add_node(node, tree.depth[node] + 1, start, end)
+            tree.child_end.append(len(dirs))
+            dirs[node] = None
+            node += 1
+        tree.strings = "".join(pieces)
+        tree.meta = read_all_meta(file_paths, workers)
+        return tree
+
+    def _add_node(self, parent: int, depth: int, start: int, end: int):
+        self.parents.append(parent)
+        self.depth.append(depth)
+        self.name_start.append(start)
+        self.name_end.append(end)
+
+    def name(self, node: int) -> str:
+        return self.strings[self.name_start[node] : self.name_end[node]]
+
+    def children(self, node: int) -> range:
+        return range(self.child_start[node], self.child_end[node])
+
+    def files(self, node: int) -> Iterator[str]:
+        for f in range(self.file_start[node], self.file_end[node]):
+            yield self.strings[self.file_name_start[f] : self.file_name_end[f]]
+
+    def parts(self, node: int) -> List[str]:
+        """Directory names from below the root down to node"""
+        parts = []
+        while node > 0:
+            parts.append(self.name(node))
+            node = self.parents[node]
+        return parts[::-1]
+
+    def module_names(self) -> Set[str]:
+        """Dotted name of every package and python script of the tree"""
+        names = set()
+        for node in range(len(self)):
+            parts = self.parts(node)
+            if parts:
+                names.add(".".join(parts))
+            names.update(".".join(parts + [f[:-3]]) for f in self.files(node) if f.endswith(".py"))
+        return names
+
+    def dir(self, node: int) -> Path:
+        return self.cmd_root.joinpath(*self.parts(node))
+
+    def view(self, node: int) -> SubMenu:
+        """SubMenu of a single node on its own, unlinked"""
+        names = [self.name(c) for c in self.children(node)]
+        files = list(self.files(node))
+        paths = CmdPaths.create(self.cmd_root, str(self.dir(node)), names, files)
+        file_ids = range(self.file_start[node], self.file_end[node])
+        paths.meta = {f: self.meta[i] for f, i in zip(files, file_ids)}
+        menu = paths.create_menu()
+        menu.level = self.depth[node] + 1
+        return menu
+
+    def menu(self, node: int) -> SubMenu:
+        """
+        The linked SubMenu of node, loading whatever is above it
+        first. Every later call hands back the same SubMenu
+        """
+        with self.lock:
+            if node not in self.views:
+                parent = self.parents[node]
+                if parent < 0:
+                    self._placeholder(node, None)
+                else:
+                    # Loading the parent puts node's placeholder in views
+                    self.menu(parent)
+            return self.views[node].load()
+
+    def _placeholder(self, node: int, parent: Optional[SubMenu]) -> SubMenu:
+        menu = SubMenu.placeholder(self.dir(node), partial(self._load, node), self.depth[node] + 1)
+        menu.parent = parent
+        self.views[node] = menu
+        return menu
+
+    def _load(self, node: int, menu: SubMenu):
+        """Loader of a placeholder, from the arrays so nothing is scanned"""
+        from cmddir.env import attach_env
+        from cmddir.pipeline import attach_pipelines
+
+        with self.lock:
+            if not menu.loader:
+                return
+            loaded = self.view(node)
+            loaded.children = [self._placeholder(c, menu) for c in self.children(node)]
+            menu.absorb(loaded)
+            menu.loader = None
+            attach_pipelines([menu])
+            attach_env([menu])
+
+    def menus(self) -> FlatMenus:
+        """
+        Every node as a linked SubMenu, the root first followed by
+        each level in turn. Each is only created when it is first
+        indexed/iterated over
+        """
+        return FlatMenus(self)
+
+
+class FlatMenus(Sequence):
+    """
+    The SubMenus of a FlatTree by node id, in place of a list of
+    them all. Iterating over it creates every one of them
+    """
+
+    def __init__(self, tree: FlatTree):
+        self.tree = tree
+
+    def __len__(self) -> int:
+        return len(self.tree)
+
+    def __getitem__(self, idx: int | slice) -> SubMenu | List[SubMenu]:
+        if isinstance(idx, slice):
+            return [self.tree.menu(node) for node in range(len(self))[idx]]
+        if not -len(self) <= idx < len(self):
+            raise IndexError(idx)
+        return self.tree.menu(idx % len(self))
+
+    def __iter__(self) -> Iterator[SubMenu]:
+        for node in range(len(self)):
+            yield self.tree.menu(node)
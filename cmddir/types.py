@@ -1,13 +1,25 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import os
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from copy import copy
 from dataclasses import dataclass, field
 from functools import partial
 from importlib import import_module
 from pathlib import Path
-from typing import Callable, List, Optional, TypeAlias, TypeVar
+from typing import Any, Callable, Dict, List, Optional, TypeAlias, TypeVar
 
 from box import Box
 from bullet import colors
 
+from cmddir.residency import residency
+from cmddir.spool import CHUNK_SIZE, SpooledOutput
+
 K = TypeVar("K")
 PathLike: TypeAlias = str | Path
 Fg = Box(colors.foreground)
@@ -15,10 +27,68 @@ Bg = Box(colors.background)
 Color: TypeAlias = Fg | Bg
 
 
-@dataclass
+@dataclass(init=False)
 class BashOut:
-    stdout: Optional[str]
-    stderr: Optional[str]
+    """
+    stdout/stderr are str as ever, decoded from the spooled output
+    behind them (see SpooledOutput) the first time they are read.
+    For large output use stdout_spool/stderr_spool directly, their
+    lines/tail/search/page never decode the whole of it
+    """
+
+    stdout_spool: Optional[SpooledOutput] = None
+    stderr_spool: Optional[SpooledOutput] = None
+    returncode: Optional[int] = None
+    # resource usage of the bash process itself (see os.wait4)
+    rusage: Optional[Any] = None
+
+    def __init__(
+        self,
+        stdout: Optional[str | SpooledOutput] = None,
+        stderr: Optional[str | SpooledOutput] = None,
+        returncode: Optional[int] = None,
+        rusage: Optional[Any] = None,
+    ):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = returncode
+        self.rusage = rusage
+
+    @property
+    def stdout(self) -> Optional[str]:
+        if self._stdout is None and self.stdout_spool is not None:
+            self._stdout = self.stdout_spool.text()
+        return self._stdout
+
+    @stdout.setter
+    def stdout(self, value: Optional[str | SpooledOutput]):
+        self.stdout_spool, self._stdout = _spooled(value)
+
+    @property
+    def stderr(self) -> Optional[str]:
+        if self._stderr is None and self.stderr_spool is not None:
+            self._stderr = self.stderr_spool.text()
+        return self._stderr
+
+    @stderr.setter
+    def stderr(self, value: Optional[str | SpooledOutput]):
+        self.stderr_spool, self._stderr = _spooled(value)
+
+    @property
+    def spilled(self) -> bool:
+        """Output went to disk, too large to be pickled along (see ResultCache)"""
+        return any(s is not None and s.spilled for s in [self.stdout_spool, self.stderr_spool])
+
+    def __getstate__(self) -> dict:
+        # The decoded str is made again from the spool
+        return {**vars(self), "_stdout": None, "_stderr": None}
+
+
+def _spooled(value: Optional[str | SpooledOutput]):
+    """(spool, str) of either"""
+    if value is None or isinstance(value, SpooledOutput):
+        return value, None
+    return SpooledOutput.from_bytes(value.encode()), value
 
 
 class InvalidScriptError(Exception):
@@ -34,14 +104,42 @@ class PythonScript(Callable):
     things can be passed from a previous step to this
 
     Optionally return whatever the function produces
+
+    main may also be a coroutine function (async def main), it is
+    run to completion when called synchronously or awaited via acall.
+    With an env it runs on an event loop of its own in a thread, the
+    one awaiting it can't have os.environ swapped underneath it
     """
 
     def __init__(self, path_struct: List[str], *args, **kwargs):
+        self.bind(path_struct, args, kwargs)
+        self.path = None
+        self.load()
+
+    @staticmethod
+    def lazy(path_struct: List[str], path: PathLike, *args, **kwargs) -> PythonScript:
+        """
+        Defer the import until the script is first called
+        """
+        script = PythonScript.__new__(PythonScript)
+        script.bind(path_struct, args, kwargs)
+        script.path = Path(path)
+        return script
+
+    def bind(self, path_struct: List[str], args: tuple, kwargs: dict):
         py_file = path_struct[-1].replace(".py", "")
         path_struct[-1] = py_file
-        module_path = ".".join(path_struct)
+        self.module_path = ".".join(path_struct)
+        self.args = args
+        self.kwargs = kwargs
+        self._fn = None
+        # Applied to os.environ whilst main runs (see environ)
+        self.env: Optional[Dict[str, str]] = None
+
+    def load(self) -> partial:
+        module_path = self.module_path
         try:
-            imported_module = import_module(module_path)
+            imported_module = residency().load(self, lambda: import_module(module_path))
         except ModuleNotFoundError:
             raise InvalidScriptError(f"Does the script: {module_path} exist?")
         # Check for main method
@@ -50,10 +148,47 @@ class PythonScript(Callable):
         main_method = imported_module.main
         if not callable(main_method):
             raise InvalidScriptError(f"Is main a method in {module_path}?")
-        self.fn = partial(main_method, *args, **kwargs)
+        self.path = Path(imported_module.__file__)
+        # Handed back rather than read from _fn, which another thread may unload meanwhile
+        fn = self._fn = partial(main_method, *self.args, **self.kwargs)
+        residency().used(self)
+        return fn
+
+    @property
+    def fn(self) -> partial:
+        """
+        main bound to the args, imported again if it was
+        unloaded in the meantime (see cmddir.residency)
+        """
+        fn = self._fn
+        if fn is None:
+            return self.load()
+        residency().used(self)
+        return fn
+
+    def __call__(self, *args, **kwargs) -> Optional[K]:
+        with environ(self.env):
+            result = self.fn(*args, **kwargs)
+            if inspect.iscoroutine(result):
+                return run_coroutine(result)
+            return result
+
+    async def acall(self, *args, **kwargs) -> Optional[K]:
+        fn = self.fn
+        if inspect.iscoroutinefunction(fn.func) and not self.env:
+            return await fn(*args, **kwargs)
+        return await asyncio.to_thread(self, *args, **kwargs)
 
-    def __call__(self) -> Optional[K]:
-        return self.fn()
+    def with_args(self, *args, **kwargs) -> PythonScript:
+        """Same script bound to a different set of args"""
+        script = copy(self)
+        script.args = args
+        script.kwargs = kwargs
+        fn = self._fn
+        script._fn = partial(fn.func, *args, **kwargs) if fn else None
+        if script._fn:
+            residency().used(script)
+        return script
 
 
 class BashScript(Callable):
@@ -64,14 +199,28 @@ class BashScript(Callable):
 
     Optionally return whatever the bash script produces
     seperating the stdout and stderr within the BashOut container
+
+    With a coproc (see cmddir.coproc) the script is sourced into a
+    subshell of a long lived bash instead of starting a new one
+
+    interpreter is what the script is handed to, subclasses run
+    other kinds of script the same way (see cmddir.runners)
+
+    Args it is called with are passed on after the ones it is bound
+    to, as a partial would (a MakeTarget hands them to make)
     """
 
+    interpreter: List[str] = ["bash"]
+
     def __init__(self, path: PathLike, *args, **kwargs):
-        # ENV
-        # Have some env parsing potentially here
         self.path = Path(path)
         assert self.path.exists()
-        self.cmd = ["bash", self.path]
+        self.args = args
+        self.kwargs = kwargs
+        self.coproc = None
+        # Whole environment to run with, None to inherit (see cmddir.env)
+        self.env: Optional[Dict[str, str]] = None
+        self.cmd = [*self.interpreter, self.path]
         if args:
             self.cmd += [str(x) for x in args]
         # if kwargs:
@@ -79,9 +228,155 @@ class BashScript(Callable):
         #         self.cmd.append(f"--{str(k)}")
         #         self.cmd.append(str(v))
 
-    def __call__(self) -> BashOut:
-        ps = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    def __call__(self, *args) -> BashOut:
+        if args:
+            return self.with_args(*self.args, *args)()
+        if self.coproc:
+            return self.coproc.run(self.path, self.cmd[len(self.interpreter) + 1 :], self.env)
+        ps = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.env)
+        o = BashOut()
+        # Both pipes are drained at once so neither can fill up and block
+        reader = threading.Thread(
+            target=lambda: setattr(o, "stderr_spool", SpooledOutput.from_stream(ps.stderr))
+        )
+        reader.start()
+        o.stdout_spool = SpooledOutput.from_stream(ps.stdout)
+        reader.join()
+        if hasattr(os, "wait4"):
+            _, status, o.rusage = os.wait4(ps.pid, 0)
+            ps.returncode = os.waitstatus_to_exitcode(status)
+        o.returncode = ps.wait()
+        return o
+
+    async def acall(self, *args) -> BashOut:
+        if args:
+            return await self.with_args(*self.args, *args).acall()
+        if self.coproc:
+            # The coprocess is driven through blocking pipe reads
+            return await asyncio.to_thread(self)
+        ps = await asyncio.create_subprocess_exec(
+            *self.cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.env
+        )
         o = BashOut()
-        o.stdout = ps.stdout.read().decode()
-        o.stderr = ps.stderr.read().decode()
+        o.stdout_spool, o.stderr_spool = await asyncio.gather(
+            _aspool(ps.stdout), _aspool(ps.stderr)
+        )
+        o.returncode = await ps.wait()
         return o
+
+    def with_args(self, *args, **kwargs) -> BashScript:
+        """Same script bound to a different set of args"""
+        script = type(self)(self.path, *args, **kwargs)
+        script.coproc = self.coproc
+        script.env = self.env
+        return script
+
+    def popen(self, stdin=None) -> subprocess.Popen:
+        """
+        Start the script with stdout as a pipe so that the caller
+        can stream it (see Pipeline) instead of buffering a BashOut
+        """
+        return subprocess.Popen(self.cmd, stdin=stdin, stdout=subprocess.PIPE, env=self.env)
+
+
+_environ_cond = threading.Condition()
+# Variable -> [value, scripts running with it, value before the first of them]
+_environ_claims: Dict[str, list] = {}
+_environ_local = threading.local()
+
+
+@contextmanager
+def environ(env: Optional[Dict[str, str]]):
+    """
+    os.environ as env for the duration of a script that runs in this
+    process. os.environ is shared by every thread, so scripts whose env
+    agrees run at once and one that needs a variable another value
+    waits until the scripts holding it are done. A script called from
+    within another one (same thread) overrides without waiting
+    """
+    if not env:
+        yield
+        return
+    nested = getattr(_environ_local, "depth", 0) > 0
+    with _environ_cond:
+        if not nested:
+            _environ_cond.wait_for(lambda: all(_environ_claims.get(k, [v])[0] == v for k, v in env.items()))
+        # What a nested script took over from the one it runs within
+        before = {}
+        for k, v in env.items():
+            claim = _environ_claims.get(k)
+            if claim is None:
+                claim = _environ_claims[k] = [v, 0, os.environ.get(k)]
+            elif claim[0] != v:
+                before[k], claim[0] = claim[0], v
+            claim[1] += 1
+            if os.environ.get(k) != v:
+                os.environ[k] = v
+    _environ_local.depth = getattr(_environ_local, "depth", 0) + 1
+    try:
+        yield
+    finally:
+        _environ_local.depth -= 1
+        with _environ_cond:
+            for k, v in before.items():
+                _environ_claims[k][0] = _set_environ(k, v)
+            for k in env:
+                claim = _environ_claims[k]
+                claim[1] -= 1
+                if not claim[1]:
+                    del _environ_claims[k]
+                    _set_environ(k, claim[2])
+            _environ_cond.notify_all()
+
+
+def _set_environ(k: str, v: Optional[str]) -> Optional[str]:
+    if v is None:
+        os.environ.pop(k, None)
+    else:
+        os.environ[k] = v
+    return v
+
+
+def run_coroutine(coro) -> Optional[K]:
+    """
+    asyncio.run, or on a helper thread when called from within a
+    running event loop (e.g. a sync out.run() in an acli handler)
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="cmddir-coroutine") as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+async def _aspool(stream: asyncio.StreamReader) -> SpooledOutput:
+    out = SpooledOutput()
+    while chunk := await stream.read(CHUNK_SIZE):
+        out.write(chunk)
+    return out
+
+
+def script_of(fn: Optional[Callable]) -> Optional[PythonScript | BashScript]:
+    """The script underneath any wrapping (CachedScript, Matrix, Dag)"""
+    while fn is not None and not isinstance(fn, (PythonScript, BashScript)):
+        fn = getattr(fn, "fn", None)
+    return fn
+
+
+def script_path(fn: Optional[Callable]) -> Optional[str]:
+    """File of the script underneath any wrapping, see script_of"""
+    script = script_of(fn)
+    return str(script.path) if script is not None and script.path else None
+
+
+async def acall(fn: Callable, *args, **kwargs) -> Optional[K]:
+    """
+    Await any Command fn: scripts use their own acall, coroutine
+    functions are awaited and everything else runs in a thread
+    """
+    if hasattr(fn, "acall"):
+        return await fn.acall(*args, **kwargs)
+    if inspect.iscoroutinefunction(fn):
+        return await fn(*args, **kwargs)
+    return await asyncio.to_thread(fn, *args, **kwargs)
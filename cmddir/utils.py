@@ -2,9 +2,12 @@ import contextlib
 import importlib
 import json
 import os
+import reprlib
 import sys
+import tempfile
 import traceback
 from pathlib import Path
+from typing import Iterator, Optional, TextIO
 
 from box import Box
 from bullet import colors
@@ -40,6 +43,22 @@ def style(msg: str, col: Color):
     return col + msg + colors.RESET
 
 
+def _clip(msg: str, width: Optional[int]) -> str:
+    if width is None or len(msg) <= width:
+        return msg
+    return msg[: max(width - 1, 0)] + "…"
+
+
+def _count(d: dict) -> int:
+    """Keys of d and every dict nested within it"""
+    total, stack = 0, [d]
+    while stack:
+        current = stack.pop()
+        total += len(current)
+        stack.extend(v for v in current.values() if isinstance(v, dict))
+    return total
+
+
 def notify(
     msg: str,
     col: Color = None,
@@ -56,9 +75,9 @@ def notify(
     print(val)
 
 
-def notify_kv(k: str, v: str, no_print: bool = False, sep: bool = False):
+def notify_kv(k: str, v: str, no_print: bool = False, sep: bool = False, max_width: Optional[int] = None):
     k = str(k)
-    v = str(v)
+    v = _clip(str(v), max_width)
     total_len = len(k + v) + 2
     val = style(f"{k}: ", _colors.notify_kv.k)
     val += style(v, _colors.notify_kv.v)
@@ -72,22 +91,104 @@ def notify_kv(k: str, v: str, no_print: bool = False, sep: bool = False):
         return val
 
 
-def notify_d(d: dict, no_print=False, level=0):
-    val = ""
-    for k, v in d.items():
-        if isinstance(v, dict):
-            val += style(f"{str(k)}:\n", _colors.notify_kv.k)
-            val += notify_d(v, no_print, level + 1)
-        else:
-            if level > 0:
-                val += "  " * level
-            val += style(f"{str(k)}: ", _colors.notify_kv.k)
-            val += style(str(v), _colors.notify_kv.v)
-            val += "\n"
+def notify_d(
+    d: dict,
+    no_print=False,
+    level=0,
+    out: Optional[TextIO] = None,
+    max_depth: Optional[int] = None,
+    max_width: Optional[int] = None,
+    max_items: Optional[int] = None,
+    to_file: bool = False,
+):
+    """
+    Print a (nested) dict as indented key: value lines
+
+    Lines are written to out (stdout by default) in batches as they
+    are formatted, the whole text is only built with no_print
+
+    max_depth: dicts below it are summarised as {… N keys}
+    max_width: values are cut to this many characters
+    max_items: only the first of every dict/list, then … N more
+    to_file: write all of it to a temp file instead, without colors
+    or limits, and print/return where it is
+    """
+    if to_file:
+        with tempfile.NamedTemporaryFile("w", prefix="cmddir-", suffix=".txt", delete=False) as f:
+            _write_lines(_d_lines(d, level, colored=False), f)
+        if not no_print:
+            notify(f"{_count(d)} keys written to {f.name}")
+        return f.name
+    lines = _d_lines(d, level, max_depth, max_width, max_items)
     if no_print:
-        return val
-    else:
-        print("\n" + val + "\n")
+        return "".join(lines)
+    out = out or sys.stdout
+    out.write("\n")
+    _write_lines(lines, out)
+    out.write("\n\n")
+    out.flush()
+
+
+# Formatted lines are handed to the stream in chunks of about this size
+WRITE_CHUNK = 64 * 1024
+
+
+def _write_lines(lines: Iterator[str], out: TextIO):
+    batch, size = [], 0
+    for line in lines:
+        batch.append(line)
+        size += len(line)
+        if size >= WRITE_CHUNK:
+            out.write("".join(batch))
+            batch, size = [], 0
+    out.write("".join(batch))
+
+
+def _d_lines(
+    d: dict,
+    level: int = 0,
+    max_depth: Optional[int] = None,
+    max_width: Optional[int] = None,
+    max_items: Optional[int] = None,
+    colored: bool = True,
+) -> Iterator[str]:
+    """The lines of notify_d, one nested dict at a time on a stack"""
+    paint = style if colored else lambda msg, col: msg
+    # Looked up once, Box attribute access is slow per line
+    k_col, v_col, sep_col = _colors.notify_kv.k, _colors.notify_kv.v, _colors.notify_kv.sep
+    short = reprlib.Repr()
+    short.fillvalue = "…"
+    if max_items is not None:
+        short.maxlist = short.maxtuple = short.maxset = short.maxdict = max_items
+    if max_width is not None:
+        short.maxstring = short.maxother = max_width
+    # [level, items left to format, number of items, items shown so far]
+    stack = [[level, iter(d.items()), len(d), 0]]
+    while stack:
+        frame = stack[-1]
+        level, items, total = frame[0], frame[1], frame[2]
+        indent = "  " * level
+        nested = None
+        for k, v in items:
+            if max_items is not None and frame[3] >= max_items:
+                yield paint(f"{indent}… {total - frame[3]} more", sep_col) + "\n"
+                break
+            frame[3] += 1
+            if isinstance(v, dict):
+                if max_depth is not None and level + 1 > max_depth:
+                    yield paint(f"{indent}{k}: ", k_col) + paint(f"{{… {len(v)} keys}}", sep_col) + "\n"
+                    continue
+                yield paint(f"{indent}{k}:", k_col) + "\n"
+                nested = [level + 1, iter(v.items()), len(v), 0]
+                break
+            if isinstance(v, (list, tuple, set, frozenset)) and (max_items is not None or max_width is not None):
+                v = short.repr(v)
+            yield paint(f"{indent}{k}: ", k_col) + paint(_clip(str(v), max_width), v_col) + "\n"
+        if nested:
+            # This dict carries on once the nested one is done
+            stack.append(nested)
+        else:
+            stack.pop()
 
 
 def clear_screen():
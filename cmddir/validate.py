@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import ast
+import json
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from pydantic import ValidationError
+
+from cmddir.cmds import HotkeyError, SubMenu
+from cmddir.meta import META_SUFFIXES, defines_main, read_meta
+from cmddir.runners import runner_for
+from cmddir.paths import CONFIG_FILE, CmdPaths
+from cmddir.types import Fg, PathLike
+from cmddir.utils import notify, notify_kv
+
+# Files handed to a worker at a time, keeps the pool overhead per file low
+BATCH_SIZE = 64
+# Shell scripts are checked with -n of the shell they run with
+SHELLS = {".sh": "bash", ".zsh": "zsh"}
+
+
+@dataclass
+class Check:
+    """Outcome of validating a single file, skipped says why it wasn't checked"""
+
+    path: str
+    kind: str
+    seconds: float = 0.0
+    error: Optional[str] = None
+    skipped: Optional[str] = None
+
+
+def tree_files(cmd_root: PathLike) -> Iterator[Path]:
+    """Every script/config that cmd_tree_builder would pick up"""
+    for root, dirs, files in os.walk(cmd_root):
+        dirs[:] = sorted(d for d in dirs if not CmdPaths.path_to_ignore(d))
+        for f in sorted(files):
+            if not CmdPaths.path_to_ignore(f) and CmdPaths.file_to_include(Path(root) / f):
+                yield Path(root) / f
+
+
+def check_file(path: PathLike) -> Check:
+    path = Path(path)
+    # Files without a suffix (executables, Makefiles) go by their runner
+    check = Check(str(path), path.suffix[1:] or runner_for(path).name)
+    start = time.perf_counter()
+    try:
+        match path.suffix:
+            case ".py":
+                check.error = check_py(path)
+            case ".sh" | ".zsh" if not shutil.which(SHELLS[path.suffix]):
+                check.skipped = f"{SHELLS[path.suffix]} not found"
+            case ".sh" | ".zsh":
+                check.error = check_sh(path, SHELLS[path.suffix])
+            case ".json" if path.name == CONFIG_FILE:
+                check.error = check_config(path)
+        if not check.error and path.suffix in META_SUFFIXES:
+            check.error = check_meta(path)
+    except OSError as e:
+        check.error = str(e)
+    check.seconds = time.perf_counter() - start
+    return check
+
+
+def check_batch(paths: List[str]) -> List[Check]:
+    return [check_file(p) for p in paths]
+
+
+def check_py(path: Path) -> Optional[str]:
+    source = path.read_bytes()
+    try:
+        module = compile(source, str(path), "exec", ast.PyCF_ONLY_AST)
+        # The AST alone misses errors such as return outside a function
+        compile(module, str(path), "exec")
+    except SyntaxError as e:
+        return f"line {e.lineno}: {e.msg}"
+    if defines_main(module) is False:
+        return "no main function"
+    return None
+
+
+def check_sh(path: Path, shell: str = "bash") -> Optional[str]:
+    ps = subprocess.run([shell, "-n", str(path)], capture_output=True, text=True)
+    if ps.returncode:
+        return ps.stderr.strip().replace(f"{path}: ", "")
+    return None
+
+
+def check_config(path: Path) -> Optional[str]:
+    try:
+        config = SubMenu.from_json(json.loads(path.read_text()))
+    except json.JSONDecodeError as e:
+        return f"line {e.lineno}: {e.msg}"
+    except (ValidationError, HotkeyError, TypeError) as e:
+        return _one_line(e)
+    # Every Command configured has to be a script or directory next to it
+    names = {p.stem for p in path.parent.iterdir() if not CmdPaths.path_to_ignore(p.name)}
+    unknown = [cmd.orig_name for cmd in config.cmds if cmd.orig_name not in names]
+    if unknown:
+        return f"orig_name not found: {', '.join(map(str, unknown))}"
+    return None
+
+
+def check_meta(path: Path) -> Optional[str]:
+    """The Command options given in a script header"""
+    meta = read_meta(path)
+    if not meta or not meta.config:
+        return None
+    unknown = meta.unknown_keys()
+    if unknown:
+        return f"metadata: unknown key(s) {', '.join(unknown)}"
+    try:
+        meta.command()
+    except (ValidationError, HotkeyError, TypeError) as e:
+        return f"metadata: {_one_line(e)}"
+    return None
+
+
+def _one_line(e: Exception) -> str:
+    return " ".join((getattr(e, "message", None) or str(e)).split())
+
+
+def validate(
+    cmd_root: PathLike,
+    paths: Optional[List[PathLike]] = None,
+    workers: Optional[int] = None,
+) -> List[Check]:
+    """
+    Check every script and config of the tree in a process pool,
+    nothing is imported or run
+
+    .py: compiles and defines main
+    .sh/.zsh: bash -n/zsh -n, skipped when that shell isn't installed
+    config.json: parses as a SubMenu and only names existing scripts/dirs
+    script metadata (see cmddir.meta): parses as Command options
+
+    paths limits it to those files (e.g. staged ones, as a pre-commit hook)
+    """
+    if paths:
+        files = [
+            str(p)
+            for p in map(Path, paths)
+            if p.exists() and not CmdPaths.path_to_ignore(p.name) and CmdPaths.file_to_include(p)
+        ]
+    else:
+        files = [str(p) for p in tree_files(cmd_root)]
+    batches = [files[i : i + BATCH_SIZE] for i in range(0, len(files), BATCH_SIZE)]
+    if len(batches) < 2:
+        return check_batch(files)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [check for batch in executor.map(check_batch, batches) for check in batch]
+
+
+def print_validation(
+    cmd_root: PathLike,
+    paths: Optional[List[PathLike]] = None,
+    workers: Optional[int] = None,
+    slowest: int = 5,
+) -> int:
+    """Report of validate, returns the number of failed files"""
+    start = time.perf_counter()
+    checks = validate(cmd_root, paths, workers)
+    wall = time.perf_counter() - start
+    failed = [c for c in checks if c.error]
+    skipped = [c for c in checks if c.skipped]
+    for c in failed:
+        notify_kv(c.path, c.error)
+    for c in skipped:
+        notify_kv(c.path, f"skipped, {c.skipped}")
+    kinds = {}
+    for c in checks:
+        kinds[c.kind] = kinds.get(c.kind, 0) + 1
+    counts = ", ".join(f"{n} {k}" for k, n in sorted(kinds.items()))
+    notify(
+        f"{len(checks)} files ({counts}) in {wall:.2f}s, {len(failed)} failed"
+        + (f", {len(skipped)} skipped" if skipped else ""),
+        Fg.red if failed else None,
+        lines_before=1 if failed else 0,
+    )
+    for c in sorted(checks, key=lambda c: -c.seconds)[:slowest]:
+        notify_kv(f"{c.seconds * 1000:8.1f}ms", c.path)
+    return len(failed)
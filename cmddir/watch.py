@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from cmddir.cmds import SubMenu
+from cmddir.env import ENV_FILE, set_env, subtree
+from cmddir.paths import CmdPaths
+from cmddir.pipeline import attach_pipelines
+from cmddir.residency import residency
+from cmddir.types import Fg
+from cmddir.utils import notify
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT = struct.Struct("iIII")
+
+
+class InotifyBackend:
+    """
+    inotify through ctypes, one watch per directory of the tree.
+    Raises OSError where inotify isn't available
+    """
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is linux only")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs: Dict[int, str] = {}
+
+    def add(self, path: str):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Can't watch {path}")
+        self.dirs[wd] = path
+
+    def remove(self, path: str):
+        for wd, p in list(self.dirs.items()):
+            if p == path:
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.dirs[wd]
+
+    def wait(self, timeout: float) -> Set[str]:
+        """Directories with a relevant change within timeout"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size : offset + EVENT.size + length].rstrip(b"\0").decode(errors="replace")
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, everything may have changed
+                return set(self.dirs.values())
+            if wd not in self.dirs or not _relevant(os.path.join(self.dirs[wd], name), mask & IN_ISDIR):
+                continue
+            changed.add(self.dirs[wd])
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingBackend:
+    """
+    Fallback that lists every watched directory each interval and
+    compares names, mtimes and sizes with the previous listing
+    """
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self.snapshots: Dict[str, frozenset] = {}
+
+    def add(self, path: str):
+        self.snapshots[path] = self.snapshot(path)
+
+    def remove(self, path: str):
+        self.snapshots.pop(path, None)
+
+    @staticmethod
+    def snapshot(path: str) -> frozenset:
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return frozenset()
+        return frozenset(
+            (e.name, e.is_dir(), 0 if e.is_dir() else e.stat().st_mtime_ns)
+            for e in entries
+            if _relevant(e.path, e.is_dir())
+        )
+
+    def wait(self, timeout: float) -> Set[str]:
+        time.sleep(min(timeout, self.interval))
+        changed = set()
+        for path, before in list(self.snapshots.items()):
+            after = self.snapshot(path)
+            if after != before:
+                self.snapshots[path] = after
+                changed.add(path)
+        return changed
+
+    def close(self):
+        pass
+
+
+def _relevant(path: str, is_dir) -> bool:
+    name = os.path.basename(path)
+    if CmdPaths.path_to_ignore(name):
+        return False
+    return bool(is_dir) or name == ENV_FILE or CmdPaths.file_to_include(path)
+
+
+class TreeWatcher:
+    """
+    Keeps an eager tree (see cmd_tree_builder(watch=True)) in step
+    with the disk
+
+    A change within a directory rebuilds just the SubMenu of that
+    directory, sub directories that still exist keep their SubMenu.
+    The old SubMenu absorbs the fully rebuilt one in one go such that
+    whoever holds it (its parent, a prompt within it) sees the change,
+    after which shortcut conflicts of its parent are resolved. menus
+    itself is kept to the SubMenus of the tree, when it is a list
+
+    Changes are debounced: a batch is applied once nothing changed
+    for debounce seconds (or max_delay passed), so a git checkout
+    touching many files is one update per affected directory
+    """
+
+    def __init__(
+        self,
+        menus: List[SubMenu],
+        debounce: float = 0.2,
+        max_delay: float = 2.0,
+        on_update: Optional[Callable[[List[SubMenu]], None]] = None,
+        polling: bool = False,
+    ):
+        self.tree_list = menus
+        self.root = menus[0]
+        self.cmd_root = Path(self.root.path)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.on_update = on_update
+        self.menus: Dict[str, SubMenu] = {}
+        # (mtime, size) of every script as last imported or seen
+        self.stamps: Dict[str, Tuple[int, int]] = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.backend = PollingBackend() if polling else None
+        if self.backend is None:
+            try:
+                self.backend = InotifyBackend()
+            except OSError:
+                self.backend = PollingBackend()
+        for menu in menus:
+            self._watch(menu)
+
+    def _watch(self, menu: SubMenu):
+        path = str(Path(menu.path).resolve())
+        self.menus[path] = menu
+        self.backend.add(path)
+        for entry in os.scandir(path):
+            if entry.name.endswith(".py") and entry.is_file():
+                self.stamps[entry.path] = _stamp(entry.path)
+
+    def _unwatch(self, menu: SubMenu):
+        path = str(Path(menu.path).resolve())
+        if self.menus.get(path) is menu:
+            del self.menus[path]
+            self.backend.remove(path)
+        for child in menu.children:
+            self._unwatch(child)
+
+    def start(self) -> TreeWatcher:
+        self.thread = threading.Thread(target=self._run, name="cmddir-watch", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.backend.close()
+
+    def _run(self):
+        pending: Set[str] = set()
+        first = 0.0
+        while not self.stopped.is_set():
+            changed = self.backend.wait(self.debounce if pending else 0.5)
+            if changed:
+                first = first if pending else time.monotonic()
+                pending |= changed
+                if time.monotonic() - first < self.max_delay:
+                    continue
+            if pending:
+                self.apply(pending)
+                pending = set()
+
+    def apply(self, dirs: Set[str]) -> List[SubMenu]:
+        """
+        Rebuild the SubMenus of dirs, parents before children. A
+        directory that fails to rebuild (e.g. a half written
+        config.json) is reported and keeps its SubMenu as it was,
+        the next change within it tries again
+        """
+        updated = []
+        with self.lock:
+            for path in sorted(dirs, key=lambda p: p.count(os.sep)):
+                menu = self.menus.get(path)
+                if menu is None or not Path(path).is_dir():
+                    continue
+                try:
+                    updated.append(self.rebuild(menu))
+                except Exception as e:
+                    notify(f"Couldn't reload {path}: {getattr(e, 'message', None) or e}", Fg.red)
+            if updated and isinstance(self.tree_list, list):
+                self.tree_list[:] = subtree(self.root)
+        if updated and self.on_update:
+            try:
+                self.on_update(updated)
+            except Exception as e:
+                notify(f"Updating after a reload failed: {e}", Fg.red)
+        return updated
+
+    def rebuild(self, old: SubMenu) -> SubMenu:
+        """
+        The new SubMenu is built in full on the side, pipelines,
+        shortcuts and .env included, before old absorbs it in one go
+        (see SubMenu.absorb). Nothing of the tree changes should it fail
+        """
+        path = Path(old.path)
+        paths = CmdPaths.scan(self.cmd_root, path)
+        # Edited scripts have to be imported again rather than taken from sys.modules
+        stamps = {}
+        for script in paths.fullpaths:
+            if script.suffix != ".py":
+                continue
+            stamp = _stamp(str(script))
+            if self.stamps.get(str(script)) == stamp:
+                continue
+            stamps[str(script)] = stamp
+            module_path = ".".join(script.relative_to(paths.cmd_root).with_suffix("").parts)
+            residency().unload(module_path)
+            sys.modules.pop(module_path, None)
+        new = paths.create_menu()
+        new.level = old.level
+        kept = {Path(c.path).name: c for c in old.children}
+        children = []
+        for d in sorted(paths.dirs):
+            child = kept.pop(d, None) or self.build(path / d, new.level + 1)
+            # Already where it ends up, old takes these children over
+            child.parent = old
+            children.append(child)
+        new.children = children
+        attach_pipelines([new])
+        new.resolve_shortcut_conflicts()
+        # Whatever is below inherits the (maybe edited) .env
+        pending = [(new, old.parent.env if old.parent else {})]
+        while pending:
+            menu, inherited = pending.pop()
+            set_env(menu, inherited)
+            pending += [(child, menu.env) for child in menu.children]
+        self.stamps.update(stamps)
+        for gone in kept.values():
+            self._unwatch(gone)
+        old.absorb(new)
+        if old.parent is not None:
+            old.parent.resolve_shortcut_conflicts()
+        return old
+
+    def build(self, path: Path, level: int) -> SubMenu:
+        """SubMenu of a new directory along with everything below it"""
+        CmdPaths.add_init(path)
+        paths = CmdPaths.scan(self.cmd_root, path)
+        menu = paths.create_menu()
+        menu.level = level
+        menu.children = [self.build(path / d, level + 1) for d in sorted(paths.dirs)]
+        for child in menu.children:
+            child.parent = menu
+        attach_pipelines([menu])
+        self._watch(menu)
+        return menu
+
+
+def _stamp(path: str) -> Tuple[int, int]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0, 0
+    return st.st_mtime_ns, st.st_size
+
+
+def watch_tree(menus: List[SubMenu], **kwargs) -> TreeWatcher:
+    return TreeWatcher(menus, **kwargs).start()
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import shutil
+from typing import Dict, List, Optional, Set
+
+from bullet import utils
+from bullet.charDef import (
+    ARROW_DOWN_KEY,
+    ARROW_UP_KEY,
+    END_KEY,
+    HOME_KEY,
+    INTERRUPT_KEY,
+    LINE_BEGIN_KEY,
+    LINE_END_KEY,
+    NEWLINE_KEY,
+    PG_DOWN_KEY,
+    PG_UP_KEY,
+    SPACE_CHAR,
+)
+
+from cmddir.cmds import (
+    BACKGROUND_KEY,
+    JOBS_KEY,
+    REFRESH_KEY,
+    WINDOW_MARGIN,
+    Command,
+    MaxAlign,
+    SubMenu,
+)
+from cmddir.types import Fg
+from cmddir.utils import style
+
+
+class WindowedMenu:
+    """
+    Dropdown/checklist for SubMenus with more Commands than fit
+    the terminal. Only the rows within the viewport are formatted
+    and drawn, so a keypress costs the same for 50 or 50k Commands
+
+    up/down/j/k: move, page up/down: by a window, home/end (or
+    ctrl-a/ctrl-e): top/bottom, enter: choose, space: check (multi),
+    a shortcut: choose that Command (or move onto it with multi)
+    """
+
+    def __init__(
+        self,
+        menu: SubMenu,
+        max_align: MaxAlign,
+        multi: bool = False,
+        height: Optional[int] = None,
+    ):
+        self.menu = menu
+        self.cmds = menu.cmds
+        self.max_align = max_align
+        self.multi = multi
+        self.height = min(height or max(shutil.get_terminal_size().lines - WINDOW_MARGIN, 3), len(self.cmds))
+        self.indent = " " * (menu.indent_by * menu.level)
+        self.pos = 0
+        self.top = 0
+        self.checked: Set[int] = set()
+        self.shortcuts: Dict[str, int] = {}
+        for idx, cmd in enumerate(self.cmds):
+            for s in cmd.shortcuts:
+                self.shortcuts.setdefault(s, idx)
+        self.drawn = False
+
+    def row(self, idx: int) -> str:
+        cmd: Command = self.cmds[idx]
+        current = idx == self.pos
+        mark = self.menu.check if idx in self.checked else " "
+        bullet = self.menu.bullet if current else " "
+        prefix = style(f"{mark} ", Fg.red) if self.multi else ""
+        text = style(cmd.str(self.max_align), Fg.green if current else Fg.blue)
+        return f"{self.indent}{prefix}{style(bullet, Fg.magenta)} {text}"
+
+    def render(self):
+        if self.drawn:
+            utils.moveCursorUp(self.height + 1)
+        for idx in range(self.top, self.top + self.height):
+            utils.clearLine()
+            utils.forceWrite(self.row(idx) + "\n")
+        utils.clearLine()
+        footer = f"-- {self.pos + 1}/{len(self.cmds)} --"
+        if self.multi:
+            footer += f" {len(self.checked)} checked"
+        utils.forceWrite(f"{self.indent}{footer}\n")
+        self.drawn = True
+
+    def move(self, pos: int):
+        self.pos = max(0, min(pos, len(self.cmds) - 1))
+        if self.pos < self.top:
+            self.top = self.pos
+        elif self.pos >= self.top + self.height:
+            self.top = self.pos - self.height + 1
+        self.menu.highlight(self.pos)
+
+    def launch(self) -> Command | List[Command]:
+        self.move(0)
+        self.render()
+        while True:
+            chosen = self.handle(utils.getchar())
+            if chosen is not None:
+                return chosen
+            self.render()
+
+    def handle(self, key) -> Optional[Command | List[Command]]:
+        code = key if isinstance(key, int) else ord(key)
+        if code in [ARROW_UP_KEY, ord("k")]:
+            self.move(self.pos - 1)
+        elif code in [ARROW_DOWN_KEY, ord("j")]:
+            self.move(self.pos + 1)
+        elif code == PG_UP_KEY:
+            self.move(self.pos - self.height)
+        elif code == PG_DOWN_KEY:
+            self.move(self.pos + self.height)
+        elif code in [HOME_KEY, LINE_BEGIN_KEY]:
+            self.move(0)
+        elif code in [END_KEY, LINE_END_KEY]:
+            self.move(len(self.cmds) - 1)
+        elif code == INTERRUPT_KEY:
+            raise KeyboardInterrupt
+        elif code == NEWLINE_KEY:
+            if not self.multi:
+                return self.cmds[self.pos]
+            if self.checked:
+                return [self.cmds[i] for i in sorted(self.checked)]
+        elif code == SPACE_CHAR and self.multi:
+            self.checked ^= {self.pos}
+        elif not self.multi and key in [REFRESH_KEY, BACKGROUND_KEY, JOBS_KEY]:
+            self.menu.modifier = key
+            return self.cmds[self.pos]
+        elif isinstance(key, str) and key in self.shortcuts:
+            self.move(self.shortcuts[key])
+            if not self.multi:
+                return self.cmds[self.pos]
+        return None
@@ -0,0 +1,29 @@
+import json
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+from cmddir.runners import configure
+
+
+def make_tree(root: Path, files: Dict[str, str | dict | list]) -> Path:
+    """
+    A Command Structure under root from {relative path: content},
+    anything but a str is written as json (e.g. a config.json)
+
+    Python scripts are imported by their path below root, so every
+    test names its directories apart from the others
+    """
+    for rel, content in files.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content if isinstance(content, str) else json.dumps(content))
+    return root
+
+
+@pytest.fixture
+def python_runner():
+    """Hands configure back, the python runner is reset afterwards"""
+    yield lambda **settings: configure("python", **settings)
+    configure("python", executor="inline", max_workers=None, warm=False, reuse=True)
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+from cmddir import cmd_tree_builder
+from cmddir.cmds import adispatch
+from cmddir.keyfeed import PromptCancelled, run_prompt
+from cmddir.runners import get_runner
+from cmddir.types import acall
+
+from conftest import make_tree
+
+OVERLAP = """\
+import asyncio
+
+running = peak = 0
+
+async def main():
+    global running, peak
+    running += 1
+    peak = max(peak, running)
+    await asyncio.sleep(0.05)
+    running -= 1
+    return peak
+"""
+
+ENV = """\
+import asyncio
+import os
+
+async def main():
+    await asyncio.sleep(0)
+    return os.environ.get("CMDDIR_TEST_ASYNC")
+"""
+
+
+@pytest.fixture
+def piped_stdin(monkeypatch):
+    r, w = os.pipe()
+    stdin = os.fdopen(r)
+    monkeypatch.setattr(sys, "stdin", stdin)
+    yield stdin, w
+    os.close(w)
+    stdin.close()
+
+
+def test_prompt_reads_keys_fed_by_the_loop(piped_stdin):
+    stdin, w = piped_stdin
+
+    async def main():
+        asyncio.get_running_loop().call_later(0.05, os.write, w, b"jk")
+        return await run_prompt(lambda: sys.stdin.read(2))
+
+    assert asyncio.run(main()) == "jk"
+    assert sys.stdin is stdin
+
+
+def test_cancelled_prompt_leaves_no_thread_behind(piped_stdin):
+    stdin, _ = piped_stdin
+    ended = threading.Event()
+
+    def prompt():
+        try:
+            return sys.stdin.read(1)
+        except PromptCancelled:
+            ended.set()
+            raise
+
+    async def main():
+        task = asyncio.ensure_future(run_prompt(prompt))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert ended.is_set()
+    assert sys.stdin is stdin
+
+
+def test_adispatch_takes_runner_slots(tmp_path, python_runner):
+    python_runner(max_workers=1)
+    cmd_root = make_tree(tmp_path / "slots", {f"{tmp_path.name}/overlap.py": OVERLAP})
+    cmd = cmd_tree_builder(cmd_root)[0].lookup(f"{tmp_path.name}/overlap")
+
+    async def main():
+        return await asyncio.gather(*[adispatch(None, cmd) for _ in range(3)])
+
+    assert asyncio.run(main()) == [1, 1, 1]
+
+
+def test_cancelled_wait_gives_its_slot_back(tmp_path, python_runner):
+    python_runner(max_workers=1)
+    cmd_root = make_tree(tmp_path / "slots", {f"{tmp_path.name}/overlap.py": OVERLAP})
+    cmd = cmd_tree_builder(cmd_root)[0].lookup(f"{tmp_path.name}/overlap")
+
+    async def main():
+        first = asyncio.ensure_future(adispatch(None, cmd))
+        waiting = asyncio.ensure_future(adispatch(None, cmd))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await first
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    slots = get_runner("python").slots
+    assert slots.acquire(blocking=False)
+    slots.release()
+
+
+def test_coroutine_main_runs_with_its_env(tmp_path):
+    cmd_root = make_tree(tmp_path / "env", {f"{tmp_path.name}/env.py": ENV})
+    cmd = cmd_tree_builder(cmd_root)[0].lookup(f"{tmp_path.name}/env")
+    cmd.fn.env = {"CMDDIR_TEST_ASYNC": "1"}
+    assert asyncio.run(acall(cmd.fn)) == "1"
+    assert "CMDDIR_TEST_ASYNC" not in os.environ
@@ -0,0 +1,75 @@
+import json
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+from cmddir.bundle import MANIFEST, BundleError, bundle, load_bundle
+from cmddir.runners import call
+
+from conftest import make_tree
+
+
+def packed(tmp_path):
+    pkg = tmp_path.name
+    helper = f"helper_{pkg}"
+    cmd_root = make_tree(
+        tmp_path / "src",
+        {
+            f"{pkg}/hello.py": f"from {helper} import greet\n\ndef main(name='bundle'):\n    return greet(name)\n",
+            "ops/up.sh": "echo up\n",
+        },
+    )
+    lib = make_tree(tmp_path / "lib", {f"{helper}.py": "def greet(name):\n    return f'hello {name}'\n"})
+    return pkg, bundle(cmd_root, tmp_path / "tree.pyz", lib)
+
+
+def test_loads_without_scanning_and_runs(tmp_path):
+    pkg, pyz = packed(tmp_path)
+    tree, libs = load_bundle(pyz, tmp_path / "bundles")
+    sys.path[:0] = [str(tree.cmd_root), *map(str, libs)]
+    try:
+        root = tree.menus()[0]
+        assert call(root.lookup(f"{pkg}/hello")) == "hello bundle"
+        assert call(root.lookup("ops/up")).stdout == "up\n"
+    finally:
+        del sys.path[: 1 + len(libs)]
+    assert (tree.cmd_root / pkg / "__pycache__").is_dir()
+    # Unpacked once per digest
+    again, _ = load_bundle(pyz, tmp_path / "bundles")
+    assert again.cmd_root == tree.cmd_root
+    assert len(list((tmp_path / "bundles").iterdir())) == 1
+
+
+def test_same_tree_same_digest(tmp_path):
+    _, pyz = packed(tmp_path)
+    digest = lambda path: json.loads(zipfile.ZipFile(path).read(MANIFEST))["digest"]
+    first = digest(pyz)
+    assert digest(bundle(tmp_path / "src", tmp_path / "again.pyz", tmp_path / "lib")) == first
+
+
+def test_runs_directly(tmp_path):
+    pkg, pyz = packed(tmp_path)
+    env = {**os.environ, "XDG_CACHE_HOME": str(tmp_path / "cache")}
+    ps = subprocess.run([sys.executable, str(pyz), f"{pkg}/hello"], capture_output=True, text=True, env=env)
+    assert ps.returncode == 0, ps.stderr
+    assert ps.stdout.strip().endswith("hello bundle")
+    ps = subprocess.run([sys.executable, str(pyz), "ops/up"], capture_output=True, text=True, env=env)
+    assert ps.returncode == 0 and ps.stdout.strip().endswith("up")
+    ps = subprocess.run([sys.executable, str(pyz), "missing"], capture_output=True, text=True, env=env)
+    assert ps.returncode == 1 and "missing not found" in ps.stderr
+
+
+def test_other_python_is_rejected(tmp_path):
+    _, pyz = packed(tmp_path)
+    other = tmp_path / "other.pyz"
+    with zipfile.ZipFile(pyz) as zf, zipfile.ZipFile(other, "w") as out:
+        for info in zf.infolist():
+            data = zf.read(info)
+            if info.filename == MANIFEST:
+                data = json.dumps({**json.loads(data), "magic": "00000000"})
+            out.writestr(info, data)
+    with pytest.raises(BundleError):
+        load_bundle(other, tmp_path / "bundles")
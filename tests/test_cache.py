@@ -0,0 +1,80 @@
+import os
+import time
+
+from cmddir import cmd_tree_builder
+from cmddir.cache import CachedScript, ResultCache
+from cmddir.runners import call
+
+from conftest import make_tree
+
+COUNTER = """\
+from pathlib import Path
+
+def main(*args):
+    calls = Path(__file__).parent / "calls"
+    with open(calls, "a") as f:
+        f.write("x\\n")
+    return len(calls.read_text().splitlines()), args
+"""
+
+
+def counter(tmp_path):
+    # Named after the test, python scripts are imported by their path
+    cmd_root = make_tree(tmp_path / "cache", {f"{tmp_path.name}/count.py": COUNTER})
+    cmd = cmd_tree_builder(cmd_root)[0].lookup(f"{tmp_path.name}/count")
+    return cmd, ResultCache(tmp_path / "results")
+
+
+def test_hit_refresh_and_bypass(tmp_path):
+    cmd, cache = counter(tmp_path)
+    cached = CachedScript(cmd.fn, cache=cache)
+    assert cached() == (1, ())
+    assert cached() == (1, ())
+    cached.refresh_next()
+    assert cached() == (2, ())
+    assert cached() == (2, ())
+    assert cached(bypass=True) == (3, ())
+
+
+def test_call_args_are_forwarded_and_keyed(tmp_path):
+    cmd, cache = counter(tmp_path)
+    cmd.fn = CachedScript(cmd.fn, cache=cache)
+    assert call(cmd, "a") == (1, ("a",))
+    assert call(cmd, "b") == (2, ("b",))
+    assert call(cmd, "a") == (1, ("a",))
+
+
+def test_shell_args_are_forwarded(tmp_path):
+    cmd_root = make_tree(tmp_path / "cache_sh", {"echo.sh": 'echo "$@"\n'})
+    cmd = cmd_tree_builder(cmd_root)[0].lookup("echo")
+    cmd.fn = CachedScript(cmd.fn, cache=ResultCache(tmp_path / "results"))
+    assert call(cmd, "x").stdout == "x\n"
+    assert call(cmd, "y").stdout == "y\n"
+
+
+def test_disk_tier_survives_a_new_cache_and_expires(tmp_path):
+    ResultCache(tmp_path / "results").put("k", [1, 2], ttl=60)
+    ResultCache(tmp_path / "results").put("short", 1, ttl=0)
+    assert ResultCache(tmp_path / "results").get("k") == (True, [1, 2])
+    assert ResultCache(tmp_path / "results").get("short") == (False, None)
+    assert oct(os.stat(tmp_path / "results").st_mode & 0o777) == oct(0o700)
+    assert oct(os.stat(tmp_path / "results" / "k.pickle").st_mode & 0o777) == oct(0o600)
+
+
+def test_files_writable_by_others_are_never_unpickled(tmp_path):
+    ResultCache(tmp_path / "results").put("k", 1, ttl=60)
+    os.chmod(tmp_path / "results" / "k.pickle", 0o666)
+    assert ResultCache(tmp_path / "results").get("k") == (False, None)
+    os.chmod(tmp_path / "results" / "k.pickle", 0o600)
+    os.chmod(tmp_path / "results", 0o777)
+    assert ResultCache(tmp_path / "results").get("k") == (False, None)
+
+
+def test_edited_script_is_a_miss(tmp_path):
+    cmd, cache = counter(tmp_path)
+    cached = CachedScript(cmd.fn, cache=cache)
+    key = cached.key()
+    script = cmd.fn.path
+    time.sleep(0.01)
+    script.write_text(script.read_text() + "\n# edited\n")
+    assert cached.key() != key
@@ -0,0 +1,17 @@
+from bullet import Bullet
+
+from cmddir import cmd_tree_builder
+from cmddir.cmds import generate_bullet
+
+from conftest import make_tree
+
+
+def test_generated_bullet_keeps_its_key_handlers_to_itself(tmp_path):
+    cmd_root = make_tree(tmp_path / "keys", {"keys_menu/run.sh": "echo\n", "keys_menu/stop.sh": "echo\n"})
+    before = dict(Bullet._key_handler)
+
+    bullet = generate_bullet(cmd_tree_builder(cmd_root)[0].lookup("keys_menu"))
+
+    assert Bullet._key_handler == before
+    assert bullet._key_handler is not Bullet._key_handler
+    assert ord("r") in bullet._key_handler and ord("r") not in Bullet._key_handler
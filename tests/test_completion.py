@@ -0,0 +1,62 @@
+import subprocess
+
+from cmddir.completion import LEAF, completion_script, completion_tables, write_tables
+from cmddir.tree import FlatTree
+
+from conftest import make_tree
+
+
+def tree_of(tmp_path):
+    return make_tree(
+        tmp_path / "comp",
+        {
+            "alpha.sh": "echo alpha\n",
+            "apple.sh": "echo apple\n",
+            "sub/inner.sh": "echo inner\n",
+            "sub/.env": f"TOKEN=$(touch {tmp_path / 'ran'})\n",
+        },
+    )
+
+
+def test_tables_of_an_eager_tree_leave_it_as_is(tmp_path):
+    tree = FlatTree.build(tree_of(tmp_path))
+    tables = completion_tables(tree.menus())
+    assert not tree.views
+    assert not (tmp_path / "ran").exists()
+    (words, follow), (sub_words, sub_follow) = tables
+    assert words == ["alpha", "apple", "sub"]
+    # apple's "a" is bumped to "b", which the prompt shows it on
+    assert follow["a"] == LEAF and follow["b"] == LEAF
+    assert follow["sub"] == follow["s"] == 1
+    assert sub_words == ["inner"] and sub_follow["i"] == LEAF
+
+
+def test_tables_of_loaded_menus_dont_change_their_shortcuts(tmp_path):
+    menus = list(FlatTree.build(tree_of(tmp_path)).menus())
+    completion_tables(menus)
+    assert [c.shortcuts for c in menus[0].cmds] == [["a"], ["a"]]
+
+
+def test_tables_are_only_rewritten_on_change(tmp_path):
+    menus = FlatTree.build(tree_of(tmp_path)).menus()
+    out = tmp_path / "tables"
+    assert write_tables("my-prog", menus, out)
+    assert not write_tables("my-prog", menus, out)
+    assert sorted(p.name for p in out.iterdir()) == [
+        f"my-prog.{s}{g}" for s in ["bash", "fish", "zsh"] for g in ["", ".gen"]
+    ]
+
+
+def test_bash_completes_from_the_tables(tmp_path):
+    out = tmp_path / "tables"
+    write_tables("prog", FlatTree.build(tree_of(tmp_path)).menus(), out)
+    script = completion_script("prog", "bash", out)
+
+    def complete(*words):
+        words = ["prog", *words]
+        run = f'{script}\nCOMP_WORDS=({" ".join(words)}); COMP_CWORD={len(words) - 1}; _cmddir_prog; echo "${{COMPREPLY[@]}}"'
+        return subprocess.run(["bash", "-c", run], capture_output=True, text=True).stdout.split()
+
+    assert complete("a") == ["alpha", "apple"]
+    assert complete("s", "") == ["inner"]
+    assert complete("alpha", "") == []
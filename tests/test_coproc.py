@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from cmddir import cmd_tree_builder
+from cmddir.coproc import BashCoprocess, get_coprocess
+from cmddir.runners import call, configure
+
+from conftest import make_tree
+
+
+@pytest.fixture
+def coproc(tmp_path):
+    coproc = BashCoprocess(tmp_path, setup="GREETING=hello")
+    yield coproc
+    coproc.stop()
+
+
+def test_run_frames_output_and_status(tmp_path, coproc):
+    script = make_tree(tmp_path, {"s.sh": 'echo "$GREETING $1"; echo err >&2; exit 3\n'}) / "s.sh"
+    o = coproc.run(script, ["world"])
+    assert (o.stdout, o.stderr, o.returncode) == ("hello world\n", "err\n", 3)
+
+
+def test_runs_cant_change_the_coprocess(tmp_path, coproc):
+    script = make_tree(tmp_path, {"s.sh": 'echo "${LEAK:-unset} $PWD"; LEAK=1; cd /\n'}) / "s.sh"
+    first = coproc.run(script)
+    assert coproc.run(script).stdout == first.stdout == f"unset {tmp_path}\n"
+
+
+def test_env_is_exported_into_the_subshell(tmp_path, coproc):
+    script = make_tree(tmp_path, {"s.sh": 'echo "$CMDDIR_TEST_COPROC"\n'}) / "s.sh"
+    env = {**os.environ, "CMDDIR_TEST_COPROC": "it's set"}
+    assert coproc.run(script, env=env).stdout == "it's set\n"
+    assert coproc.run(script).stdout == "\n"
+
+
+def test_dead_coprocess_is_restarted(tmp_path, coproc):
+    script = make_tree(tmp_path, {"s.sh": 'echo "$GREETING"\n'}) / "s.sh"
+    coproc.run(script)
+    coproc.ps.kill()
+    coproc.ps.wait()
+    assert coproc.run(script).stdout == "hello\n"
+
+
+def test_bash_dying_midway_fails_the_run(tmp_path, coproc):
+    # $$ is the coprocess itself, not the subshell of the run
+    script = make_tree(tmp_path, {"s.sh": "echo partial; kill -9 $$\n"}) / "s.sh"
+    o = coproc.run(script)
+    assert o.returncode != 0
+    assert o.stdout.startswith("partial")
+    assert "Bash coprocess failed" in o.stderr
+    assert not coproc.alive()
+
+
+def test_one_coprocess_per_session_or_directory(tmp_path):
+    assert get_coprocess() is get_coprocess()
+    assert get_coprocess(tmp_path) is get_coprocess(tmp_path / ".")
+    assert get_coprocess(tmp_path) is not get_coprocess()
+
+
+def test_persistent_runner_sources_scripts(tmp_path):
+    configure("bash", executor="persistent", reuse=False)
+    try:
+        cmd_root = make_tree(tmp_path / "coproc", {"pid.sh": "echo $$\n"})
+        cmd = cmd_tree_builder(cmd_root)[0].lookup("pid")
+        assert cmd.fn.coproc is get_coprocess(cmd_root)
+        assert call(cmd).stdout == call(cmd).stdout
+    finally:
+        configure("bash", executor="inline", reuse=True)
+        get_coprocess(tmp_path / "coproc").stop()
@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+
+from cmddir import cmd_tree_builder
+from cmddir.runners import call
+
+from conftest import make_tree
+
+
+def deploy_tree(root, suffix: str, script: str):
+    return make_tree(
+        root,
+        {
+            f"build/all{suffix}": script,
+            f"deploy/go{suffix}": script,
+            "deploy/config.json": {"cmds": [{"name": "go", "orig_name": "go", "depends_on": ["../build/all"]}]},
+        },
+    )
+
+
+@pytest.mark.parametrize("lazy", [True, False])
+def test_depends_on_resolves_from_the_loaded_submenu(tmp_path, lazy):
+    cmd_root = deploy_tree(tmp_path / "dag_root", ".sh", "echo ok\n")
+    root = cmd_tree_builder(cmd_root, lazy=lazy)[0]
+    go = root.lookup("deploy/go")
+    go.fn.state_dir = tmp_path / "state"
+
+    out = go.fn()
+    assert list(out.nodes) == ["dag_root/build/all", "dag_root/deploy/go"]
+    assert [n.status for n in out.nodes.values()] == ["done", "done"]
+
+    assert [n.status for n in go.fn().nodes.values()] == ["skipped", "skipped"]
+    go.fn.refresh_next()
+    assert [n.status for n in go.fn().nodes.values()] == ["done", "done"]
+
+
+@pytest.mark.parametrize("executor", ["inline", "thread"])
+def test_dag_does_not_hold_a_runner_slot(tmp_path, python_runner, executor):
+    cmd_root = make_tree(
+        tmp_path / "slots",
+        {
+            f"slot_build_{executor}/all.py": "def main():\n    return 1\n",
+            f"slot_deploy_{executor}/go.py": "def main():\n    return 2\n",
+            f"slot_deploy_{executor}/config.json": {
+                "cmds": [{"name": "go", "orig_name": "go", "depends_on": [f"../slot_build_{executor}/all"]}]
+            },
+        },
+    )
+    python_runner(executor=executor, max_workers=1)
+    go = cmd_tree_builder(cmd_root)[0].lookup(f"slot_deploy_{executor}/go")
+    go.fn.state_dir = tmp_path / "state"
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(call(go)), daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive(), "deadlocked on the runner's only slot"
+    assert results[0].returncode == 0
+
+
+def test_bypass_is_keyword_only_and_args_go_to_the_root(tmp_path):
+    pkg = tmp_path.name
+    log = tmp_path / "log"
+    cmd_root = make_tree(
+        tmp_path / "dag_args",
+        {
+            "build/all.sh": f"echo built >> {log}\n",
+            f"{pkg}/go.py": f"def main(target='none'):\n    open({str(log)!r}, 'a').write(target + '\\n')\n",
+            f"{pkg}/config.json": {"cmds": [{"name": "go", "orig_name": "go", "depends_on": ["../build/all"]}]},
+        },
+    )
+    go = cmd_tree_builder(cmd_root)[0].lookup(f"{pkg}/go")
+    go.fn.state_dir = tmp_path / "state"
+
+    out = go.fn("prod")
+    assert [n.status for n in out.nodes.values()] == ["done", "done"]
+    assert log.read_text() == "built\nprod\n"
+    # The same args are up to date, other args only rerun the root
+    assert [n.status for n in go.fn("prod").nodes.values()] == ["skipped", "skipped"]
+    assert [n.status for n in go.fn("dev").nodes.values()] == ["skipped", "done"]
+    assert [n.status for n in go.fn("dev", bypass=True).nodes.values()] == ["done", "done"]
+    assert log.read_text() == "built\nprod\ndev\nbuilt\ndev\n"
+
+
+def test_a_failing_pipeline_blocks_its_dependents(tmp_path):
+    cmd_root = make_tree(
+        tmp_path / "dag_pipe",
+        {
+            "steps/words.sh": "echo a\n",
+            "steps/fail.sh": "cat; exit 3\n",
+            "steps/config.json": {"pipelines": {"broken": ["words", "fail"]}},
+            "deploy/go.sh": "echo go\n",
+            "deploy/config.json": {"cmds": [{"name": "go", "orig_name": "go", "depends_on": ["../steps/broken"]}]},
+        },
+    )
+    go = cmd_tree_builder(cmd_root)[0].lookup("deploy/go")
+    go.fn.state_dir = tmp_path / "state"
+
+    out = go.fn()
+    assert [n.status for n in out.nodes.values()] == ["failed", "blocked"]
+    assert out.returncode == 3
@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from cmddir import cmd_tree_builder, env
+from cmddir.cache import ResultCache
+from cmddir.env import parse_env
+from cmddir.runners import call
+
+from conftest import make_tree
+
+
+@pytest.fixture(autouse=True)
+def env_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(env, "_env_cache", ResultCache(tmp_path / "env_cache"))
+
+
+def test_parse_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("CMDDIR_TEST_OUTER", "outer")
+    path = make_tree(
+        tmp_path / "parse",
+        {
+            ".env": (
+                "# a comment\n"
+                "export REGION=eu-west-1\n"
+                "ZONE=${REGION}a  # trailing comment\n"
+                "FROM_OUTSIDE=$CMDDIR_TEST_OUTER/bin\n"
+                "QUOTED=\"two words $REGION\"\n"
+                "LITERAL='no $expansion here'\n"
+                "ESCAPED=\\$REGION\n"
+                "RAN=$(echo $REGION | tr a-z A-Z)\n"
+                "not a variable\n"
+            )
+        },
+    ) / ".env"
+    assert parse_env(path, {"INHERITED": "1"}) == {
+        "INHERITED": "1",
+        "REGION": "eu-west-1",
+        "ZONE": "eu-west-1a",
+        "FROM_OUTSIDE": "outer/bin",
+        "QUOTED": "two words eu-west-1",
+        "LITERAL": "no $expansion here",
+        "ESCAPED": "$REGION",
+        "RAN": "EU-WEST-1",
+    }
+
+
+def test_substitutions_are_cached_failures_are_not(tmp_path, capsys):
+    counter = tmp_path / "count"
+    path = make_tree(
+        tmp_path / "subst",
+        {".env": f"N=$(echo x >> {counter}; wc -l < {counter})\nBAD=$(exit 3)\n"},
+    ) / ".env"
+    assert parse_env(path) == {"N": "1", "BAD": ""}
+    assert parse_env(path) == {"N": "1", "BAD": ""}
+    assert capsys.readouterr().out.count("failed") == 2
+
+
+def test_python_scripts_get_only_the_env_files(tmp_path, monkeypatch):
+    pkg = tmp_path.name
+    cmd_root = make_tree(
+        tmp_path / "scripts",
+        {
+            ".env": "REGION=eu\n",
+            f"{pkg}/.env": "ZONE=${REGION}a\n",
+            f"{pkg}/show.py": "import os\n\ndef main():\n    return os.environ.get('REGION'), os.environ.get('CMDDIR_TEST_LATER')\n",
+            f"{pkg}/echo.sh": 'echo "$REGION $ZONE $CMDDIR_TEST_LATER"\n',
+        },
+    )
+    menu = cmd_tree_builder(cmd_root)[0].lookup(pkg)
+    py, sh = menu.find_command("show"), menu.find_command("echo")
+    assert py.fn.env == {"REGION": "eu", "ZONE": "eua"}
+    assert sh.fn.env["PATH"] == os.environ["PATH"] and sh.fn.env["ZONE"] == "eua"
+
+    # Set after the tree was built, a PythonScript still sees it
+    monkeypatch.setenv("CMDDIR_TEST_LATER", "later")
+    assert call(py) == ("eu", "later")
+    assert "REGION" not in os.environ
+    assert call(sh).stdout == "eu eua \n"
@@ -0,0 +1,46 @@
+from cmddir import cmd_tree_builder
+from cmddir.runners import call
+
+from conftest import make_tree
+
+
+def roots(tmp_path):
+    pkg = tmp_path.name
+    team = make_tree(
+        tmp_path / "team",
+        {
+            "deploy.sh": "echo team deploy\n",
+            "status.sh": "echo team status\n",
+            f"{pkg}/a.py": "def main():\n    return 'team a'\n",
+            f"{pkg}/x.py": "def main():\n    return 'team x'\n",
+        },
+    )
+    personal = make_tree(
+        tmp_path / "personal",
+        {
+            "deploy.sh": "echo personal deploy\n",
+            "mine.sh": "echo mine\n",
+            f"{pkg}/b.py": f"from {pkg}.a import main as a\n\ndef main():\n    return a() + ' via b'\n",
+            f"{pkg}/x.py": "def main():\n    return 'personal x'\n",
+        },
+    )
+    return pkg, team, personal
+
+
+def test_later_roots_replace_and_extend(tmp_path):
+    pkg, team, personal = roots(tmp_path)
+    menus = cmd_tree_builder([team, personal])
+    root = menus[0]
+    assert root.name == "team"
+    assert sorted(c.name for c in root.cmds) == ["deploy", "mine", "status"]
+    assert call(root.lookup("deploy")).stdout == "personal deploy\n"
+    assert call(root.lookup("status")).stdout == "team status\n"
+    assert [m.name for m in menus] == ["team", pkg]
+    assert sorted(c.name for c in menus[1].cmds) == ["a", "b", "x"]
+
+
+def test_packages_span_the_roots(tmp_path):
+    pkg, team, personal = roots(tmp_path)
+    root = cmd_tree_builder([team, personal])[0]
+    assert call(root.lookup(f"{pkg}/b")) == "team a via b"
+    assert call(root.lookup(f"{pkg}/x")) == "personal x"
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from cmddir import cmd_tree_builder, jobs
+from cmddir.cmds import Command
+from cmddir.jobs import JobQueue, check_cancelled
+
+from conftest import make_tree
+
+
+@pytest.fixture
+def job_queue(monkeypatch):
+    queue = JobQueue(max_jobs=1)
+    monkeypatch.setattr(jobs, "_job_queue", queue)
+    return queue
+
+
+def wait_for(check, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not check() and time.monotonic() < end:
+        time.sleep(0.01)
+    return check()
+
+
+def test_lower_priority_values_run_first(job_queue):
+    release = threading.Event()
+    ran = []
+    job_queue.submit(Command(name="block", fn=release.wait))
+    for name, priority in [("later", 5), ("sooner", 1), ("also later", 5)]:
+        job_queue.submit(Command(name=name, fn=lambda name=name: ran.append(name)), priority=priority)
+    release.set()
+    assert wait_for(lambda: len(ran) == 3)
+    assert ran == ["sooner", "later", "also later"]
+
+
+def test_bash_output_is_streamed_into_the_job(tmp_path, job_queue):
+    cmd_root = make_tree(tmp_path / "jobs", {"ok.sh": "echo one; echo two >&2\n", "bad.sh": "echo x; exit 3\n"})
+    root = cmd_tree_builder(cmd_root)[0]
+    ok = job_queue.submit(root.find_command("ok"), root)
+    bad = job_queue.submit(root.find_command("bad"), root)
+    assert wait_for(lambda: not ok.active and not bad.active)
+    assert ok.status == "done" and ok.last_lines() == ["one", "two"]
+    assert ok.name == "jobs/ok" and ok.result.stdout == "one\ntwo\n"
+    assert bad.status == "failed" and bad.result.returncode == 3
+
+
+def test_prints_of_a_python_job_go_to_the_job(job_queue, capsys):
+    job = job_queue.submit(Command(name="talk", fn=lambda: print("hello") or 1))
+    assert wait_for(lambda: not job.active)
+    assert job.status == "done" and job.result == 1
+    assert job.last_lines() == ["hello"]
+    assert "hello" not in capsys.readouterr().out
+
+
+def test_cancel_queued_and_running(tmp_path, job_queue):
+    started = threading.Event()
+
+    def loop():
+        started.set()
+        while True:
+            check_cancelled()
+            time.sleep(0.01)
+
+    running = job_queue.submit(Command(name="loop", fn=loop))
+    ran = []
+    queued = job_queue.submit(Command(name="never", fn=lambda: ran.append(1)))
+    assert started.wait(5)
+    assert job_queue.cancel(queued) and job_queue.cancel(running)
+    assert wait_for(lambda: running.finished is not None)
+    assert running.status == queued.status == "cancelled"
+    time.sleep(0.05)
+    assert ran == [] and not job_queue.cancel(running)
+
+
+def test_cancel_terminates_a_bash_job(tmp_path, job_queue):
+    cmd_root = make_tree(tmp_path / "jobs", {"slow.sh": "echo started; sleep 30\n"})
+    job = job_queue.submit(cmd_tree_builder(cmd_root)[0].find_command("slow"))
+    assert wait_for(lambda: job.last_lines() == ["started"])
+    job_queue.cancel(job)
+    assert wait_for(lambda: job.finished is not None)
+    assert job.status == "cancelled" and job.elapsed < 30
@@ -0,0 +1,56 @@
+import time
+
+from cmddir import LazyLoader, cmd_tree_builder
+
+from conftest import make_tree
+
+TREE = {
+    "top.sh": "echo top\n",
+    "a/one.sh": "echo one\n",
+    "a/deep/two.sh": "echo two\n",
+    "a/deep/deeper/three.sh": "echo three\n",
+    "b/four.sh": "echo four\n",
+}
+
+
+def child(menu, name):
+    return next(c for c in menu.children if c.name == name)
+
+
+def wait_for(check, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not check() and time.monotonic() < end:
+        time.sleep(0.01)
+    return check()
+
+
+def test_only_the_root_is_built(tmp_path):
+    tree = cmd_tree_builder(make_tree(tmp_path / "lazy", TREE), lazy=True)
+    assert len(tree) == 1
+    root = tree[0]
+    assert [c.name for c in root.cmds] == ["top"]
+    assert [c.name for c in root.children] == ["a", "b"]
+    assert all(isinstance(c.loader, LazyLoader) and not c.cmds for c in root.children)
+
+
+def test_lookup_loads_only_the_way_down(tmp_path):
+    root = cmd_tree_builder(make_tree(tmp_path / "lazy", TREE), lazy=True)[0]
+    assert root.lookup("a/deep/two").name == "two"
+    a = child(root, "a")
+    assert a.loader is None and child(a, "deep").loader is None
+    assert child(child(a, "deep"), "deeper").loader is not None
+    assert child(root, "b").loader is not None
+    assert child(a, "deep").parent is a
+
+
+def test_prefetch_keeps_one_level_ahead(tmp_path):
+    root = cmd_tree_builder(make_tree(tmp_path / "lazy", TREE), lazy=True, prefetch=True)[0]
+    a, b = child(root, "a"), child(root, "b")
+    assert wait_for(lambda: [c.name for c in a.cmds] == ["one"] and [c.name for c in b.cmds] == ["four"])
+    deep = child(a, "deep")
+    # Scanned only once a is entered
+    time.sleep(0.05)
+    assert isinstance(deep.loader, LazyLoader) and not deep.cmds
+    a.load()
+    assert wait_for(lambda: [c.name for c in deep.cmds] == ["two"])
+    assert isinstance(child(deep, "deeper").loader, LazyLoader)
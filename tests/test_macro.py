@@ -0,0 +1,90 @@
+import json
+
+from cmddir import cmd_tree_builder, record
+from cmddir.cmds import COutput, cli, dispatch
+from cmddir.macro import read_macros, replay
+
+from conftest import make_tree
+
+
+def macro_tree(tmp_path):
+    pkg = tmp_path.name
+    log = tmp_path / "log"
+    return pkg, log, make_tree(
+        tmp_path / "macro",
+        {
+            f"{pkg}/say.py": f"def main(word='hi'):\n    open({str(log)!r}, 'a').write(word + '\\n')\n",
+            f"{pkg}/both.py": (
+                "from cmddir.cmds import dispatch\n\n"
+                "def main(menu=None, cmd=None):\n"
+                "    return dispatch(menu, cmd, None, 'nested')\n"
+            ),
+            "build/all.sh": "echo built\n",
+            "deploy/go.sh": "echo go\n",
+            "deploy/config.json": {"cmds": [{"name": "go", "orig_name": "go", "depends_on": ["../build/all"]}]},
+        },
+    )
+
+
+def steps(path):
+    return [json.loads(line)["steps"] for line in path.read_text().splitlines()]
+
+
+def test_handler_calling_fn_itself_is_recorded(tmp_path):
+    pkg, log, cmd_root = macro_tree(tmp_path)
+    menu = cmd_tree_builder(cmd_root)[0].lookup(pkg)
+
+    @cli(menu)
+    def handler(out):
+        return out.chosen.fn("direct")
+
+    with record(tmp_path / "macros.jsonl", "direct"):
+        handler(out=COutput(skips=["say"]))
+    assert log.read_text() == "direct\n"
+    assert steps(tmp_path / "macros.jsonl") == [[{"paths": [f"{pkg}/say"], "args": [], "kwargs": {}}]]
+
+
+def test_out_run_gives_the_choice_its_args(tmp_path):
+    pkg, log, cmd_root = macro_tree(tmp_path)
+    menu = cmd_tree_builder(cmd_root)[0].lookup(pkg)
+
+    @cli(menu)
+    def handler(out):
+        out.run("first")
+        out.run("second")
+
+    with record(tmp_path / "macros.jsonl"):
+        handler(out=COutput(skips=["say"]))
+    assert [s["args"] for s in steps(tmp_path / "macros.jsonl")[0]] == [["first"], ["second"]]
+
+
+def test_only_the_outermost_dispatch_is_a_step(tmp_path):
+    pkg, log, cmd_root = macro_tree(tmp_path)
+    root = cmd_tree_builder(cmd_root)[0]
+    menu = root.lookup(pkg)
+    go = root.lookup("deploy/go")
+    go.fn.state_dir = tmp_path / "state"
+
+    with record(tmp_path / "macros.jsonl"):
+        dispatch(menu, menu.find_command("both"), None, menu, menu.find_command("say"))
+        assert dispatch(root.lookup("deploy"), go).returncode == 0
+    assert log.read_text() == "nested\n"
+    assert [s["paths"] for s in steps(tmp_path / "macros.jsonl")[0]] == [[f"{pkg}/both"], ["deploy/go"]]
+
+
+def test_recorded_session_replays(tmp_path):
+    pkg, log, cmd_root = macro_tree(tmp_path)
+    root = cmd_tree_builder(cmd_root)[0]
+    menu = root.lookup(pkg)
+    with record(tmp_path / "macros.jsonl", "session"):
+        dispatch(menu, menu.find_command("say"), None, "one")
+        dispatch(menu, menu.find_command("say"), None, word="two")
+
+    assert len(read_macros(tmp_path / "macros.jsonl")) == 1
+
+    with record(tmp_path / "again.jsonl"):
+        (macro,) = replay(root, tmp_path / "macros.jsonl")
+    assert macro.ok and [s.status for s in macro.steps] == ["done", "done"]
+    assert log.read_text() == "one\ntwo\none\ntwo\n"
+    # Replaying records nothing
+    assert not (tmp_path / "again.jsonl").exists()
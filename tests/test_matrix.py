@@ -0,0 +1,83 @@
+from functools import partial
+
+from cmddir import cmd_tree_builder
+from cmddir.cache import CachedScript, ResultCache
+from cmddir.matrix import Matrix, load_arg_sets
+from cmddir.validate import validate
+
+from conftest import make_tree
+
+SCRIPT = """\
+from pathlib import Path
+
+def main(name):
+    with open(Path(__file__).parent / "calls", "a") as f:
+        f.write(name + "\\n")
+    return name.upper()
+"""
+
+
+def test_process_matrix_serves_cached_items(tmp_path):
+    cmd_root = make_tree(tmp_path / "mx", {"mx_fan/fan.py": SCRIPT})
+    fan = cmd_tree_builder(cmd_root)[0].lookup("mx_fan/fan")
+    cache = ResultCache(tmp_path / "results")
+    matrix = Matrix(fan.fn, [["a"], ["b"]], mode="process", workers=2, wrap=partial(CachedScript, cache=cache))
+    calls = cmd_root / "mx_fan" / "calls"
+
+    first = matrix()
+    assert [i.output for i in first.items] == ["A", "B"]
+    assert first.returncode == 0
+    assert sorted(calls.read_text().split()) == ["a", "b"]
+
+    second = matrix()
+    assert [i.output for i in second.items] == ["A", "B"]
+    # Served from the disk tier, the script did not run again
+    assert sorted(calls.read_text().split()) == ["a", "b"]
+
+
+def test_matrix_reports_an_unpicklable_item(tmp_path):
+    cmd_root = make_tree(tmp_path / "mx_bad", {"mx_bad_fan/fan.py": SCRIPT})
+    fan = cmd_tree_builder(cmd_root)[0].lookup("mx_bad_fan/fan")
+    matrix = Matrix(fan.fn, [[lambda: None]], mode="process", workers=1)
+
+    out = matrix()
+    assert out.returncode != 0
+    assert out.items[0].error
+
+
+ECHO = 'echo "$@"\nexit ${2:-0}\n'
+
+
+def test_json_args_next_to_the_command_are_data(tmp_path):
+    cmd_root = make_tree(
+        tmp_path / "mx_json",
+        {
+            "hosts/ping.sh": ECHO,
+            "hosts/hosts.json": [["a"], ["b"], {"c": 1}],
+            "hosts/config.json": {"cmds": [{"name": "ping", "orig_name": "ping", "matrix": "hosts.json"}]},
+        },
+    )
+    hosts = cmd_tree_builder(cmd_root)[0].lookup("hosts").load()
+    assert [c.name for c in hosts.cmds] == ["ping"]
+    out = hosts.find_command("ping").fn()
+    assert [i.output.stdout for i in out.items] == ["a\n", "b\n", "\n"]
+    assert [c.path for c in validate(cmd_root) if c.path.endswith(".json")] == [str(cmd_root / "hosts/config.json")]
+    assert not [c for c in validate(cmd_root, [cmd_root / "hosts/hosts.json"]) if c.error]
+
+
+def test_failures_are_per_item_and_fail_fast_stops_scheduling(tmp_path):
+    cmd_root = make_tree(tmp_path / "mx_fail", {"run.sh": ECHO})
+    run = cmd_tree_builder(cmd_root)[0].lookup("run")
+    out = Matrix(run.fn, ["a 0", "b 3", "c 0"], workers=1, on_item=lambda *_: None)()
+    assert [i.returncode for i in out.items] == [0, 3, 0]
+    assert out.returncode == 3
+
+    out = Matrix(run.fn, ["a 3", "b 0", "c 0"], workers=1, fail_fast=True, on_item=lambda *_: None)()
+    # Nothing after the failure was scheduled
+    assert [i.returncode for i in out.items] == [3]
+
+
+def test_args_file_skips_blank_lines_and_comments(tmp_path):
+    args = tmp_path / "hosts.txt"
+    args.write_text("# hosts\none 'two words'\n\nthree\n")
+    assert load_arg_sets(args) == [(["one", "two words"], {}), (["three"], {})]
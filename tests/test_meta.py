@@ -0,0 +1,69 @@
+from cmddir import cmd_tree_builder
+from cmddir.meta import HEADER_BYTES, py_meta, read_all_meta, read_meta, sh_meta
+
+from conftest import make_tree
+
+PY = '''\
+"""Show disk usage
+
+More than the first line
+"""
+__cmddir__ = {"shortcuts": ["u"], "aliases": ["usage"], "bogus": 1}
+
+
+def main():
+    raise SystemExit("never imported")
+'''
+
+SH = """\
+#!/bin/bash
+# cmddir: desc=Show disk usage
+# cmddir: shortcuts=u, d
+echo hi
+# cmddir: desc=too late
+"""
+
+
+def test_py_header_is_read_without_importing(tmp_path):
+    meta = read_meta(make_tree(tmp_path, {"du.py": PY}) / "du.py")
+    assert meta.desc == "Show disk usage"
+    assert meta.config == {"shortcuts": ["u"], "aliases": ["usage"], "bogus": 1}
+    assert meta.has_main is True
+    assert meta.unknown_keys() == ["bogus"]
+    cmd = meta.command()
+    assert cmd.shortcuts == ["u"] and cmd.aliases == ["usage"]
+
+
+def test_truncated_py_header_still_gives_desc_and_config():
+    header = (PY + "#" * HEADER_BYTES).encode()[:HEADER_BYTES]
+    meta = py_meta(header, complete=False)
+    assert meta.desc == "Show disk usage"
+    assert meta.config["aliases"] == ["usage"]
+    assert meta.has_main is None
+
+
+def test_has_main_hints():
+    assert py_meta(b"x = 1\n", complete=True).has_main is False
+    assert py_meta(b"from os import *\n", complete=True).has_main is None
+    assert py_meta(b"try:\n    from a import main\nexcept ImportError:\n    pass\n", complete=True).has_main
+
+
+def test_sh_header_stops_at_the_first_command():
+    meta = sh_meta(SH)
+    assert meta.desc == "Show disk usage"
+    assert meta.config == {"shortcuts": ["u", "d"]}
+
+
+def test_all_meta_keeps_the_order(tmp_path):
+    root = make_tree(tmp_path, {"a.sh": SH, "b.txt": "", "c.py": PY})
+    metas = read_all_meta([root / "a.sh", root / "b.txt", root / "c.py"])
+    assert metas[0].config == {"shortcuts": ["u", "d"]}
+    assert metas[1] is None
+    assert metas[2].config["aliases"] == ["usage"]
+
+
+def test_menu_takes_the_metadata(tmp_path, capsys):
+    cmd_root = make_tree(tmp_path / "meta", {f"{tmp_path.name}/du.py": PY})
+    cmd = cmd_tree_builder(cmd_root)[0].lookup(f"{tmp_path.name}/du")
+    assert cmd.desc == "Show disk usage" and "u" in cmd.shortcuts
+    assert "bogus" in capsys.readouterr().out
@@ -0,0 +1,50 @@
+from cmddir import cmd_tree_builder
+from cmddir.pipeline import Pipeline, PipelineError
+
+import pytest
+
+from conftest import make_tree
+
+
+def pipe_tree(root):
+    return make_tree(
+        root,
+        {
+            "pipe_steps/words.sh": "printf 'b\\na\\nc\\n'\n",
+            "pipe_steps/sorted.sh": "sort\n",
+            "pipe_steps/upper.py": "def main(stdin):\n    for line in stdin:\n        yield line.strip().upper()\n",
+            "pipe_steps/count.py": "def main(stdin):\n    return [str(len(list(stdin)))]\n",
+            "pipe_steps/config.json": {"pipelines": {"shout": ["words", "sorted", "upper"]}},
+        },
+    )
+
+
+def test_bash_into_bash_into_python_streams_lines(tmp_path):
+    steps = cmd_tree_builder(pipe_tree(tmp_path / "pipe"))[0].lookup("pipe_steps")
+    pipeline = Pipeline.from_tree(steps, ["words", "sorted", "upper"])
+    assert list(pipeline.stream()) == ["A", "B", "C"]
+    assert pipeline.returncodes == [0, 0]
+
+
+def test_python_into_bash_and_python_into_python(tmp_path):
+    steps = cmd_tree_builder(pipe_tree(tmp_path / "pipe"))[0].lookup("pipe_steps")
+    upper_sorted = Pipeline.from_tree(steps, ["words", "upper", "sorted"])
+    assert [l.strip() for l in upper_sorted.stream()] == ["A", "B", "C"]
+    counted = Pipeline.from_tree(steps, ["words", "upper", "count"])
+    assert list(counted.stream()) == ["3"]
+
+
+def test_config_pipelines_become_commands(tmp_path, capsys):
+    steps = cmd_tree_builder(pipe_tree(tmp_path / "pipe"))[0].lookup("pipe_steps")
+    shout = steps.find_command("shout")
+    assert shout is not None
+    assert shout.fn() == [0, 0]
+    assert capsys.readouterr().out == "A\nB\nC\n"
+
+
+def test_unknown_step_is_rejected(tmp_path):
+    steps = cmd_tree_builder(pipe_tree(tmp_path / "pipe"))[0].lookup("pipe_steps")
+    with pytest.raises(PipelineError):
+        Pipeline.from_tree(steps, ["words", "missing"])
+    with pytest.raises(PipelineError):
+        Pipeline([])
@@ -0,0 +1,72 @@
+import json
+import sys
+import time
+
+from cmddir import cmd_tree_builder
+from cmddir.cache import CachedScript, ResultCache
+from cmddir.dag import Dag
+from cmddir.preimport import Preimporter
+from cmddir.types import BashScript, PythonScript, script_of, script_path
+
+from conftest import make_tree
+
+OPTED = '__cmddir__ = {"preimport": True}\n\ndef main():\n    return 1\n'
+PLAIN = "def main():\n    return 1\n"
+
+
+def menu_of(tmp_path):
+    name = tmp_path.name
+    files = {f"{name}/{n}.py": OPTED for n in ["a", "b", "c"]}
+    files[f"{name}/plain.py"] = PLAIN
+    return cmd_tree_builder(make_tree(tmp_path / "pre", files))[0].lookup(name).load()
+
+
+def wait_for(check, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not check() and time.monotonic() < end:
+        time.sleep(0.01)
+    return check()
+
+
+def test_highlighted_then_most_used_opted_in(tmp_path, monkeypatch):
+    menu = menu_of(tmp_path)
+    prefix = "/".join(menu.tree_path())
+    log = tmp_path / "traces.jsonl"
+    names = ["c", "c", "b", "plain", "plain", "plain"]
+    log.write_text("".join(json.dumps({"name": f"{prefix}/{n}"}) + "\n" for n in names))
+    monkeypatch.setenv("CMDDIR_TRACE_LOG", str(log))
+    a, b, c, plain = menu.cmds
+    scripts = Preimporter(top=2).candidates(menu, a)
+    assert scripts == [a.fn, c.fn, b.fn]
+    assert Preimporter().candidates(menu, plain) == [c.fn, b.fn]
+
+
+def test_warm_imports_in_the_background(tmp_path, monkeypatch):
+    monkeypatch.delenv("CMDDIR_TRACE_LOG", raising=False)
+    menu = menu_of(tmp_path)
+    a, _, _, plain = menu.cmds
+    preimporter = Preimporter()
+    preimporter.warm(menu, a)
+    assert wait_for(lambda: a.fn._fn is not None)
+    preimporter.warm(menu, plain)
+    time.sleep(0.05)
+    assert plain.fn._fn is None and plain.fn.module_path not in sys.modules
+
+
+def test_nothing_past_the_budget(tmp_path, monkeypatch):
+    monkeypatch.delenv("CMDDIR_TRACE_LOG", raising=False)
+    menu = menu_of(tmp_path)
+    Preimporter(budget=0).warm(menu, menu.cmds[0])
+    time.sleep(0.05)
+    assert menu.cmds[0].fn._fn is None
+
+
+def test_script_of_unwraps(tmp_path):
+    menu = menu_of(tmp_path)
+    script = menu.cmds[0].fn
+    cached = CachedScript(script, cache=ResultCache(tmp_path / "results"))
+    assert isinstance(script, PythonScript) and script_of(cached) is script
+    assert script_path(cached) == str(tmp_path / "pre" / tmp_path.name / "a.py")
+    sh = BashScript(make_tree(tmp_path, {"s.sh": "echo\n"}) / "s.sh")
+    assert script_of(sh) is sh
+    assert script_of(Dag.__new__(Dag)) is None and script_path(None) is None
@@ -0,0 +1,65 @@
+import sys
+
+import pytest
+
+from cmddir import cmd_tree_builder, residency
+from cmddir.residency import Residency
+
+from conftest import make_tree
+
+COUNTER = """\
+calls = 0
+
+def main():
+    global calls
+    calls += 1
+    return calls
+"""
+
+
+@pytest.fixture
+def one_module(monkeypatch):
+    resident = Residency(max_modules=1)
+    monkeypatch.setattr(residency, "_residency", resident)
+    return resident
+
+
+def scripts(tmp_path):
+    name = tmp_path.name
+    files = {
+        f"{name}/a.py": f"from {name}.helper import value\n\n" + COUNTER,
+        f"{name}/b.py": COUNTER,
+        f"{name}/helper.py": "value = 1\n\ndef main():\n    return value\n",
+    }
+    menu = cmd_tree_builder(make_tree(tmp_path / "res", files))[0].lookup(name).load()
+    return name, menu.find_command("a").fn, menu.find_command("b").fn
+
+
+def test_least_recently_used_is_unloaded(tmp_path, one_module):
+    name, a, b = scripts(tmp_path)
+    assert a() == 1 and a() == 2
+    assert f"{name}.helper" in one_module.residents[f"{name}.a"].modules
+    assert b() == 1
+    assert list(one_module.residents) == [f"{name}.b"]
+    assert a._fn is None
+    assert f"{name}.a" not in sys.modules and f"{name}.helper" not in sys.modules
+    # The package stays, b is still imported from it
+    assert name in sys.modules and f"{name}.b" in sys.modules
+
+
+def test_unloaded_script_is_imported_afresh(tmp_path, one_module):
+    _, a, b = scripts(tmp_path)
+    a()
+    a()
+    b()
+    assert a() == 1
+    assert b._fn is None
+
+
+def test_no_limit_keeps_everything(tmp_path, monkeypatch):
+    monkeypatch.setattr(residency, "_residency", Residency())
+    name, a, b = scripts(tmp_path)
+    a()
+    b()
+    assert a._fn is not None and b._fn is not None
+    assert {f"{name}.a", f"{name}.b"} <= set(residency.residency().residents)
@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from cmddir import cmd_tree_builder
+from cmddir.runners import MakeRunner, RunnerError, acall, call, make_targets
+
+from conftest import make_tree
+
+MAKEFILE = """\
+.PHONY: build test
+VERSION := 1
+build:
+\t@echo building $(VERSION)
+test: build
+\t@echo testing
+%.o: %.c
+\t@echo never
+"""
+
+
+def test_targets_of_a_makefile(tmp_path):
+    cmd_root = make_tree(tmp_path / "make", {"proj/Makefile": MAKEFILE})
+    assert make_targets(cmd_root / "proj" / "Makefile") == ["build", "test"]
+    proj = cmd_tree_builder(cmd_root)[0].lookup("proj")
+    assert call(proj.lookup("build")).stdout == "building 1\n"
+    assert call(proj.lookup("test")).stdout == "building 1\ntesting\n"
+
+
+def test_runtime_args_of_shell_scripts(tmp_path):
+    cmd_root = make_tree(tmp_path / "args", {"proj/Makefile": MAKEFILE, "proj/echo.sh": 'echo "$@"\n'})
+    proj = cmd_tree_builder(cmd_root)[0].lookup("proj")
+    echo = proj.lookup("echo")
+    assert call(echo, "a", 1).stdout == "a 1\n"
+    assert call(echo).stdout == "\n"
+    assert call(proj.lookup("build"), "VERSION=2").stdout == "building 2\n"
+    # Appended to the args it is bound to
+    assert echo.fn.with_args("bound")("more").stdout == "bound more\n"
+    assert asyncio.run(acall(echo, "x")).stdout == "x\n"
+
+
+def test_persistent_make_is_rejected(tmp_path):
+    makefile = make_tree(tmp_path / "persistent", {"Makefile": MAKEFILE}) / "Makefile"
+    with pytest.raises(RunnerError, match="Makefile"):
+        MakeRunner(executor="persistent").commands(makefile, [])
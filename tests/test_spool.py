@@ -0,0 +1,60 @@
+import pickle
+
+from cmddir import cmd_tree_builder
+from cmddir.spool import SpooledOutput, utils
+from cmddir.types import BashOut
+
+from conftest import make_tree
+
+LINES = b"".join(f"line {i}\n".encode() for i in range(100))
+
+
+def spooled(max_size: int) -> SpooledOutput:
+    out = SpooledOutput(max_size)
+    for i in range(0, len(LINES), 7):
+        out.write(LINES[i : i + 7])
+    return out
+
+
+def test_spills_past_the_threshold():
+    assert not spooled(len(LINES)).spilled
+    out = spooled(64)
+    assert out.spilled and not out.memory
+    assert out.size == len(LINES) and out == LINES.decode()
+
+
+def test_lines_tail_and_search_in_memory_and_spilled():
+    for out in [spooled(len(LINES)), spooled(64)]:
+        lines = list(out.lines())
+        assert len(lines) == 100 and lines[42] == "line 42"
+        assert out.line(99) == "line 99"
+        assert out.tail(2) == ["line 98", "line 99"]
+        assert [line for _, line in out.search(r"line 9\d")] == [f"line 9{i}" for i in range(10)]
+        assert "line 7" in out
+
+
+def test_survives_a_pickle():
+    out = pickle.loads(pickle.dumps(spooled(64)))
+    assert out == LINES.decode() and out.spilled
+
+
+def test_page_only_reads_the_visible_lines(monkeypatch):
+    written = []
+    keys = iter(["j", " ", "G", "q"])
+    monkeypatch.setattr(utils, "forceWrite", written.append)
+    monkeypatch.setattr(utils, "getchar", lambda: next(keys))
+    spooled(64).page(height=10)
+    screens = "".join(written).split("\033[2J\033[H")[1:]
+    assert screens[0].startswith("line 0\n") and "line 10\n" not in screens[0]
+    assert screens[1].startswith("line 1\n")
+    assert screens[2].startswith("line 11\n")
+    assert screens[3].startswith("line 90\n") and "-- 100% --" in screens[3]
+
+
+def test_bash_out_decodes_on_first_read(tmp_path):
+    cmd_root = make_tree(tmp_path / "spool", {"out.sh": "seq 3; echo oops >&2\n"})
+    o = cmd_tree_builder(cmd_root)[0].lookup("out").fn()
+    assert isinstance(o, BashOut) and o._stdout is None
+    assert o.stdout == "1\n2\n3\n" and o.stderr == "oops\n"
+    assert list(o.stdout_spool.lines()) == ["1", "2", "3"]
+    assert pickle.loads(pickle.dumps(o)).stdout == "1\n2\n3\n"
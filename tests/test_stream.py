@@ -0,0 +1,56 @@
+import io
+import json
+import time
+
+from cmddir import cmd_tree_builder
+from cmddir.stream import export_ndjson, iter_tree
+
+from conftest import make_tree
+
+TREE = {
+    "top.sh": "echo top\n",
+    "b/two.sh": "echo two\n",
+    "a/one.sh": "echo one\n",
+    "a/.env": "REGION=eu\n",
+    "a/deep/three.sh": "echo three\n",
+}
+
+
+def test_yields_bfs_and_links_as_it_goes(tmp_path):
+    menus = iter_tree(make_tree(tmp_path / "stream", TREE))
+    root = next(menus)
+    assert root.name == "stream" and root.children == []
+    a = next(menus)
+    assert a.name == "a" and a.parent is root and root.children == [a]
+    rest = list(menus)
+    assert [m.name for m in rest] == ["b", "deep"]
+    assert [m.level for m in [root, a, *rest]] == [1, 2, 2, 3]
+    assert rest[1].parent is a and rest[1].env == {"REGION": "eu"}
+
+
+def test_unlinked_still_hands_down_env(tmp_path):
+    menus = list(iter_tree(make_tree(tmp_path / "stream", TREE), link=False))
+    assert all(m.parent is None and m.children == [] for m in menus)
+    assert menus[-1].name == "deep" and menus[-1].env == {"REGION": "eu"}
+
+
+def test_ndjson_export(tmp_path):
+    cmd_root = make_tree(tmp_path / "stream", TREE)
+    out = io.StringIO()
+    assert export_ndjson(cmd_root, out) == 4
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r["path"] for r in records] == ["", "a", "b", "a/deep"]
+    assert records[0]["dirs"] == ["a", "b"]
+    assert records[3]["cmds"][0]["name"] == "three"
+    assert records[3]["cmds"][0]["file"] == str(cmd_root / "a" / "deep" / "three.sh")
+
+
+def test_builder_returns_the_root_first(tmp_path):
+    tree = cmd_tree_builder(make_tree(tmp_path / "stream", TREE), stream=True)
+    assert len(tree) == 1
+    root = tree[0]
+    end = time.monotonic() + 5
+    while len(root.children) < 2 or not root.children[0].children:
+        assert time.monotonic() < end
+        time.sleep(0.01)
+    assert root.lookup("a/deep/three").name == "three"
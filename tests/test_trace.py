@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from cmddir import cmd_tree_builder
+from cmddir.cmds import COutput, Command, dispatch
+from cmddir.trace import percentile, trace_report
+
+from conftest import make_tree
+
+
+def test_dispatch_records_a_trace(tmp_path, monkeypatch):
+    monkeypatch.setenv("CMDDIR_TRACE_LOG", str(tmp_path / "traces.jsonl"))
+    cmd_root = make_tree(tmp_path / "trace", {"sub/fail.sh": "echo 12345; exit 2\n"})
+    root = cmd_tree_builder(cmd_root)[0]
+    sub = root.lookup("sub").load()
+    out = COutput(menu=sub)
+    dispatch(sub, sub.find_command("fail"), out)
+    (trace,) = out.traces
+    assert trace.name == "trace/sub/fail"
+    assert trace.returncode == 2 and trace.output_size == 6
+    assert trace.max_rss_scope == "command" and trace.wall > 0
+    (logged,) = [json.loads(line) for line in open(tmp_path / "traces.jsonl")]
+    assert logged["name"] == "trace/sub/fail" and logged["returncode"] == 2
+
+
+def test_errors_and_interrupts_are_failures():
+    def interrupted():
+        raise KeyboardInterrupt
+
+    def broken():
+        raise ValueError("bad")
+
+    out = COutput()
+    for fn in [interrupted, broken]:
+        with pytest.raises((KeyboardInterrupt, ValueError)):
+            dispatch(None, Command(name=fn.__name__, fn=fn), out)
+    assert [(t.returncode, t.error) for t in out.traces] == [(130, "KeyboardInterrupt"), (1, "ValueError: bad")]
+    assert out.traces[0].max_rss_scope == "process"
+
+
+def test_report_per_command(tmp_path):
+    log = tmp_path / "traces.jsonl"
+    rows = [
+        {"name": "a", "wall": w, "cpu_user": 0.1, "cpu_sys": 0.1, "max_rss": 10, "returncode": 0,
+         "error": None, "output_size": 4, "max_rss_scope": "command"}
+        for w in [1, 2, 3, 4]
+    ]
+    rows.append({**rows[0], "name": "b", "returncode": 1, "max_rss_scope": "process"})
+    log.write_text("".join(json.dumps(r) + "\n" for r in rows))
+    report = trace_report(log)
+    assert report["a"]["count"] == 4 and report["a"]["p50"] == 2 and report["a"]["p95"] == 4
+    assert not report["a"]["rss_process"] and report["a"]["failed"] == 0
+    assert report["b"]["failed"] == 1 and report["b"]["rss_process"]
+
+
+def test_percentile():
+    assert percentile([], 50) == 0.0
+    assert percentile([5, 1, 3], 50) == 3
+    assert percentile(list(range(1, 101)), 95) == 95
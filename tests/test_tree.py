@@ -0,0 +1,71 @@
+import os
+
+from cmddir.tree import FlatTree
+
+from conftest import make_tree
+
+TREE = {
+    "top.sh": "echo top\n",
+    "b/two.sh": "echo two\n",
+    "a/one.sh": "echo one\n",
+    "a/deep/three.sh": "echo three\n",
+}
+
+
+def test_bfs_order_and_names(tmp_path):
+    tree = FlatTree.build(make_tree(tmp_path / "flat", TREE))
+    assert [tree.name(n) for n in range(len(tree))] == ["flat", "a", "b", "deep"]
+    assert list(tree.depth) == [0, 1, 1, 2]
+    assert all(tree.parents[n] < n for n in range(1, len(tree)))
+    assert list(tree.children(0)) == [1, 2]
+    assert list(tree.files(1)) == ["one.sh"]
+    assert tree.parts(3) == ["a", "deep"]
+
+
+def test_menus_are_created_on_demand(tmp_path):
+    tree = FlatTree.build(make_tree(tmp_path / "flat", TREE))
+    menus = tree.menus()
+    assert len(menus) == 4 and not tree.views
+    root = menus[0]
+    assert [c.name for c in root.children] == ["a", "b"]
+    assert all(c.loader for c in root.children)
+    deep = menus[-1]
+    assert [c.name for c in deep.cmds] == ["three"]
+    assert deep.parent is root.children[0] and deep.parent.loader is None
+    assert [m.level for m in menus] == [1, 2, 2, 3]
+
+
+def test_nested_dir_named_like_the_root(tmp_path):
+    cmd_root = make_tree(tmp_path / "proj", {"proj/inner.sh": "echo inner\n"})
+    menus = FlatTree.build(cmd_root).menus()
+    assert menus[0].lookup("proj/inner").name == "inner"
+
+
+def test_cached_tree_is_reused_until_the_tree_changes(tmp_path, monkeypatch):
+    cmd_root = make_tree(tmp_path / "flat", TREE)
+    builds = []
+    build = FlatTree.build
+    monkeypatch.setattr(FlatTree, "build", lambda *a: builds.append(1) or build(*a))
+    cache_dir = tmp_path / "trees"
+    FlatTree.cached(cmd_root, cache_dir)
+    FlatTree.cached(cmd_root, cache_dir)
+    assert len(builds) == 1
+    (cache_file,) = cache_dir.iterdir()
+    assert oct(os.stat(cache_file).st_mode & 0o777) == oct(0o600)
+    assert oct(os.stat(cache_dir).st_mode & 0o777) == oct(0o700)
+    (cmd_root / "b" / "more.sh").write_text("echo more\n")
+    assert "more.sh" in FlatTree.cached(cmd_root, cache_dir).files(2)
+    assert len(builds) == 2
+
+
+def test_cache_writable_by_others_is_not_loaded(tmp_path, monkeypatch):
+    cmd_root = make_tree(tmp_path / "flat", TREE)
+    cache_dir = tmp_path / "trees"
+    FlatTree.cached(cmd_root, cache_dir)
+    (cache_file,) = cache_dir.iterdir()
+    cache_file.chmod(0o666)
+    builds = []
+    build = FlatTree.build
+    monkeypatch.setattr(FlatTree, "build", lambda *a: builds.append(1) or build(*a))
+    FlatTree.cached(cmd_root, cache_dir)
+    assert builds == [1]
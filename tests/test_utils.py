@@ -0,0 +1,71 @@
+import io
+import os
+import re
+
+from cmddir import utils
+from cmddir.utils import notify_d, notify_kv
+
+ANSI = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def plain(text: str) -> str:
+    return ANSI.sub("", text)
+
+
+def test_nested_dicts_are_indented():
+    text = plain(notify_d({"a": 1, "b": {"c": 2, "d": {"e": 3}}, "f": 4}, no_print=True))
+    assert text == "a: 1\nb:\n  c: 2\n  d:\n    e: 3\nf: 4\n"
+
+
+def test_limits():
+    d = {"keys": {str(i): i for i in range(10)}, "deep": {"x": {"y": 1}}, "long": "x" * 50, "list": list(range(10))}
+    text = plain(notify_d(d, no_print=True, max_depth=1, max_width=10, max_items=3))
+    assert text.splitlines() == [
+        "keys:",
+        "  0: 0",
+        "  1: 1",
+        "  2: 2",
+        "  … 7 more",
+        "deep:",
+        "  x: {… 1 keys}",
+        "long: xxxxxxxxx…",
+        "… 1 more",
+    ]
+    assert plain(notify_d({"list": list(range(10))}, no_print=True, max_items=3)) == "list: [0, 1, 2, …]\n"
+    assert plain(notify_kv("k", "x" * 50, no_print=True, max_width=5)) == "k: xxxx…"
+
+
+def test_deep_nesting_does_not_recurse():
+    d = leaf = {}
+    for _ in range(5000):
+        leaf["k"] = {}
+        leaf = leaf["k"]
+    leaf["k"] = "bottom"
+    lines = plain(notify_d(d, no_print=True)).splitlines()
+    assert len(lines) == 5001 and lines[-1].strip() == "k: bottom"
+
+
+def test_lines_are_written_in_batches(monkeypatch):
+    monkeypatch.setattr(utils, "WRITE_CHUNK", 100)
+
+    class Counting(io.StringIO):
+        writes = 0
+
+        def write(self, s):
+            self.writes += 1
+            return super().write(s)
+
+    out = Counting()
+    notify_d({str(i): "v" * 10 for i in range(1000)}, out=out)
+    assert plain(out.getvalue()).split("\n")[1:-2] == [f"{i}: vvvvvvvvvv" for i in range(1000)] + [""]
+    assert 50 < out.writes < 1000
+
+
+def test_to_file_has_everything_uncolored(capsys):
+    path = notify_d({"a": {"b": 1}, "c": "x" * 500}, to_file=True, max_width=5)
+    try:
+        with open(path) as f:
+            assert f.read() == "a:\n  b: 1\nc: " + "x" * 500 + "\n"
+        assert f"3 keys written to {path}" in capsys.readouterr().out
+    finally:
+        os.unlink(path)
@@ -0,0 +1,58 @@
+import shutil
+
+import pytest
+
+from cmddir import validate as validate_module
+from cmddir.validate import print_validation, validate
+
+from conftest import make_tree
+
+TREE = {
+    "good.sh": "echo ok\n",
+    "bad.sh": "if then\n",
+    "nomain.py": "x = 1\n",
+    "broken.py": "def main(:\n",
+    "fine.py": "def main():\n    return 1\n",
+    "zed.zsh": "echo ok\n",
+    "sub/config.json": {"name": "sub", "cmds": [{"name": "missing", "orig_name": "missing"}]},
+    "sub/data.json": "not json at all",
+    "sub/meta.sh": "# cmddir: bogus=1\necho\n",
+}
+
+
+def by_name(checks):
+    return {c.path.rsplit("/", 1)[-1]: c for c in checks}
+
+
+def test_every_kind_of_file_is_checked(tmp_path):
+    checks = by_name(validate(make_tree(tmp_path, TREE)))
+    assert "data.json" not in checks
+    assert checks["good.sh"].error is None and checks["fine.py"].error is None
+    assert checks["bad.sh"].error
+    assert checks["nomain.py"].error == "no main function"
+    assert checks["broken.py"].error.startswith("line 1:")
+    assert checks["config.json"].error == "orig_name not found: missing"
+    assert checks["meta.sh"].error == "metadata: unknown key(s) bogus"
+
+
+def test_zsh_is_skipped_without_zsh(tmp_path, monkeypatch, capsys):
+    which = shutil.which
+    monkeypatch.setattr(validate_module.shutil, "which", lambda cmd: None if cmd == "zsh" else which(cmd))
+    cmd_root = make_tree(tmp_path, TREE)
+    check = by_name(validate(cmd_root))["zed.zsh"]
+    assert check.error is None and check.skipped == "zsh not found"
+    print_validation(cmd_root)
+    assert "1 skipped" in capsys.readouterr().out
+
+
+@pytest.mark.skipif(not shutil.which("zsh"), reason="zsh not installed")
+def test_zsh_is_checked_with_zsh(tmp_path):
+    checks = by_name(validate(make_tree(tmp_path, {"ok.zsh": "echo ok\n", "no.zsh": "if then\n"})))
+    assert checks["ok.zsh"].error is None and checks["ok.zsh"].skipped is None
+    assert checks["no.zsh"].error
+
+
+def test_only_given_paths(tmp_path):
+    cmd_root = make_tree(tmp_path, TREE)
+    checks = validate(cmd_root, [cmd_root / "bad.sh", cmd_root / "sub" / "data.json"])
+    assert [c.path for c in checks] == [str(cmd_root / "bad.sh")]
@@ -0,0 +1,76 @@
+import time
+
+from cmddir import cmd_tree_builder
+from cmddir.runners import call
+from cmddir.watch import TreeWatcher
+
+from conftest import make_tree
+
+
+def wait_for(check, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not check() and time.monotonic() < end:
+        time.sleep(0.02)
+    return check()
+
+
+def names(menu):
+    return sorted(c.name for c in menu.cmds)
+
+
+def watched(tmp_path, files):
+    cmd_root = make_tree(tmp_path / "watch", files)
+    tree = list(cmd_tree_builder(cmd_root))
+    return cmd_root, tree, TreeWatcher(tree, polling=True)
+
+
+def test_changed_directory_is_rebuilt_in_place(tmp_path):
+    cmd_root, tree, watcher = watched(tmp_path, {"top.sh": "echo\n", "sub/a.sh": "echo a\n"})
+    root, sub = tree
+    (cmd_root / "sub" / "b.sh").write_text("echo b\n")
+    (cmd_root / "new").mkdir()
+    (cmd_root / "new" / "c.sh").write_text("echo c\n")
+    watcher.apply({str(cmd_root), str(cmd_root / "sub")})
+    assert tree[2] is sub and names(sub) == ["a", "b"]
+    assert [m.name for m in tree] == ["watch", "new", "sub"]
+    assert names(tree[1]) == ["c"] and tree[1].parent is root
+    assert sub.parent is root
+
+
+def test_broken_config_keeps_the_old_menu(tmp_path, capsys):
+    cmd_root, tree, watcher = watched(tmp_path, {"sub/a.sh": "echo a\n"})
+    sub = tree[1]
+    (cmd_root / "sub" / "b.sh").write_text("echo b\n")
+    (cmd_root / "sub" / "config.json").write_text('{"cmds": [')
+    assert watcher.apply({str(cmd_root / "sub")}) == []
+    assert names(sub) == ["a"]
+    assert f"Couldn't reload {cmd_root / 'sub'}" in capsys.readouterr().out
+    (cmd_root / "sub" / "config.json").write_text('{"name": "sub", "cmds": []}')
+    assert watcher.apply({str(cmd_root / "sub")}) == [sub]
+    assert names(sub) == ["a", "b"]
+
+
+def test_watcher_keeps_running_past_a_failure(tmp_path):
+    cmd_root, tree, watcher = watched(tmp_path, {"sub/a.sh": "echo a\n"})
+    watcher.backend.interval = 0.02
+    watcher.debounce = 0.02
+    watcher.start()
+    try:
+        (cmd_root / "sub" / "config.json").write_text("{")
+        time.sleep(0.2)
+        (cmd_root / "sub" / "config.json").unlink()
+        (cmd_root / "sub" / "b.sh").write_text("echo b\n")
+        assert wait_for(lambda: names(tree[1]) == ["a", "b"])
+        assert watcher.thread.is_alive()
+    finally:
+        watcher.stop()
+
+
+def test_edited_script_is_imported_again(tmp_path):
+    pkg = tmp_path.name
+    cmd_root, tree, watcher = watched(tmp_path, {f"{pkg}/v.py": "def main():\n    return 1\n"})
+    menu = tree[1]
+    assert call(menu.find_command("v")) == 1
+    (cmd_root / pkg / "v.py").write_text("def main():\n    return 22\n")
+    watcher.apply({str(cmd_root / pkg)})
+    assert call(menu.find_command("v")) == 22
@@ -0,0 +1,60 @@
+from bullet import utils
+from bullet.charDef import ARROW_DOWN_KEY, END_KEY, NEWLINE_KEY, PG_DOWN_KEY, SPACE_CHAR
+
+from cmddir import cmd_tree_builder
+from cmddir.cmds import REFRESH_KEY
+from cmddir.window import WindowedMenu
+
+from conftest import make_tree
+
+
+def windowed(tmp_path, multi=False, count=50):
+    files = {f"win/cmd{i:02}.sh": "echo\n" for i in range(count)}
+    files["win/zap.sh"] = "echo\n"
+    menu = cmd_tree_builder(make_tree(tmp_path / "window", files))[0].lookup("win")
+    menu.load()
+    return WindowedMenu(menu, menu.max_align(), multi=multi, height=5)
+
+
+def test_only_the_viewport_is_drawn(tmp_path, capsys):
+    window = windowed(tmp_path)
+    window.move(0)
+    window.render()
+    # clearLine blanks each line and returns to its head with a \r
+    lines = [line.split("\r")[-1] for line in capsys.readouterr().out.split("\n")[:-1]]
+    assert len(lines) == 6
+    assert "cmd00" in lines[0] and "cmd04" in lines[4] and "cmd05" not in "".join(lines)
+    assert lines[-1].strip() == "-- 1/51 --"
+
+
+def test_moving_scrolls_the_window(tmp_path):
+    window = windowed(tmp_path)
+    for _ in range(6):
+        window.handle(ARROW_DOWN_KEY)
+    assert (window.pos, window.top) == (6, 2)
+    window.handle(PG_DOWN_KEY)
+    assert (window.pos, window.top) == (11, 7)
+    window.handle("k")
+    assert (window.pos, window.top) == (10, 7)
+    window.handle(END_KEY)
+    assert (window.pos, window.top) == (50, 46)
+    window.handle(ARROW_DOWN_KEY)
+    assert window.pos == 50
+
+
+def test_enter_shortcut_and_modifier_choose(tmp_path):
+    window = windowed(tmp_path)
+    window.handle("j")
+    assert window.handle(NEWLINE_KEY).name == "cmd01"
+    zap = window.menu.find_command("zap")
+    assert window.handle(zap.shortcuts[0]) is zap
+    assert window.pos == 50
+    assert window.handle(REFRESH_KEY) is zap and window.menu.modifier == REFRESH_KEY
+
+
+def test_multi_checks_and_returns_in_order(tmp_path, monkeypatch, capsys):
+    window = windowed(tmp_path, multi=True)
+    keys = iter([SPACE_CHAR, END_KEY, SPACE_CHAR, "k", NEWLINE_KEY])
+    monkeypatch.setattr(utils, "getchar", lambda: next(keys))
+    assert [c.name for c in window.launch()] == ["cmd00", "zap"]
+    assert "2 checked" in capsys.readouterr().out